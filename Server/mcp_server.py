@@ -1,15 +1,20 @@
 # mcp_gmail_server.py
 import base64
 import os
+import tempfile
+import threading
 from email.mime.text import MIMEText
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from fastmcp import FastMCP
 
+import google_auth_httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.exceptions import GoogleAuthError
 from google.auth.transport.requests import Request
 
 
@@ -25,21 +30,82 @@ BASE_DIR = Path(__file__).resolve().parent
 CREDENTIALS_PATH = BASE_DIR / "credentials.json"
 TOKEN_PATH = BASE_DIR / "token.json"
 
+# Token refresh / OAuth failures from get_gmail_service, reported per id
+# by the batch tools like any other failure
+SERVICE_ERRORS = (HttpError, GoogleAuthError, OSError)
+
+# Gmail allows 100 calls per batch request but recommends <= 50 to
+# stay clear of per-user rate limits; batchModify takes up to 1000 IDs.
+BATCH_GET_LIMIT = 50
+BATCH_MODIFY_LIMIT = 1000
+
+# Labels under this prefix are created on demand by the label registry
+AUTO_CREATE_LABEL_PREFIX = "AI/"
+
+# Headers passed through to the client's rule-based pre-classifier
+TRIAGE_HEADERS = ("List-Unsubscribe", "List-Id", "Precedence", "Auto-Submitted")
+
+# Refresh the access token this long before it actually expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
 # ---------------------------------------------------------
 #  GMAIL AUTH HANDLER  (OAuth)
 # ---------------------------------------------------------
-def get_gmail_service():
+_auth_lock = threading.Lock()
+_creds: Credentials | None = None
+# googleapiclient services sit on httplib2, which is not thread-safe,
+# so each worker thread keeps its own service (and HTTP connection).
+_local = threading.local()
+_service_stats = {"token_loads": 0, "refreshes": 0, "oauth_flows": 0, "builds": 0}
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.valid:
+        return True
+    # google-auth stores expiry as naive UTC
+    return creds.expiry is not None and creds.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+
+def _write_token(creds: Credentials):
     """
-    Loads token.json if it exists, otherwise triggers OAuth login.
+    Write token.json atomically so a crash never leaves a half-written token.
     """
-    creds = None
+    fd, tmp_path = tempfile.mkstemp(dir=TOKEN_PATH.parent, prefix=".token-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as token:
+            token.write(creds.to_json())
+        os.replace(tmp_path, TOKEN_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_gmail_credentials() -> Credentials:
+    """
+    Process-wide credentials. token.json is read once; the token is only
+    refreshed when it is within TOKEN_REFRESH_MARGIN of expiry.
+    """
+    global _creds
+
+    with _auth_lock:
+        creds = _creds
 
-    if TOKEN_PATH.exists():
-        creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
+        if creds is None and TOKEN_PATH.exists():
+            creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
+            _service_stats["token_loads"] += 1
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+        if creds and not _needs_refresh(creds):
+            _creds = creds
+            return creds
+
+        if creds and creds.refresh_token:
             creds.refresh(Request())
+            _service_stats["refreshes"] += 1
         else:
             if not CREDENTIALS_PATH.exists():
                 raise FileNotFoundError(
@@ -51,20 +117,45 @@ def get_gmail_service():
                 str(CREDENTIALS_PATH), SCOPES
             )
             creds = flow.run_local_server(port=0)
+            _service_stats["oauth_flows"] += 1
 
-        with open(TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+        _write_token(creds)
+        _creds = creds
+        return creds
 
-    return build("gmail", "v1", credentials=creds)
+
+def get_gmail_service():
+    """
+    Returns a cached Gmail service for the calling thread.
+    The discovery document is parsed once per thread and the HTTP
+    connection is reused; refreshed tokens are picked up in place.
+    """
+    creds = get_gmail_credentials()
+
+    service = getattr(_local, "service", None)
+    if service is None or _local.creds is not creds:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+        service = build("gmail", "v1", http=http, cache_discovery=False)
+        _local.service, _local.creds = service, creds
+        with _auth_lock:
+            _service_stats["builds"] += 1
+
+    return service
 
 
 # ---------------------------------------------------------
 #  TOOL: List Messages
 # ---------------------------------------------------------
 @app.tool()
-def list_messages(q: str = "is:unread", max_results: int = 10) -> dict:
+def list_messages(
+    q: str = "is:unread",
+    max_results: int = 100,
+    page_token: str | None = None,
+) -> dict:
     """
-    List messages matching Gmail search query.
+    List one page of messages matching Gmail search query.
+    Pass the returned `next_page_token` back as `page_token` to get the
+    next page; it is null on the last page. Gmail caps a page at 500.
     Example queries:
       - is:unread
       - subject:Invoice
@@ -72,20 +163,146 @@ def list_messages(q: str = "is:unread", max_results: int = 10) -> dict:
     """
     try:
         service = get_gmail_service()
-        results = service.users().messages().list(
-            userId="me", q=q, maxResults=max_results
-        ).execute()
+        kwargs = {"userId": "me", "q": q, "maxResults": min(max_results, 500)}
+        if page_token:
+            kwargs["pageToken"] = page_token
+
+        results = service.users().messages().list(**kwargs).execute()
 
         messages = results.get("messages", [])
-        return {"messages": messages}
+        return {
+            "messages": messages,
+            "next_page_token": results.get("nextPageToken"),
+            "result_size_estimate": results.get("resultSizeEstimate"),
+        }
 
     except HttpError as error:
         return {"error": str(error)}
 
 
+# ---------------------------------------------------------
+#  TOOL: Mailbox Profile
+# ---------------------------------------------------------
+@app.tool()
+def get_profile() -> dict:
+    """
+    Mailbox profile, including the current historyId used as the
+    starting point for incremental sync.
+    """
+    try:
+        service = get_gmail_service()
+        profile = service.users().getProfile(userId="me").execute()
+
+        return {
+            "email": profile.get("emailAddress", ""),
+            "history_id": profile.get("historyId"),
+            "messages_total": profile.get("messagesTotal"),
+        }
+
+    except HttpError as error:
+        return {"error": str(error)}
+
+
+# ---------------------------------------------------------
+#  TOOL: List History (incremental sync)
+# ---------------------------------------------------------
+@app.tool()
+def list_history(
+    start_history_id: str,
+    page_token: str | None = None,
+    max_results: int = 500,
+) -> dict:
+    """
+    One page of mailbox changes since `start_history_id`
+    (users.history.list, messageAdded + labelAdded records).
+
+    Returns {"history_id", "changes": [{"id", "labels"}], "next_page_token"}.
+    If the start id is too old Gmail answers 404; that is reported as
+    {"error": ..., "expired": true} so the caller can do a full resync.
+    """
+    try:
+        service = get_gmail_service()
+        kwargs = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded", "labelAdded"],
+            "maxResults": max_results,
+        }
+        if page_token:
+            kwargs["pageToken"] = page_token
+
+        resp = service.users().history().list(**kwargs).execute()
+
+        changes = []
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg = added["message"]
+                changes.append({"id": msg["id"], "labels": msg.get("labelIds", [])})
+            for added in record.get("labelsAdded", []):
+                msg = added["message"]
+                changes.append({"id": msg["id"], "labels": msg.get("labelIds", [])})
+
+        return {
+            "history_id": resp.get("historyId"),
+            "changes": changes,
+            "next_page_token": resp.get("nextPageToken"),
+        }
+
+    except HttpError as error:
+        expired = getattr(error, "resp", None) is not None and error.resp.status == 404
+        return {"error": str(error), "expired": expired}
+
+
 # ---------------------------------------------------------
 #  TOOL: Get Full Email
 # ---------------------------------------------------------
+def _walk_parts(part: dict):
+    yield part
+    for child in part.get("parts", []) or []:
+        yield from _walk_parts(child)
+
+
+def _parse_message(msg: dict) -> dict:
+    """
+    Flatten a `format=full` Gmail message into the dict our tools return.
+    """
+    headers = {h["name"]: h["value"] for h in msg["payload"]["headers"]}
+    # Header names are case-insensitive in practice
+    lower_headers = {name.lower(): value for name, value in headers.items()}
+
+    # Extract plaintext body; walk nested multiparts and keep the first
+    # text/html part as a fallback for HTML-only mail
+    body = ""
+    body_html = ""
+    for part in _walk_parts(msg["payload"]):
+        data = part.get("body", {}).get("data")
+        if not data:
+            continue
+        if part.get("mimeType") == "text/plain" and not body:
+            body = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+        elif part.get("mimeType") == "text/html" and not body_html:
+            body_html = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+
+    return {
+        "id": msg["id"],
+        "thread_id": msg.get("threadId"),
+        "labels": msg.get("labelIds", []),
+        "snippet": msg.get("snippet", ""),
+        "subject": headers.get("Subject", ""),
+        "from": headers.get("From", ""),
+        "to": headers.get("To", ""),
+        "received_at": headers.get("Date", ""),
+        "body": body,
+        # only sent when there is no text/plain part
+        "body_html": "" if body else body_html,
+        "headers": {
+            name: lower_headers[name.lower()]
+            for name in TRIAGE_HEADERS
+            if name.lower() in lower_headers
+        },
+    }
+
+
 @app.tool()
 def get_message(id: str) -> dict:
     """
@@ -98,34 +315,175 @@ def get_message(id: str) -> dict:
             userId="me", id=id, format="full"
         ).execute()
 
-        headers = {h["name"]: h["value"] for h in msg["payload"]["headers"]}
+        return _parse_message(msg)
 
-        # Extract plaintext body
-        body = ""
-        if "data" in msg["payload"]["body"]:
-            body = base64.urlsafe_b64decode(
-                msg["payload"]["body"]["data"]
-            ).decode("utf-8", errors="ignore")
-        else:
-            # If multipart
-            for part in msg["payload"].get("parts", []):
-                if part["mimeType"] == "text/plain":
-                    body = base64.urlsafe_b64decode(
-                        part["body"]["data"]
-                    ).decode("utf-8", errors="ignore")
-                    break
+    except HttpError as error:
+        return {"error": str(error)}
+
+
+# ---------------------------------------------------------
+#  TOOL: Batch Get Emails
+# ---------------------------------------------------------
+def _fetch_error(gmail_id: str, error: Exception) -> dict:
+    # The HTTP status lets the client drop deleted messages (404) instead
+    # of retrying them
+    item = {"id": gmail_id, "error": str(error)}
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        item["status"] = int(status)
+    return item
 
-        return {
-            "id": msg["id"],
-            "thread_id": msg.get("threadId"),
-            "labels": msg.get("labelIds", []),
-            "snippet": msg.get("snippet", ""),
-            "subject": headers.get("Subject", ""),
-            "from": headers.get("From", ""),
-            "to": headers.get("To", ""),
-            "received_at": headers.get("Date", ""),
-            "body": body,
-        }
+
+@app.tool()
+def batch_get_messages(ids: list[str]) -> dict:
+    """
+    Fetch many Gmail messages using the Gmail batch HTTP endpoint
+    (BATCH_GET_LIMIT messages per HTTP request).
+    Returns {"results": [...]} in the order of `ids`; each item is either
+    the same dict as get_message or {"id": ..., "error": ..., "status": ...}
+    (status: the HTTP status, when there is one).
+    """
+    try:
+        service = get_gmail_service()
+    except SERVICE_ERRORS as error:
+        return {"results": [_fetch_error(gid, error) for gid in ids]}
+
+    results: list[dict] = [{"id": gid, "error": "not fetched"} for gid in ids]
+
+    def _callback(request_id, response, exception):
+        idx = int(request_id)
+        if exception is not None:
+            results[idx] = _fetch_error(ids[idx], exception)
+            return
+        try:
+            results[idx] = _parse_message(response)
+        except Exception as ex:
+            results[idx] = {"id": ids[idx], "error": f"parse error: {ex}"}
+
+    for offset in range(0, len(ids), BATCH_GET_LIMIT):
+        chunk = ids[offset : offset + BATCH_GET_LIMIT]
+
+        batch = service.new_batch_http_request(callback=_callback)
+        for i, gid in enumerate(chunk):
+            batch.add(
+                service.users().messages().get(userId="me", id=gid, format="full"),
+                request_id=str(offset + i),
+            )
+
+        try:
+            batch.execute()
+        except HttpError as error:
+            for i, gid in enumerate(chunk):
+                results[offset + i] = _fetch_error(gid, error)
+
+    return {"results": results}
+
+
+# ---------------------------------------------------------
+#  LABEL REGISTRY  (name -> ID cache)
+# ---------------------------------------------------------
+_labels_lock = threading.Lock()
+_label_ids: dict[str, str] | None = None
+_label_stats = {"label_list_calls": 0, "labels_created": 0}
+
+
+def _load_labels(service) -> dict[str, str]:
+    resp = service.users().labels().list(userId="me").execute()
+    _label_stats["label_list_calls"] += 1
+    mapping = {}
+    for label in resp.get("labels", []):
+        mapping[label["name"]] = label["id"]
+        # IDs resolve to themselves, so callers may pass either
+        mapping[label["id"]] = label["id"]
+    return mapping
+
+
+def invalidate_label_cache():
+    global _label_ids
+    with _labels_lock:
+        _label_ids = None
+
+
+def resolve_label_ids(service, names: list[str], create_missing: bool = True) -> list[str]:
+    """
+    Translate label names (or IDs) to Gmail label IDs.
+
+    Labels are listed once and cached. With `create_missing`, an unknown
+    name triggers one reload; if it is still unknown, AUTO_CREATE_LABEL_PREFIX
+    labels are created and other names raise ValueError. Without it, unknown
+    names are simply dropped (there is nothing to remove).
+    """
+    global _label_ids
+    if not names:
+        return []
+
+    with _labels_lock:
+        if _label_ids is None:
+            _label_ids = _load_labels(service)
+
+        if create_missing and any(name not in _label_ids for name in names):
+            _label_ids = _load_labels(service)
+
+        ids = []
+        for name in names:
+            if name in _label_ids:
+                ids.append(_label_ids[name])
+                continue
+            if not create_missing:
+                continue
+            if not name.startswith(AUTO_CREATE_LABEL_PREFIX):
+                raise ValueError(f"Unknown Gmail label: {name!r}")
+
+            created = service.users().labels().create(
+                userId="me",
+                body={
+                    "name": name,
+                    "labelListVisibility": "labelShow",
+                    "messageListVisibility": "show",
+                },
+            ).execute()
+            _label_stats["labels_created"] += 1
+            _label_ids[name] = _label_ids[created["id"]] = created["id"]
+            ids.append(created["id"])
+
+        return ids
+
+
+def _with_label_ids(service, add_labels, remove_labels, call):
+    """
+    Run `call(add_ids, remove_ids)` with names translated to IDs. A label
+    deleted or renamed in Gmail since we cached it surfaces as a 400/404;
+    the registry is then reloaded and the call retried once.
+    """
+    for attempt in range(2):
+        add_ids = resolve_label_ids(service, add_labels or [])
+        remove_ids = resolve_label_ids(service, remove_labels or [], create_missing=False)
+        try:
+            return call(add_ids, remove_ids)
+        except HttpError as error:
+            if attempt or error.resp.status not in (400, 404):
+                raise
+            invalidate_label_cache()
+
+
+# ---------------------------------------------------------
+#  TOOL: List Labels
+# ---------------------------------------------------------
+@app.tool()
+def list_labels(refresh: bool = False) -> dict:
+    """
+    The cached label name -> ID mapping (reloaded from Gmail if `refresh`).
+    """
+    global _label_ids
+    try:
+        service = get_gmail_service()
+
+        with _labels_lock:
+            if refresh or _label_ids is None:
+                _label_ids = _load_labels(service)
+            return {
+                "labels": {name: lid for name, lid in _label_ids.items() if name != lid}
+            }
 
     except HttpError as error:
         return {"error": str(error)}
@@ -142,20 +500,23 @@ def modify_labels(
 ) -> dict:
     """
     Add/remove Gmail labels for a message.
+    Labels may be given by name (e.g. "AI/Urgent") or ID.
     """
     try:
         service = get_gmail_service()
 
-        body = {
-            "addLabelIds": add_labels or [],
-            "removeLabelIds": remove_labels or [],
-        }
+        def _modify(add_ids, remove_ids):
+            body = {
+                "addLabelIds": add_ids,
+                "removeLabelIds": remove_ids,
+            }
+            return service.users().messages().modify(
+                userId="me",
+                id=id,
+                body=body
+            ).execute()
 
-        result = service.users().messages().modify(
-            userId="me",
-            id=id,
-            body=body
-        ).execute()
+        _with_label_ids(service, add_labels, remove_labels, _modify)
 
         return {
             "id": id,
@@ -163,10 +524,57 @@ def modify_labels(
             "removed": remove_labels or [],
         }
 
-    except HttpError as error:
+    except (HttpError, ValueError) as error:
         return {"error": str(error)}
 
 
+# ---------------------------------------------------------
+#  TOOL: Batch Modify Labels
+# ---------------------------------------------------------
+@app.tool()
+def batch_modify_labels(
+    ids: list[str],
+    add_labels: list[str] | None = None,
+    remove_labels: list[str] | None = None,
+) -> dict:
+    """
+    Apply the same label change to many messages with messages.batchModify
+    (BATCH_MODIFY_LIMIT IDs per call). Labels may be names or IDs.
+    Returns {"results": [{"id", "ok": true} | {"id", "error"}], ...}.
+    """
+    try:
+        service = get_gmail_service()
+    except SERVICE_ERRORS as error:
+        return {
+            "results": [{"id": gid, "error": str(error)} for gid in ids],
+            "added": add_labels or [],
+            "removed": remove_labels or [],
+        }
+
+    results: list[dict] = []
+    for chunk in _chunks(ids, BATCH_MODIFY_LIMIT):
+
+        def _modify(add_ids, remove_ids, chunk=chunk):
+            body = {
+                "ids": chunk,
+                "addLabelIds": add_ids,
+                "removeLabelIds": remove_ids,
+            }
+            service.users().messages().batchModify(userId="me", body=body).execute()
+
+        try:
+            _with_label_ids(service, add_labels, remove_labels, _modify)
+            results.extend({"id": gid, "ok": True} for gid in chunk)
+        except (HttpError, ValueError) as error:
+            results.extend({"id": gid, "error": str(error)} for gid in chunk)
+
+    return {
+        "results": results,
+        "added": add_labels or [],
+        "removed": remove_labels or [],
+    }
+
+
 # ---------------------------------------------------------
 #  TOOL: Send Email (optional)
 # ---------------------------------------------------------
@@ -195,6 +603,23 @@ def send_email(to: str, subject: str, message: str) -> dict:
         return {"error": str(error)}
 
 
+# ---------------------------------------------------------
+#  TOOL: Service Stats
+# ---------------------------------------------------------
+@app.tool()
+def service_stats() -> dict:
+    """
+    How many times this process loaded token.json, refreshed the token,
+    ran the OAuth flow, built a Gmail service object, listed labels and
+    created labels.
+    """
+    with _auth_lock:
+        stats = dict(_service_stats)
+    with _labels_lock:
+        stats.update(_label_stats)
+    return stats
+
+
 # ---------------------------------------------------------
 #  START MCP SERVER
 # ---------------------------------------------------------
@@ -0,0 +1,167 @@
+# app/classify_cache.py
+# Persistent LLM classification cache, keyed by a normalized content
+# fingerprint + prompt/model version, so templated mail (receipts,
+# digests, shipping notices) is classified without touching Ollama.
+
+import os
+import re
+import hashlib
+import sqlite3
+from datetime import datetime, timedelta
+from email.utils import parseaddr
+
+CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFY_CACHE_MAX_ENTRIES", "50000"))
+CACHE_TTL_DAYS = float(os.getenv("CLASSIFY_CACHE_TTL_DAYS", "30"))
+
+# bottom-k sketch over word shingles of the body
+SHINGLE_SIZE = 4
+SKETCH_SIZE = 8
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_DIGITS_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"[a-z#]+")
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd)\s*:\s*)+")
+
+
+def prompt_version(model: str, system_prompt: str) -> str:
+    """
+    Cache entries are only valid for the model + prompt that produced them.
+    """
+    return hashlib.sha1(f"{model}\n{system_prompt}".encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize_subject(subject: str) -> str:
+    text = (subject or "").lower()
+    text = _SUBJECT_PREFIX_RE.sub("", text)
+    text = _DIGITS_RE.sub("#", text)
+    return " ".join(text.split())
+
+
+def _body_sketch(body: str) -> str:
+    """
+    Bottom-k hash sketch of the body's word shingles, after masking URLs
+    and numbers. Bodies that differ only in order numbers, dates, tracking
+    links or a few words usually produce the same sketch.
+    """
+    text = _URL_RE.sub(" url ", (body or "").lower())
+    text = _DIGITS_RE.sub("#", text)
+    words = _WORD_RE.findall(text)
+
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[i : i + SHINGLE_SIZE])
+            for i in range(len(words) - SHINGLE_SIZE + 1)
+        }
+
+    hashes = sorted(
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in shingles
+    )
+    return ",".join(f"{h:x}" for h in hashes[:SKETCH_SIZE])
+
+
+def fingerprint(from_addr: str, subject: str, body: str) -> str:
+    """
+    sender address + normalized subject + body shingle sketch.
+    """
+    sender = parseaddr(from_addr or "")[1].lower()
+    key = f"{sender}\n{_normalize_subject(subject)}\n{_body_sketch(body)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ClassificationCache:
+    """
+    SQLite-backed LRU/TTL cache: fingerprint -> (category, confidence).
+    `hits` / `misses` count lookups made through this instance.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        version: str,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl_days: float = CACHE_TTL_DAYS,
+    ):
+        self.conn = conn
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = timedelta(days=ttl_days)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fp: str) -> tuple[str, float | None] | None:
+        row = self.conn.execute(
+            """
+            SELECT category, created_at, confidence FROM classification_cache
+             WHERE fingerprint = ? AND version = ?
+            """,
+            (fp, self.version),
+        ).fetchone()
+
+        now = datetime.utcnow()
+        if row is None or datetime.fromisoformat(row[1]) < now - self.ttl:
+            self.misses += 1
+            return None
+
+        self.conn.execute(
+            """
+            UPDATE classification_cache
+               SET hits = hits + 1, last_used_at = ?
+             WHERE fingerprint = ? AND version = ?
+            """,
+            (now.isoformat(), fp, self.version),
+        )
+        self.hits += 1
+        return row[0], row[2]
+
+    def put(self, fp: str, category: str, confidence: float | None = None):
+        now = datetime.utcnow().isoformat()
+        self.conn.execute(
+            """
+            INSERT INTO classification_cache
+                (fingerprint, version, category, confidence, hits, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, 0, ?, ?)
+            ON CONFLICT(fingerprint, version) DO UPDATE SET
+                category = excluded.category,
+                confidence = excluded.confidence,
+                created_at = excluded.created_at,
+                last_used_at = excluded.last_used_at
+            """,
+            (fp, self.version, category, confidence, now, now),
+        )
+
+    def evict(self) -> int:
+        """
+        Drop expired entries and entries from older prompt/model versions,
+        then the least recently used ones above `max_entries`.
+        Returns the number of rows removed.
+        """
+        cutoff = (datetime.utcnow() - self.ttl).isoformat()
+        removed = self.conn.execute(
+            "DELETE FROM classification_cache WHERE created_at < ? OR version != ?",
+            (cutoff, self.version),
+        ).rowcount
+
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()
+        if count > self.max_entries:
+            removed += self.conn.execute(
+                """
+                DELETE FROM classification_cache WHERE rowid IN (
+                    SELECT rowid FROM classification_cache
+                     ORDER BY last_used_at ASC
+                     LIMIT ?
+                )
+                """,
+                (count - self.max_entries,),
+            ).rowcount
+        return removed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
@@ -0,0 +1,552 @@
+# app/db.py
+# SQLite storage for the triage agent: one shared connection per process,
+# WAL mode, versioned schema migrations and batched reads/writes.
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator
+
+from app import metrics
+
+DB_PATH = os.getenv("MEMORY_DB_PATH", "memory.db")
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",    # durable enough with WAL, far fewer fsyncs
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-32000",     # ~32 MB page cache
+    "PRAGMA mmap_size=268435456",   # 256 MB
+    "PRAGMA busy_timeout=5000",
+)
+
+# SQLite caps the number of bound parameters per statement
+IN_CLAUSE_CHUNK = 500
+
+
+# -------------------------------------------------------------------
+# Schema migrations (tracked in PRAGMA user_version)
+# -------------------------------------------------------------------
+
+def _migrate_1_base_tables(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS emails (
+            gmail_id TEXT PRIMARY KEY,
+            thread_id TEXT,
+            from_addr TEXT,
+            to_addr TEXT,
+            subject TEXT,
+            snippet TEXT,
+            body TEXT,
+            received_at TEXT,
+            labels TEXT,
+            category TEXT,
+            category_confidence REAL,
+            last_updated_at TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TEXT
+        )
+        """
+    )
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    # Databases created before migrations existed may already have it
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_2_headers(conn: sqlite3.Connection):
+    _add_column(conn, "emails", "headers", "TEXT")
+
+
+def _migrate_3_classification_cache(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            fingerprint TEXT NOT NULL,
+            version TEXT NOT NULL,
+            category TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            last_used_at TEXT NOT NULL,
+            PRIMARY KEY (fingerprint, version)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_classification_cache_last_used
+            ON classification_cache (last_used_at)
+        """
+    )
+
+
+def _migrate_4_email_indexes(conn: sqlite3.Connection):
+    # uncategorized_ids (category IS NULL, oldest first), the kNN sync
+    # (last_updated_at past its watermark) and thread_categories (thread_id)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_category ON emails (category, last_updated_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_last_updated ON emails (last_updated_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_thread ON emails (thread_id)"
+    )
+
+
+def _migrate_5_applied_label(conn: sqlite3.Connection):
+    # Gmail label last pushed successfully for this email (NULL = none)
+    _add_column(conn, "emails", "applied_label", "TEXT")
+
+
+def _migrate_6_body_normalized(conn: sqlite3.Connection):
+    # Cleaned, token-budgeted body shared by the categorizer and validator
+    _add_column(conn, "emails", "body_normalized", "TEXT")
+
+
+def _migrate_7_cache_confidence(conn: sqlite3.Connection):
+    # Confidence of the answer that was cached, reused on a cache hit
+    _add_column(conn, "classification_cache", "confidence", "REAL")
+
+
+def _migrate_8_category_source(conn: sqlite3.Connection):
+    # Who set the category: rule, cache, knn, llm or validator
+    _add_column(conn, "emails", "category_source", "TEXT")
+
+
+def _migrate_9_labels_dirty(conn: sqlite3.Connection):
+    # Set when the category changes, cleared once Gmail matches; the
+    # organizer only looks at dirty rows (settle_labels marks existing
+    # rows dirty on its first run)
+    _add_column(conn, "emails", "labels_dirty", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_emails_labels_dirty ON emails (gmail_id) WHERE labels_dirty = 1"
+    )
+
+
+def _migrate_10_categorize_attempts(conn: sqlite3.Connection):
+    # Runs in which categorization failed for this (still uncategorized) email
+    _add_column(conn, "emails", "categorize_attempts", "INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    (1, _migrate_1_base_tables),
+    (2, _migrate_2_headers),
+    (3, _migrate_3_classification_cache),
+    (4, _migrate_4_email_indexes),
+    (5, _migrate_5_applied_label),
+    (6, _migrate_6_body_normalized),
+    (7, _migrate_7_cache_confidence),
+    (8, _migrate_8_category_source),
+    (9, _migrate_9_labels_dirty),
+    (10, _migrate_10_categorize_attempts),
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply pending migrations in order; returns the resulting schema version.
+    """
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    for target, step in MIGRATIONS:
+        if target <= version:
+            continue
+        with conn:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+        version = target
+    return version
+
+
+# -------------------------------------------------------------------
+# Connection handling
+# -------------------------------------------------------------------
+
+_conn: sqlite3.Connection | None = None
+_conn_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    The process-wide connection, opened (and migrated) on first use.
+    Graph nodes run one after another, so sharing it is safe; the lock
+    only guards opening/closing.
+    """
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            migrate(conn)
+            _conn = conn
+        return _conn
+
+
+def close_connection():
+    global _conn
+    with _conn_lock:
+        if _conn is not None:
+            _conn.execute("PRAGMA optimize")
+            _conn.close()
+            _conn = None
+
+
+def ensure_db():
+    """
+    Open the shared connection and bring the schema up to date.
+    """
+    get_connection()
+
+
+@contextmanager
+def transaction():
+    """
+    Commit on success, roll back on error. Timed, commit included, in
+    triage_sqlite_transaction_seconds.
+    """
+    conn = get_connection()
+    with metrics.timed("triage_sqlite_transaction_seconds"), conn:
+        yield conn
+
+
+def _chunks(items: list, size: int = IN_CLAUSE_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+# -------------------------------------------------------------------
+# sync_state
+# -------------------------------------------------------------------
+
+def get_sync_state(key: str) -> str | None:
+    row = get_connection().execute(
+        "SELECT value FROM sync_state WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_sync_state(key: str, value: str):
+    get_connection().execute(
+        """
+        INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value,
+                                       updated_at = excluded.updated_at
+        """,
+        (key, value, datetime.utcnow().isoformat()),
+    )
+
+
+# -------------------------------------------------------------------
+# emails
+# -------------------------------------------------------------------
+
+def unknown_ids(ids: list[str]) -> list[str]:
+    """
+    Drop ids that are already stored in the emails table (order preserved).
+    """
+    conn = get_connection()
+    known = set()
+    for chunk in _chunks(ids):
+        known.update(
+            row[0]
+            for row in conn.execute(
+                f"SELECT gmail_id FROM emails WHERE gmail_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+        )
+    return [gid for gid in ids if gid not in known]
+
+
+def uncategorized_ids(max_attempts: int) -> list[str]:
+    """
+    Stored emails without a category, e.g. because the LLM failed on them
+    in an earlier run, oldest first. Emails that already failed
+    `max_attempts` times are given up on.
+    """
+    return [
+        row[0]
+        for row in get_connection().execute(
+            """
+            SELECT gmail_id FROM emails
+             WHERE category IS NULL AND categorize_attempts < ?
+             ORDER BY last_updated_at
+            """,
+            (max_attempts,),
+        )
+    ]
+
+
+def record_categorize_failures(ids: list[str], max_attempts: int) -> list[str]:
+    """
+    Count one more failed categorization for each of `ids`; returns those
+    that have now reached `max_attempts` and will not be retried.
+    """
+    conn = get_connection()
+    given_up = []
+    for chunk in _chunks(ids):
+        marks = ",".join("?" * len(chunk))
+        conn.execute(
+            f"UPDATE emails SET categorize_attempts = categorize_attempts + 1 WHERE gmail_id IN ({marks})",
+            chunk,
+        )
+        given_up.extend(
+            row[0]
+            for row in conn.execute(
+                f"SELECT gmail_id FROM emails WHERE gmail_id IN ({marks}) AND categorize_attempts = ?",
+                [*chunk, max_attempts],
+            )
+        )
+    return given_up
+
+
+def upsert_emails(emails: Iterable[Dict[str, Any]]) -> int:
+    """
+    Insert fetched messages (get_message dicts) in one executemany.
+    Existing rows keep their category and only refresh Gmail-side fields.
+    """
+    now = datetime.utcnow().isoformat()
+    rows = [
+        (
+            e["id"],
+            e.get("thread_id"),
+            e.get("from", ""),
+            e.get("to", ""),
+            e.get("subject", ""),
+            e.get("snippet", ""),
+            e.get("body", ""),
+            e.get("body_normalized"),
+            e.get("received_at"),
+            json.dumps(e.get("labels", [])),
+            json.dumps(e.get("headers", {})),
+            now,
+        )
+        for e in emails
+    ]
+    cur = get_connection().executemany(
+        """
+        INSERT INTO emails
+        (gmail_id, thread_id, from_addr, to_addr, subject, snippet, body, body_normalized,
+         received_at, labels, headers, category, category_confidence, last_updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?)
+        ON CONFLICT(gmail_id) DO UPDATE SET
+            labels = excluded.labels,
+            headers = excluded.headers,
+            snippet = excluded.snippet
+        """,
+        rows,
+    )
+    return cur.rowcount
+
+
+def update_categories(rows: Iterable[tuple[str, str, float, str]]) -> int:
+    """
+    rows: (gmail_id, category, confidence, source)
+    """
+    now = datetime.utcnow().isoformat()
+    cur = get_connection().executemany(
+        """
+        UPDATE emails
+           SET category = ?,
+               category_confidence = ?,
+               category_source = ?,
+               last_updated_at = ?,
+               labels_dirty = 1
+         WHERE gmail_id = ?
+        """,
+        [(cat, conf, source, now, gid) for gid, cat, conf, source in rows],
+    )
+    return cur.rowcount
+
+
+def _desired_label_sql(label_map: Dict[str, str | None]) -> tuple[str, list]:
+    """
+    SQL expression for label_map[category] (NULL if unmapped) and its params.
+    """
+    if not label_map:
+        return "NULL", []
+    case = " ".join("WHEN ? THEN ?" for _ in label_map)
+    return f"CASE category {case} ELSE NULL END", [v for item in label_map.items() for v in item]
+
+
+def settle_labels(label_map: Dict[str, str | None]) -> int:
+    """
+    Clear labels_dirty on emails whose desired label is already the one
+    applied. If label_map differs from the one last settled (or this is
+    the first run), every categorized or labeled email is marked dirty
+    first, so a changed mapping is pushed to Gmail.
+    """
+    conn = get_connection()
+    fingerprint = json.dumps(label_map, sort_keys=True)
+    if get_sync_state("label_map") != fingerprint:
+        conn.execute(
+            """
+            UPDATE emails SET labels_dirty = 1
+             WHERE labels_dirty = 0 AND (category IS NOT NULL OR applied_label IS NOT NULL)
+            """
+        )
+        set_sync_state("label_map", fingerprint)
+
+    desired, params = _desired_label_sql(label_map)
+    conn.execute(
+        f"UPDATE emails SET labels_dirty = 0 WHERE labels_dirty = 1 AND {desired} IS applied_label",
+        params,
+    )
+
+
+def label_deltas(
+    label_map: Dict[str, str | None], ids: list[str] | None = None
+) -> list[tuple[str, str | None, str | None]]:
+    """
+    (gmail_id, desired_label, applied_label) for every email whose desired
+    label (label_map[category], or None) differs from the one last applied.
+    Without `ids` only dirty rows are read (see settle_labels), so a pass
+    over an unchanged mailbox costs nothing; with `ids`, just those rows.
+    """
+    desired, params = _desired_label_sql(label_map)
+    query = f"""
+        SELECT gmail_id, desired, applied_label FROM (
+            SELECT gmail_id, {desired} AS desired, applied_label
+              FROM emails
+             WHERE {{only}}
+        )
+        WHERE desired IS NOT applied_label
+        """
+    conn = get_connection()
+    if ids is None:
+        return conn.execute(query.format(only="labels_dirty = 1"), params).fetchall()
+
+    deltas = []
+    for chunk in _chunks(ids):
+        only = f"gmail_id IN ({','.join('?' * len(chunk))})"
+        deltas.extend(conn.execute(query.format(only=only), [*params, *chunk]).fetchall())
+    return deltas
+
+
+def mark_labels_applied(rows: Iterable[tuple[str, str | None]]) -> int:
+    """
+    rows: (gmail_id, label now applied in Gmail, or None)
+    """
+    cur = get_connection().executemany(
+        "UPDATE emails SET applied_label = ?, labels_dirty = 0 WHERE gmail_id = ?",
+        [(label, gid) for gid, label in rows],
+    )
+    return cur.rowcount
+
+
+def thread_categories(thread_ids: Iterable[str]) -> Dict[str, tuple[str, float | None]]:
+    """
+    thread_id -> (category, confidence) of the most recently updated
+    categorized message in each thread.
+    """
+    conn = get_connection()
+    result: Dict[str, tuple[str, float | None]] = {}
+    for chunk in _chunks(list(thread_ids)):
+        rows = conn.execute(
+            f"""
+            SELECT thread_id, category, category_confidence FROM emails
+             WHERE thread_id IN ({','.join('?' * len(chunk))}) AND category IS NOT NULL
+             ORDER BY last_updated_at
+            """,
+            chunk,
+        )
+        for thread_id, category, confidence in rows:
+            result[thread_id] = (category, confidence)
+    return result
+
+
+def thread_heads(ids: list[str], category: str) -> list[tuple[str, str, str]]:
+    """
+    (thread_id, subject, gmail_id) for the given ids in `category`, one per
+    thread (a message without a thread id is its own thread).
+    Messages that only inherited their thread's category are skipped:
+    the thread was handled when it was first categorized.
+    """
+    conn = get_connection()
+    heads: Dict[str, tuple[str, str, str]] = {}
+    for chunk in _chunks(ids):
+        rows = conn.execute(
+            f"""
+            SELECT COALESCE(thread_id, gmail_id), subject, gmail_id FROM emails
+             WHERE gmail_id IN ({','.join('?' * len(chunk))}) AND category = ?
+               AND (category_source IS NULL OR category_source != 'thread')
+            """,
+            [*chunk, category],
+        )
+        for thread, subject, gmail_id in rows:
+            heads.setdefault(thread, (thread, subject, gmail_id))
+    return list(heads.values())
+
+
+def iter_emails(ids: list[str], chunk_size: int = IN_CLAUSE_CHUNK) -> Iterator[list[Dict[str, Any]]]:
+    """
+    Stored emails for `ids`, `chunk_size` at a time, in the order of `ids`,
+    as get_message-style dicts (labels/headers decoded, plus
+    body_normalized). Only one chunk is held in memory at once.
+    """
+    conn = get_connection()
+    for chunk in _chunks(ids, min(chunk_size, IN_CLAUSE_CHUNK)):
+        rows = conn.execute(
+            f"""
+            SELECT gmail_id, thread_id, from_addr, to_addr, subject, snippet, body,
+                   body_normalized, received_at, labels, headers
+              FROM emails
+             WHERE gmail_id IN ({','.join('?' * len(chunk))})
+            """,
+            chunk,
+        )
+        by_id = {
+            row[0]: {
+                "id": row[0],
+                "thread_id": row[1],
+                "from": row[2],
+                "to": row[3],
+                "subject": row[4],
+                "snippet": row[5],
+                "body": row[6],
+                "body_normalized": row[7],
+                "received_at": row[8],
+                "labels": json.loads(row[9] or "[]"),
+                "headers": json.loads(row[10] or "{}"),
+            }
+            for row in rows
+        }
+        yield [by_id[gid] for gid in chunk if gid in by_id]
+
+
+def iter_uncertain_emails(ids: list[str], threshold: float) -> Iterator[list[tuple]]:
+    """
+    (gmail_id, subject, snippet, body, category, confidence) for the given
+    ids whose category confidence is below `threshold` (or unknown), one
+    IN_CLAUSE_CHUNK of ids at a time. `body` is the normalized body when
+    one was stored.
+    """
+    conn = get_connection()
+    for chunk in _chunks(ids):
+        rows = conn.execute(
+            f"""
+            SELECT gmail_id, subject, snippet, COALESCE(body_normalized, body),
+                   category, category_confidence
+            FROM emails
+            WHERE gmail_id IN ({','.join('?' * len(chunk))})
+              AND category IS NOT NULL
+              AND (category_confidence IS NULL OR category_confidence < ?)
+            """,
+            [*chunk, threshold],
+        ).fetchall()
+        if rows:
+            yield rows
@@ -1,121 +1,315 @@
 # app/graph.py
 
-import sqlite3
+import os
+import math
+import time
+import asyncio
 import logging
 import json
 from datetime import datetime, timedelta
-from typing import Any, Dict
-
-from langgraph.graph import StateGraph, END
-from langchain_ollama import ChatOllama
+from typing import TYPE_CHECKING, Any, Dict
 
 from app.state import EmailState
+from app import db, knn, metrics, rules
+from app.llm import LLM_MODEL, LLM_NUM_CTX, get_llm
+from app.normalize import (
+    BODY_TOKEN_BUDGET,
+    estimate_tokens,
+    html_to_text,
+    normalize_email,
+    truncate_to_tokens,
+)
+from app.classify_cache import (
+    ClassificationCache,
+    fingerprint,
+    prompt_version,
+)
 from app.tools.gmail_calendar_tools import (
-    list_unread_emails,
-    get_email,
-    set_email_labels,
+    aiter_unread_email_ids,
+    get_mailbox_profile,
+    list_history,
+    get_emails_async,
+    set_labels_bulk,
+    set_labels_bulk_async,
     create_calendar_block,
+    create_calendar_block_async,
+    mcp_warm_up,
 )
 
+# LangGraph is imported by build_app(); logging is configured by the entry
+# point (main.py) and the Ollama client is created on first use, so
+# importing this module is cheap
+if TYPE_CHECKING:
+    from langgraph.types import StreamWriter
+
 # -------------------------------------------------------------------
 # Shared config
 # -------------------------------------------------------------------
-logging.basicConfig(
-    filename="agent.log",           # log file next to your script
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-)
 log = logging.getLogger(__name__)
 
-DB_PATH = "memory.db"
-
-
-def ensure_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS emails (
-            gmail_id TEXT PRIMARY KEY,
-            thread_id TEXT,
-            from_addr TEXT,
-            to_addr TEXT,
-            subject TEXT,
-            snippet TEXT,
-            body TEXT,
-            received_at TEXT,
-            labels TEXT,
-            category TEXT,
-            category_confidence REAL,
-            last_updated_at TEXT
-        )
-        """
-    )
+# Ids per list_messages page, messages per batch_get_messages call,
+# and max batch calls in flight
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+READ_BATCH_SIZE = int(os.getenv("READ_BATCH_SIZE", "50"))
+READ_CONCURRENCY = int(os.getenv("READ_CONCURRENCY", "8"))
+
+# Runs that may fail to fetch a message (other than it being deleted)
+# before its id is dropped from the retry list
+FETCH_MAX_ATTEMPTS = int(os.getenv("FETCH_MAX_ATTEMPTS", "5"))
 
-    conn.commit()
-    conn.close()
+# "incremental" follows Gmail history from the last stored historyId,
+# "full" always re-lists unread mail
+SYNC_MODE = os.getenv("SYNC_MODE", "incremental")
 
-llm = ChatOllama(model="qwen2.5:0.5b", temperature=0.1)
+
+# Concurrent categorization requests; match the server's OLLAMA_NUM_PARALLEL
+# times the number of OLLAMA_ENDPOINTS
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+
+# The LLMPool from app.llm, created by _llm() on first use; benchmarks
+# may assign their own client here
+llm = None
+
+
+def _llm():
+    global llm
+    if llm is None:
+        llm = get_llm()
+    return llm
+
+# Stored emails loaded from SQLite per categorization step
+CATEGORIZE_CHUNK = int(os.getenv("CATEGORIZE_CHUNK", "500"))
+
+# Runs that may fail to categorize a stored email (LLM error, no category
+# in the answer) before it is left uncategorized for good
+CATEGORIZE_MAX_ATTEMPTS = int(os.getenv("CATEGORIZE_MAX_ATTEMPTS", "3"))
+
+# Rows categorized this run with a confidence below this are re-checked
+# by the validator; everything else skips it
+VALIDATION_THRESHOLD = float(os.getenv("VALIDATION_THRESHOLD", "0.8"))
 
 
 # -------------------------------------------------------------------
 # Agent 1: Read Emails
 # -------------------------------------------------------------------
 
-def read_emails_node(state: EmailState) -> EmailState:
+async def _fetch_emails(ids: list[str], concurrency: int) -> list[Dict[str, Any]]:
     """
-    Read unread emails via MCP Gmail and store them in SQLite.
+    Fetch full messages in READ_BATCH_SIZE chunks, at most `concurrency`
+    batch calls in flight. Results keep the order of `ids`; a failed fetch
+    becomes {"id", "error"}.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _batch(chunk: list[str]) -> list[Dict[str, Any]]:
+        async with sem:
+            try:
+                resp = await get_emails_async(chunk)
+            except Exception as ex:
+                return [{"id": gid, "error": str(ex)} for gid in chunk]
+        results = resp.get("results") if isinstance(resp, dict) else None
+        if not isinstance(results, list) or len(results) != len(chunk):
+            err = resp.get("error") if isinstance(resp, dict) else None
+            return [{"id": gid, "error": err or f"unexpected response: {resp!r}"} for gid in chunk]
+        return results
+
+    chunks = [ids[i : i + READ_BATCH_SIZE] for i in range(0, len(ids), READ_BATCH_SIZE)]
+    batches = await asyncio.gather(*(_batch(c) for c in chunks))
+    return [item for batch in batches for item in batch]
+
+
+def _history_unread_ids(start_history_id: str) -> tuple[list[str], str] | None:
+    """
+    Unread message ids added/re-labelled since `start_history_id`, plus
+    the new historyId. Returns None when the history has expired (or the
+    call failed) and a full resync is needed.
+    """
+    ids: list[str] = []
+    seen = set()
+    page_token = None
+    history_id = start_history_id
+
+    while True:
+        resp = list_history(start_history_id, page_token)
+        if not isinstance(resp, dict) or "error" in resp:
+            err = resp.get("error") if isinstance(resp, dict) else resp
+            log.warning(f"History sync from {start_history_id} unavailable, full resync: {err}")
+            return None
+
+        for change in resp.get("changes", []):
+            gid = change["id"]
+            if gid not in seen and "UNREAD" in change.get("labels", []):
+                seen.add(gid)
+                ids.append(gid)
+
+        history_id = resp.get("history_id") or history_id
+        page_token = resp.get("next_page_token")
+        if not page_token:
+            return ids, history_id
+
+
+async def _aiter_pages(pages):
+    for page in pages:
+        yield page
+
+
+def _store_fetched(
+    ids: list[str], fetched: list[Dict[str, Any]]
+) -> tuple[list[Dict[str, Any]], list[str]]:
+    """
+    Normalize and upsert one fetched batch (inside the caller's open
+    transaction). Returns (stored emails, failed ids); messages deleted
+    since they were listed (404) are neither.
+    """
+    ok = []
+    failed = []
+    for gid, full in zip(ids, fetched):
+        if "error" in full:
+            if full.get("status") == 404 or "notFound" in str(full["error"]):
+                log.info(f"Message {gid} no longer exists, skipping")
+                continue
+            log.error(f"Fetch failed for {gid}: {full['error']}")
+            failed.append(gid)
+            continue
+        metrics.email_debug(log, gid, "Full email fields for %s: %s", gid, list(full))
+
+        body_html = full.pop("body_html", "") or ""
+        if not full.get("body") and body_html:
+            full["body"] = html_to_text(body_html)
+        full["body_normalized"] = normalize_email(full.get("body", ""))
+        ok.append(full)
+
+    db.upsert_emails(ok)
+    return ok, failed
+
+
+async def _ingest(pages) -> tuple[list[str], list[str]]:
     """
-    ensure_db() 
-
-    raw_list = list_unread_emails()
-    emails = []
-    log.info(f"Raw list keys: {list(raw_list.keys())}")
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    for msg in raw_list.get("messages", []):
-        log.info(f"Reading message id={msg.get('id')}")
-        gid = msg["id"]
-        full = get_email(gid)
-        log.info(f"Full email fields: {list(full.keys())}")
-
-        subject = full.get("subject", "")
-        snippet = full.get("snippet", "")
-        body = full.get("body", "")
-        received_at = full.get("received_at")  # map fields as per tool
-        labels = full.get("labels", [])
-
-        cur.execute(
-            """
-            INSERT OR IGNORE INTO emails
-            (gmail_id, thread_id, from_addr, to_addr, subject, snippet, body,
-             received_at, labels, category, category_confidence, last_updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?)
-            """,
-            (
-                gid,
-                full.get("thread_id"),
-                full.get("from", ""),
-                full.get("to", ""),
-                subject,
-                snippet,
-                body,
-                received_at,
-                json.dumps(labels),
-                datetime.utcnow().isoformat(),
-            ),
+    Consume id pages as they arrive: while page N is being fetched, page
+    N+1 is already being listed. Rows are inserted page by page inside the
+    caller's open transaction and only their ids are kept.
+    Returns (stored ids, failed ids).
+    """
+    stored: list[str] = []
+    failed: list[str] = []
+    seen: set[str] = set()
+    skipped = 0
+
+    def _store(ids: list[str], fetched: list[Dict[str, Any]]):
+        ok, bad = _store_fetched(ids, fetched)
+        stored.extend(e["id"] for e in ok)
+        failed.extend(bad)
+
+    pending = None
+    async for page in pages:
+        page = [gid for gid in page if gid not in seen]
+        seen.update(page)
+        ids = db.unknown_ids(page)
+        skipped += len(page) - len(ids)
+
+        task = asyncio.create_task(_fetch_emails(ids, READ_CONCURRENCY))
+        if pending is not None:
+            _store(pending[0], await pending[1])
+        pending = (ids, task)
+
+    if pending is not None:
+        _store(pending[0], await pending[1])
+
+    log.info(
+        f"Fetched {len(stored) + len(failed)} new messages ({skipped} already stored, "
+        f"{len(failed)} failed, batch={READ_BATCH_SIZE}, concurrency={READ_CONCURRENCY})"
+    )
+    return stored, failed
+
+
+def _read_pages():
+    """
+    Where this run's ids come from: (async iterator of id pages, historyId
+    to store once they have all been read).
+
+    With SYNC_MODE=incremental only messages that appeared since the last
+    stored historyId are considered; otherwise unread mail is listed page
+    by page. Messages whose fetch failed in earlier runs come first.
+    """
+    retry_ids = list(_retry_attempts())
+
+    last_history_id = db.get_sync_state("history_id")
+    delta = None
+    if SYNC_MODE == "incremental" and last_history_id:
+        delta = _history_unread_ids(last_history_id)
+
+    if delta is not None:
+        ids, new_history_id = delta
+        log.info(f"Incremental sync since historyId={last_history_id}: {len(ids)} changed")
+        return _aiter_pages([retry_ids, ids]), new_history_id
+
+    # Take the historyId *before* listing so nothing slips between the two
+    profile = get_mailbox_profile()
+    new_history_id = profile.get("history_id") if isinstance(profile, dict) else None
+    log.info(f"Full unread listing (page size {LIST_PAGE_SIZE})")
+
+    async def _full_pages():
+        yield retry_ids
+        async for page in aiter_unread_email_ids(LIST_PAGE_SIZE):
+            yield page
+
+    return _full_pages(), new_history_id
+
+
+def _retry_attempts() -> Dict[str, int]:
+    """
+    gmail_id -> failed fetches so far, for ids to fetch again next run.
+    """
+    stored = json.loads(db.get_sync_state("retry_ids") or "{}")
+    if isinstance(stored, list):
+        # written before attempts were counted
+        return dict.fromkeys(stored, 1)
+    return stored
+
+
+def _finish_read(new_history_id: str | None, failed: list[str]):
+    if new_history_id:
+        db.set_sync_state("history_id", str(new_history_id))
+
+    previous = _retry_attempts()
+    retry: Dict[str, int] = {}
+    dropped = []
+    for gid in failed:
+        attempts = previous.get(gid, 0) + 1
+        if attempts >= FETCH_MAX_ATTEMPTS:
+            dropped.append(gid)
+        else:
+            retry[gid] = attempts
+    if dropped:
+        log.warning(
+            f"Giving up on fetching {len(dropped)} message(s) after {FETCH_MAX_ATTEMPTS} "
+            f"failed attempts: {', '.join(dropped)}"
         )
+    db.set_sync_state("retry_ids", json.dumps(retry))
 
-        emails.append(full)
 
-    conn.commit()
-    conn.close()
+def read_emails_node(state: EmailState) -> EmailState:
+    """
+    Read unread emails via MCP Gmail and store them in SQLite.
 
-    state["emails"] = emails
-    state["current_email_index"] = 0
+    Ids already in the emails table are never re-fetched (see _read_pages
+    for where ids come from), and everything is written in one transaction.
+    Stored emails an earlier run could not categorize are passed on again.
+    """
+    leftover = db.uncategorized_ids(CATEGORIZE_MAX_ATTEMPTS)
+    pages, new_history_id = _read_pages()
+
+    with db.transaction():
+        stored, failed = asyncio.run(_ingest(pages))
+        _finish_read(new_history_id, failed)
+
+    # Only ids travel through the graph; later nodes read rows from SQLite
+    state["email_ids"] = leftover + stored
+    state["counters"] = {
+        **(state.get("counters") or {}),
+        "fetched": len(stored),
+        "fetch_failed": len(failed),
+    }
     return state
 
 
@@ -145,8 +339,8 @@ VERY IMPORTANT:
 - Promotional shopping emails (Amazon, Target, clothing brands, etc.) are **NOT** urgent_action.
 - If you are unsure, choose **newsletter**, NOT urgent_action.
 
-Return ONLY the category name as plain text: one of:
-urgent_action, newsletter, weekend_reading, ignore.
+Return ONLY a JSON object of the form {"category": "<name>"} where <name> is
+one of: urgent_action, newsletter, weekend_reading, ignore.
 """
 
 ALLOWED_CATEGORIES = {
@@ -156,122 +350,543 @@ ALLOWED_CATEGORIES = {
     "weekend_reading",
 }
 
-def _extract_category(raw: str) -> str:
+# Ollama `format` schemas: decoding is constrained to these, so the
+# categorizer can only emit one allowed category
+CATEGORY_SCHEMA = {
+    "type": "object",
+    "properties": {"category": {"type": "string", "enum": sorted(ALLOWED_CATEGORIES)}},
+    "required": ["category"],
+}
+# Output caps (num_predict); `{"category": "weekend_reading"}` is ~10 tokens
+CATEGORIZE_MAX_TOKENS = int(os.getenv("CATEGORIZE_MAX_TOKENS", "16"))
+
+# Per-purpose LLM counters: calls, parse_failures, output_tokens
+_llm_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _llm_options(num_predict: int) -> Dict[str, Any]:
     """
-    Take the raw LLM output and map it to one of the allowed categories.
-    Very tolerant: looks for known keywords inside the text.
+    Ollama options for one call: the client's defaults plus an output cap.
     """
+    client = _llm()
+    return {"temperature": client.temperature, "num_ctx": client.num_ctx, "num_predict": num_predict}
+
+
+def _count_llm(kind: str, resp: Any, parsed: bool):
+    stats = _llm_stats.setdefault(kind, {"calls": 0, "parse_failures": 0, "output_tokens": 0})
+    stats["calls"] += 1
+    stats["parse_failures"] += 0 if parsed else 1
+    usage = getattr(resp, "usage_metadata", None) or {}
+    stats["output_tokens"] += usage.get("output_tokens", 0)
+
+
+def _llm_note(kind: str) -> str:
+    stats = _llm_stats.get(kind)
+    if not stats or not stats["calls"]:
+        return f"{kind}: no calls"
+    return (
+        f"{kind}: calls={stats['calls']} "
+        f"parse_failures={stats['parse_failures']} ({stats['parse_failures'] / stats['calls']:.0%}) "
+        f"avg_output_tokens={stats['output_tokens'] / stats['calls']:.1f}"
+    )
+
+
+def _extract_category(raw: str) -> tuple[str | None, bool]:
+    """
+    Map the raw LLM output to one of the allowed categories. Returns
+    (category, parsed): parsed is False when the output was not the
+    expected {"category": ...} object and the category had to be guessed
+    from keywords in the text. category is None when the output (or an
+    LLM error's empty one) names no category at all.
+    """
+    parsed = _safe_parse_json(raw or "")
+    if parsed is not None and parsed.get("category") in ALLOWED_CATEGORIES:
+        return parsed["category"], True
+
     text = (raw or "").strip().lower()
 
     # exact match first
     if text in ALLOWED_CATEGORIES:
-        return text
+        return text, False
 
     # handle formats like "category: urgent_action, ads"
     for cat in ALLOWED_CATEGORIES:
         if cat in text:
-            return cat
+            return cat, False
 
-    # last resort
-    return "weekend_reading"
+    return None, False
 
 
-def categorize_emails_node(state: EmailState) -> EmailState:
-    log.info("ENTER: categorize_emails_node")
+# Used when the server returns no logprobs (older Ollama)
+DEFAULT_LLM_CONFIDENCE = 0.7
+# LLM answer confirmed / contradicted by rules.subject_hint
+AGREEMENT_CONFIDENCE = 0.9
+DISAGREEMENT_CONFIDENCE = 0.5
 
-    emails = state.get("emails", []) or []
-    log.info(f"Categorizing {len(emails)} emails")
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def _value_logprob(logprobs: list, value: str) -> float | None:
+    """
+    Sum of the logprobs of the tokens that spell `value` in the generated
+    text, skipping the JSON punctuation around it.
+    """
+    text = "".join(t.get("token", "") for t in logprobs)
+    start = text.find(value)
+    if start == -1:
+        return None
+    end = start + len(value)
+
+    total, pos = 0.0, 0
+    for t in logprobs:
+        token = t.get("token", "")
+        if pos < end and pos + len(token) > start:
+            total += t.get("logprob", 0.0)
+        pos += len(token)
+    return total
+
+
+def _llm_confidence(
+    raw: str, category: str, parsed: bool, logprobs: list | None, hint: str | None
+) -> float:
+    """
+    Probability the model gave its own answer: exp(sum of the logprobs of
+    the category tokens). Answers that had to be dug out of free text
+    count for half. A subject hint that agrees raises the score, one that
+    disagrees caps it.
+    """
+    text = (raw or "").strip().lower()
+    if not text or category not in text:
+        return 0.0
+
+    logprob = _value_logprob(logprobs, category) if logprobs else None
+    conf = math.exp(logprob) if logprob is not None else DEFAULT_LLM_CONFIDENCE
+    if not parsed:
+        conf *= 0.5
+
+    if hint == category:
+        conf = max(conf, AGREEMENT_CONFIDENCE)
+    elif hint is not None:
+        conf = min(conf, DISAGREEMENT_CONFIDENCE)
+    return round(conf, 3)
+
+
+async def _categorize_llm(
+    jobs: list[tuple[str, str]], concurrency: int
+) -> list[tuple[str, list | None, float]]:
+    """
+    Run the categorizer prompt for each (gmail_id, content) job with at most
+    `concurrency` requests in flight. Returns (raw response, token logprobs,
+    seconds) per job, in input order; an LLM error yields an empty response.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(eid: str, content: str) -> tuple[str, list | None, float]:
+        async with sem:
+            started = time.perf_counter()
+            logprobs = None
+            try:
+                resp = await _llm().ainvoke(
+                    [
+                        {"role": "system", "content": CATEGORIZE_SYSTEM},
+                        {"role": "user", "content": content},
+                    ],
+                    format=CATEGORY_SCHEMA,
+                    options=_llm_options(CATEGORIZE_MAX_TOKENS),
+                    logprobs=True,
+                )
+                raw = resp.content if hasattr(resp, "content") else str(resp)
+                logprobs = (getattr(resp, "response_metadata", None) or {}).get("logprobs")
+                metrics.email_debug(log, eid, "[categorize] LLM raw response for %s: %r", eid, raw)
+                _count_llm("categorize", resp, _extract_category(raw)[1])
+            except Exception as ex:
+                log.error(f"[categorize] LLM error for {eid}: {ex}")
+                raw = ""
+            return raw, logprobs, time.perf_counter() - started
+
+    return await asyncio.gather(*(_one(eid, content) for eid, content in jobs))
+
 
-    updated_count = 0
+# Set KNN_ENABLED=0 to send every undecided email to the LLM
+KNN_ENABLED = os.getenv("KNN_ENABLED", "1") == "1"
+
+_knn: knn.KNNIndex | None = None
+
+
+def _knn_index() -> knn.KNNIndex | None:
+    """
+    The kNN index next to memory.db, loaded on first use; None when
+    disabled or numpy is not installed.
+    """
+    global _knn
+    if not KNN_ENABLED or not knn.available():
+        return None
+    path = knn.index_path(db.DB_PATH)
+    if _knn is None or _knn.path != path:
+        _knn = knn.KNNIndex(path)
+    return _knn
+
+
+async def _categorize_chunk(
+    emails: list[Dict[str, Any]],
+    cache: ClassificationCache,
+    index: knn.KNNIndex | None,
+    counters: Dict[str, float],
+) -> list[str]:
+    """
+    Categorize one chunk of stored emails (rules, thread inheritance,
+    cache, kNN, then the LLM) and write the results in one transaction.
+    Updates `counters` in place; returns the categorized ids.
+    """
+    # gmail_id -> (category, confidence, source)
+    categories: Dict[str, tuple[str, float, str]] = {}
+    # Threads categorized earlier (including earlier chunks), and threads
+    # seen earlier in this chunk: thread_id -> (representative gmail_id,
+    # its thread_signals)
+    known_threads = db.thread_categories({e["thread_id"] for e in emails if e.get("thread_id")})
+    run_threads: Dict[str, tuple[str, tuple]] = {}
+    # (gmail_id, representative gmail_id) resolved once the representative is decided
+    thread_members: list[tuple[str, str]] = []
+    # gmail_ids left uncategorized this run
+    failed: list[str] = []
+    # fingerprint -> gmail_ids sharing it; one kNN/LLM decision per fingerprint
+    pending: Dict[str, list[str]] = {}
+    candidates: list[tuple[str, str, str, str, str, str]] = []
 
     for e in emails:
         eid = e.get("id")
         subject = e.get("subject")
-        body = (e.get("body") or "")[:4000]
+        raw_body = e.get("body") or ""
+        body = e.get("body_normalized")
+        if body is None:
+            body = normalize_email(raw_body)
         from_addr = e.get("from")
 
-        log.info(f"[categorize] Processing gmail_id={eid} subject={subject!r}")
+        metrics.email_debug(log, eid, "[categorize] Processing gmail_id=%s subject=%r", eid, subject)
 
-        content = f"From: {from_addr}\nSubject: {subject}\nBody:\n{body}"
+        match = rules.classify(e)
+        if match is not None:
+            metrics.email_debug(log, eid, "[categorize] Rule %s for %s: %r", match.rule, eid, match.category)
+            categories[eid] = (match.category, match.confidence, "rule")
+            counters["rule_hits"] += 1
+            continue
 
-        try:
-            resp = llm.invoke(
-                [
-                    {"role": "system", "content": CATEGORIZE_SYSTEM},
-                    {"role": "user", "content": content},
-                ]
-            )
-            raw = resp.content if hasattr(resp, "content") else str(resp)
-            log.info(f"[categorize] LLM raw response: {raw!r}")
-        except Exception as ex:
-            log.error(f"[categorize] LLM error for {eid}: {ex}")
-            raw = ""
+        # A reply in a thread we already categorized keeps its category
+        # unless a cheap change detector fires
+        tid = e.get("thread_id")
+        if tid in known_threads:
+            thread_cat, thread_conf = known_threads[tid]
+            reason = rules.thread_change(e, thread_cat)
+            if reason is None:
+                conf = DEFAULT_LLM_CONFIDENCE if thread_conf is None else thread_conf
+                categories[eid] = (thread_cat, conf, "thread")
+                counters["thread_hits"] += 1
+                continue
+            metrics.email_debug(log, eid, "[categorize] Thread %s change for %s (%s), reclassifying", tid, eid, reason)
+        elif tid:
+            signals = rules.thread_signals(e)
+            if tid in run_threads and run_threads[tid][1] == signals:
+                thread_members.append((eid, run_threads[tid][0]))
+                counters["thread_hits"] += 1
+                continue
+            run_threads.setdefault(tid, (eid, signals))
+
+        fp = fingerprint(from_addr, subject, raw_body)
+        if fp in pending:
+            pending[fp].append(eid)
+            continue
 
-        cat = _extract_category(raw)
-        log.info(f"[categorize] Final category for {eid}: {cat!r}")
+        cached = cache.get(fp)
+        if cached is not None:
+            cat, conf = cached
+            metrics.email_debug(log, eid, "[categorize] Cache hit for %s: %r", eid, cat)
+            categories[eid] = (cat, DEFAULT_LLM_CONFIDENCE if conf is None else conf, "cache")
+            continue
 
-        try:
-            cur.execute(
-                """
-                UPDATE emails
-                   SET category = ?,
-                       category_confidence = ?,
-                       last_updated_at = ?
-                 WHERE gmail_id = ?
-                """,
-                (cat, 0.7, datetime.utcnow().isoformat(), eid),
-            )
-            rowcount = cur.rowcount
-            updated_count += rowcount
-            log.info(
-                f"[categorize] UPDATE emails SET category={cat!r} "
-                f"WHERE gmail_id={eid!r} → rowcount={rowcount}"
+        pending[fp] = [eid]
+        candidates.append((fp, eid, from_addr, subject, body, raw_body))
+
+    # Nearest neighbours among past mail; only undecided votes reach the LLM
+    if index is not None and candidates:
+        knn_matches = index.classify([(c[2], c[3], c[4]) for c in candidates])
+    else:
+        knn_matches = [None] * len(candidates)
+
+    llm_fps: list[str] = []
+    jobs: list[tuple[str, str]] = []
+    hints: list[str | None] = []
+    for (fp, eid, from_addr, subject, body, raw_body), knn_match in zip(candidates, knn_matches):
+        if knn_match is not None:
+            metrics.email_debug(
+                log, eid, "[categorize] kNN for %s: %r (share=%.2f margin=%.2f)",
+                eid, knn_match.category, knn_match.confidence, knn_match.margin,
             )
-        except Exception as ex:
-            log.error(f"[categorize] DB UPDATE error for {eid}: {ex}")
+            for same in pending[fp]:
+                categories[same] = (knn_match.category, knn_match.confidence, "knn")
+            counters["knn_hits"] += len(pending[fp])
+            continue
+
+        llm_fps.append(fp)
+        hints.append(rules.subject_hint(subject))
+        # body tokens the old `body[:4000]` prompt would have sent vs what we send
+        counters["raw_tokens"] += estimate_tokens(raw_body[:4000])
+        counters["prompt_tokens"] += estimate_tokens(body)
+        jobs.append((eid, f"From: {from_addr}\nSubject: {subject}\nBody:\n{body}"))
+
+    results = await _categorize_llm(jobs, LLM_CONCURRENCY) if jobs else []
+
+    for fp, hint, (raw, logprobs, seconds) in zip(llm_fps, hints, results):
+        eids = pending[fp]
+        cat, parsed = _extract_category(raw)
+        counters["llm_calls"] += 1
+        counters["llm_seconds"] += seconds
+        if cat is None:
+            # LLM error or no category in the answer: leave these emails
+            # uncategorized (no label, no calendar block, not cached); the
+            # next runs pick them up again via db.uncategorized_ids, up to
+            # CATEGORIZE_MAX_ATTEMPTS times
+            log.warning(f"[categorize] No category for {len(eids)} email(s) like {eids[0]}")
+            failed.extend(eids)
+            continue
+        conf = _llm_confidence(raw, cat, parsed, logprobs, hint)
+        cache.put(fp, cat, conf)
+        for eid in eids:
+            categories[eid] = (cat, conf, "llm")
+        metrics.email_debug(
+            log, eids[0], "[categorize] Final category for %s: %r confidence=%.2f (%.2fs)",
+            eids[0], cat, conf, seconds,
+        )
+
+    for eid, rep in thread_members:
+        if rep not in categories:
+            # representative left for retry; so is the rest of its thread
+            failed.append(eid)
+            continue
+        cat, conf, _ = categories[rep]
+        categories[eid] = (cat, conf, "thread")
+
+    with db.transaction():
+        db.update_categories(
+            (eid, cat, conf, source) for eid, (cat, conf, source) in categories.items()
+        )
+        given_up = db.record_categorize_failures(failed, CATEGORIZE_MAX_ATTEMPTS)
+    counters["llm_failed"] += len(failed)
+    counters["given_up"] += len(given_up)
+    if given_up:
+        log.warning(
+            f"[categorize] Giving up on {len(given_up)} email(s) after "
+            f"{CATEGORIZE_MAX_ATTEMPTS} failed attempts, left uncategorized: {', '.join(given_up)}"
+        )
+    counters["uncertain"] += sum(
+        1 for _, conf, _ in categories.values() if conf < VALIDATION_THRESHOLD
+    )
+    return list(categories)
+
+
+def _start_categorize() -> tuple[ClassificationCache, knn.KNNIndex | None, Dict[str, float]]:
+    """
+    Classification cache, synced kNN index and zeroed counters for one run.
+    """
+    cache = ClassificationCache(db.get_connection(), prompt_version(LLM_MODEL, CATEGORIZE_SYSTEM))
+    _llm_stats.pop("categorize", None)
+
+    index = _knn_index()
+    if index is not None:
+        synced = index.sync(db.get_connection())
+        if synced:
+            index.save()
+            log.info(f"[categorize] kNN index synced {synced} rows ({len(index)} total)")
+
+    counters: Dict[str, float] = dict.fromkeys(
+        ("rule_hits", "knn_hits", "thread_hits", "llm_calls", "llm_seconds",
+         "llm_failed", "given_up", "raw_tokens", "prompt_tokens", "uncertain"),
+        0,
+    )
+    return cache, index, counters
+
+
+def _finish_categorize(
+    state: EmailState,
+    total: int,
+    categorized: list[str],
+    cache: ClassificationCache,
+    index: knn.KNNIndex | None,
+    counters: Dict[str, float],
+    elapsed: float,
+):
+    """
+    Evict stale cache entries and record the run's categorize counters and
+    notes in `state`.
+    """
+    with db.transaction():
+        evicted = cache.evict()
+    state["categorized_ids"] = categorized
+
+    rate = len(categorized) / elapsed if elapsed > 0 else 0.0
+    llm_calls = int(counters["llm_calls"])
+    avg_latency = counters["llm_seconds"] / llm_calls if llm_calls else 0.0
+    rule_hits, knn_hits, thread_hits = (
+        int(counters[k]) for k in ("rule_hits", "knn_hits", "thread_hits")
+    )
+    bypass = rule_hits / total if total else 0.0
+    if llm_calls:
+        avg_raw = counters["raw_tokens"] / llm_calls
+        avg_prompt = counters["prompt_tokens"] / llm_calls
+        token_note = (
+            f", avg body tokens {avg_raw:.0f} -> {avg_prompt:.0f} "
+            f"({1 - avg_prompt / avg_raw if avg_raw else 0:.0%} smaller)"
+        )
+    else:
+        token_note = ""
+
+    stats = cache.stats()
+    state["counters"] = {
+        **(state.get("counters") or {}),
+        "categorized": len(categorized),
+        "llm_calls": llm_calls,
+        "rule_hits": rule_hits,
+        "knn_hits": knn_hits,
+        "thread_hits": thread_hits,
+        "cache_hits": stats["hits"],
+        "categorize_failed": int(counters["llm_failed"]),
+    }
+    state["notes"] = state.get("notes", "") + (
+        f"\n[CATEGORIZE] {len(categorized)} emails in {elapsed:.1f}s ({rate:.2f} emails/sec), "
+        f"llm_calls={llm_calls} avg_llm_latency={avg_latency:.2f}s "
+        f"concurrency={LLM_CONCURRENCY}, rules={rule_hits} ({bypass:.0%} bypassed LLM), "
+        f"knn={knn_hits} (index {len(index) if index is not None else 'off'}), "
+        f"thread_inherited={thread_hits} (LLM calls saved), "
+        f"cache hits={stats['hits']} misses={stats['misses']} evicted={evicted}, "
+        f"below confidence {VALIDATION_THRESHOLD}={int(counters['uncertain'])}, "
+        f"left uncategorized for retry={int(counters['llm_failed'] - counters['given_up'])} "
+        f"given up={int(counters['given_up'])}"
+        f"{token_note}"
+        f"\n[CATEGORIZE] {_llm_note('categorize')}"
+    )
+    log.info(
+        f"EXIT: categorize updated_count={len(categorized)} "
+        f"llm_calls={llm_calls} rule_hits={rule_hits} knn_hits={knn_hits} "
+        f"thread_hits={thread_hits} emails_per_sec={rate:.2f} "
+        f"cache_hits={stats['hits']} cache_misses={stats['misses']}"
+    )
+
+
+def categorize_emails_node(state: EmailState) -> EmailState:
+    """
+    Categorize the emails stored by read_emails this run. Rows are
+    streamed from SQLite CATEGORIZE_CHUNK at a time, so memory does not
+    grow with the size of the backlog; results are written per chunk.
+    """
+    log.info("ENTER: categorize_emails_node")
+
+    ids = state.get("email_ids", []) or []
+    log.info(f"Categorizing {len(ids)} emails")
+
+    cache, index, counters = _start_categorize()
+    started = time.perf_counter()
+    categorized: list[str] = []
+
+    async def _all_chunks():
+        # One event loop for every chunk: the LLM client's pooled
+        # connections belong to the loop that opened them
+        for emails in db.iter_emails(ids, CATEGORIZE_CHUNK):
+            categorized.extend(await _categorize_chunk(emails, cache, index, counters))
 
-    conn.commit()
-    conn.close()
-    log.info(f"EXIT: categorize_emails_node updated_count={updated_count}")
+    asyncio.run(_all_chunks())
 
+    _finish_categorize(
+        state, len(ids), categorized, cache, index, counters, time.perf_counter() - started
+    )
     return state
 
 # -------------------------------------------------------------------
 # Agent 3: Organizer (apply Gmail labels)
 # -------------------------------------------------------------------
 
-CATEGORY_LABEL_MAP = {
+# One entry per ALLOWED_CATEGORIES value; ignored mail is deliberately
+# left without a label
+CATEGORY_LABEL_MAP: Dict[str, str | None] = {
     "urgent_action": "AI/Urgent",
-    "ads": "AI/Ads",
-    "awaiting_reply": "AI/AwaitingReply",
-    "personal": "AI/Personal",
+    "newsletter": "AI/Newsletter",
     "weekend_reading": "AI/WeekendReading",
+    "ignore": None,
 }
 
 
+def _label_groups(
+    deltas: list[tuple[str, str | None, str | None]]
+) -> Dict[tuple[str | None, str | None], list[str]]:
+    """
+    Group (gmail_id, desired, applied) deltas by their (add, remove) change;
+    each group is one batch_modify_labels call.
+    """
+    groups: Dict[tuple[str | None, str | None], list[str]] = {}
+    for gmail_id, desired, applied in deltas:
+        groups.setdefault((desired, applied), []).append(gmail_id)
+    return groups
+
+
+def _record_labels(desired: str | None, gmail_ids: list[str], resp: Any) -> tuple[int, int]:
+    """
+    Store which ids of one label call now carry `desired` in Gmail.
+    Returns (updated, failed).
+    """
+    if not isinstance(resp, dict) or "error" in resp:
+        err = resp.get("error") if isinstance(resp, dict) else resp
+        log.error(f"[organize] Label update failed for {desired!r}: {err}")
+        return 0, len(gmail_ids)
+
+    done = []
+    failed = 0
+    for item in resp.get("results", []):
+        if "error" in item:
+            log.error(f"[organize] Label update failed for {item.get('id')}: {item['error']}")
+            failed += 1
+        else:
+            done.append((item["id"], desired))
+
+    with db.transaction():
+        return db.mark_labels_applied(done), failed
+
+
+def _sync_labels() -> tuple[int, int, int]:
+    """
+    Push only the difference between each email's desired label
+    (CATEGORY_LABEL_MAP[category]) and the label last applied in Gmail.
+    Emails with the same (add, remove) change share one batch call; failed
+    ids stay dirty and are retried next run.
+    Returns (label calls, emails updated, emails failed).
+    """
+    with db.transaction():
+        db.settle_labels(CATEGORY_LABEL_MAP)
+
+    calls = updated = failed = 0
+    for (desired, applied), gmail_ids in _label_groups(db.label_deltas(CATEGORY_LABEL_MAP)).items():
+        add_labels = [desired] if desired else []
+        remove_labels = [applied] if applied else []
+        log.info(
+            f"[organize] Labels +{add_labels} -{remove_labels} for {len(gmail_ids)} emails"
+        )
+        calls += 1
+        try:
+            resp = set_labels_bulk(gmail_ids, add_labels=add_labels, remove_labels=remove_labels)
+        except Exception as ex:
+            resp = {"error": str(ex)}
+        ok, bad = _record_labels(desired, gmail_ids, resp)
+        updated += ok
+        failed += bad
+
+    return calls, updated, failed
+
+
 def organize_emails_node(state: EmailState) -> EmailState:
     log.info("ENTER: organize_emails_node")
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    rows = cur.execute(
-        "SELECT gmail_id, category FROM emails WHERE category IS NOT NULL"
-    ).fetchall()
-
-    for gmail_id, cat in rows:
-        label = CATEGORY_LABEL_MAP.get(cat)
-        if not label:
-            continue
 
-        log.info(f"[organize] Setting label {label!r} for {gmail_id}")
-        resp = set_email_labels(gmail_id, add_labels=[label])
-        if isinstance(resp, dict) and "error" in resp:
-            log.error(f"[organize] Label update failed for {gmail_id}: {resp['error']}")
+    calls, updated, failed = _sync_labels()
 
-    conn.close()
-    log.info("EXIT: organize_emails_node")
+    state["counters"] = {**(state.get("counters") or {}), "label_calls": calls, "labeled": updated}
+    state["notes"] = state.get("notes", "") + (
+        f"\n[ORGANIZE] label_calls={calls} updated={updated} failed={failed}"
+    )
+    log.info(f"EXIT: organize_emails_node label_calls={calls} updated={updated} failed={failed}")
     return state
 
 
@@ -280,28 +895,20 @@ def organize_emails_node(state: EmailState) -> EmailState:
 # Agent 4: Scheduler (Calendar blocks)
 # -------------------------------------------------------------------
 
-def scheduler_node(state: EmailState) -> EmailState:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    urgent = cur.execute(
-        "SELECT subject, gmail_id FROM emails WHERE category='urgent_action'"
-    ).fetchall()
-    weekend = cur.execute(
-        "SELECT subject, gmail_id FROM emails WHERE category='weekend_reading'"
-    ).fetchall()
-
+def _calendar_blocks(
+    urgent: list[tuple[str, str, str]], weekend: list[tuple[str, str, str]]
+) -> list[tuple[str, str, str]]:
+    """
+    (summary, start_iso, end_iso) for each thread head from db.thread_heads.
+    """
     now = datetime.now()
+    blocks = []
 
     # Urgent: block today/tomorrow (simple: 2 hours from now, 30 min)
-    for subj, gid in urgent:
+    for _, subj, gid in urgent:
         start = now + timedelta(hours=2)
         end = start + timedelta(minutes=30)
-        create_calendar_block(
-            summary=f"Process urgent email: {subj}",
-            start_iso=start.isoformat(),
-            end_iso=end.isoformat(),
-        )
+        blocks.append((f"Process urgent email: {subj}", start.isoformat(), end.isoformat()))
 
     # Weekend reading: Saturday at 10 AM (next Saturday)
     if weekend:
@@ -309,14 +916,29 @@ def scheduler_node(state: EmailState) -> EmailState:
         weekend_start = next_saturday.replace(hour=10, minute=0, second=0, microsecond=0)
         weekend_end = weekend_start + timedelta(hours=1)
 
-        for subj, gid in weekend:
-            create_calendar_block(
-                summary=f"Weekend reading: {subj}",
-                start_iso=weekend_start.isoformat(),
-                end_iso=weekend_end.isoformat(),
+        for _, subj, gid in weekend:
+            blocks.append(
+                (f"Weekend reading: {subj}", weekend_start.isoformat(), weekend_end.isoformat())
             )
+    return blocks
+
+
+def scheduler_node(state: EmailState) -> EmailState:
+    """
+    Calendar blocks for this run's urgent and weekend-reading mail, one
+    per thread: replies that inherited their thread's category do not get
+    a block of their own.
+    """
+    new_ids = state.get("categorized_ids", []) or []
+    urgent = db.thread_heads(new_ids, "urgent_action")
+    weekend = db.thread_heads(new_ids, "weekend_reading")
 
-    conn.close()
+    for summary, start_iso, end_iso in _calendar_blocks(urgent, weekend):
+        create_calendar_block(summary=summary, start_iso=start_iso, end_iso=end_iso)
+
+    state["notes"] = state.get("notes", "") + (
+        f"\n[SCHEDULE] calendar blocks: urgent={len(urgent)} weekend={len(weekend)} (one per thread)"
+    )
     return state
 
 
@@ -328,11 +950,10 @@ VALIDATOR_SYSTEM_PROMPT = """
 You are validating email triage categories.
 
 Allowed categories:
-1. urgent_action – important and needs immediate attention.
-2. ads – advertisements, marketing, newsletters with no action.
-3. awaiting_reply – not urgent but awaiting my reply or follow-up.
-4. personal – personal, family, or friends.
-5. weekend_reading – interesting but no urgency, fine to read on the weekend.
+1. urgent_action – needs personal action within the next 48 hours.
+2. newsletter – marketing, promotions, recurring newsletters with no action.
+3. weekend_reading – interesting but no urgency, fine to read on the weekend.
+4. ignore – spam, junk, or irrelevant.
 
 You will receive:
 - the current category assigned by a previous agent
@@ -355,128 +976,590 @@ If it is wrong:
 }
 """
 
+# Ollama `format` schemas for the validator verdicts
+_VERDICT_PROPERTIES = {
+    "keep": {"type": "boolean"},
+    "new_category": {"enum": [*sorted(ALLOWED_CATEGORIES), None]},
+    "reason": {"type": "string", "maxLength": 100},
+}
+VALIDATION_SCHEMA = {
+    "type": "object",
+    "properties": _VERDICT_PROPERTIES,
+    "required": list(_VERDICT_PROPERTIES),
+}
+
+
+def _batch_schema(n: int) -> Dict[str, Any]:
+    return {
+        "type": "array",
+        "minItems": n,
+        "maxItems": n,
+        "items": {
+            "type": "object",
+            "properties": {"gmail_id": {"type": "string"}, **_VERDICT_PROPERTIES},
+            "required": ["gmail_id", *_VERDICT_PROPERTIES],
+        },
+    }
+
+
+VALIDATOR_BATCH_SYSTEM_PROMPT = """
+You are validating email triage categories for several emails at once.
+
+Allowed categories:
+1. urgent_action – needs personal action within the next 48 hours.
+2. newsletter – marketing, promotions, recurring newsletters with no action.
+3. weekend_reading – interesting but no urgency, fine to read on the weekend.
+4. ignore – spam, junk, or irrelevant.
+
+You will receive a numbered list of emails. Each has a gmail_id, the
+current category assigned by a previous agent, and the subject, snippet
+and start of the body.
+
+You MUST respond with a STRICT JSON array only, no extra text, with
+exactly one object per email, in the same order:
+
+[
+  {"gmail_id": "<id>", "keep": true, "new_category": null, "reason": "short explanation"},
+  {"gmail_id": "<id>", "keep": false, "new_category": "<one_of_allowed>", "reason": "short explanation"}
+]
+"""
+
+# Emails per batched validator request (1 = per-email prompts only);
+# the real batch size also shrinks to fit LLM_NUM_CTX
+VALIDATE_BATCH_SIZE = int(os.getenv("VALIDATE_BATCH_SIZE", "8"))
+# Body budget per email inside a batch, and output tokens allowed per
+# verdict (reserved in the context window and used as the num_predict cap)
+VALIDATE_BATCH_BODY_TOKENS = int(os.getenv("VALIDATE_BATCH_BODY_TOKENS", "160"))
+VALIDATE_OUTPUT_TOKENS = int(os.getenv("VALIDATE_OUTPUT_TOKENS", "64"))
 
-def _safe_parse_json(text: str) -> Dict[str, Any]:
+
+def _safe_parse_json(text: str) -> Dict[str, Any] | None:
     """
-    Tries to parse JSON from the model output.
-    Falls back to a default 'keep' if parsing fails.
+    Tries to parse a JSON object from the model output.
+    Returns None if there is none.
     """
     try:
-        return json.loads(text)
+        parsed = json.loads(text)
     except Exception:
+        parsed = None
         start = text.find("{")
         end = text.rfind("}")
         if start != -1 and end != -1 and end > start:
             try:
-                return json.loads(text[start : end + 1])
+                parsed = json.loads(text[start : end + 1])
             except Exception:
                 pass
-    return {"keep": True, "new_category": None, "reason": "fallback_keep"}
+    return parsed if isinstance(parsed, dict) else None
 
 
-def validator_node(state: EmailState) -> EmailState:
+def _parse_json_array(text: str) -> list | None:
     """
-    Iterate through categorized emails and let the LLM
-    confirm or correct the category. If corrected, update DB and Gmail labels.
+    Tries to parse a JSON array from the model output.
+    Returns None if there is none.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    try:
+        parsed = json.loads(text)
+    except Exception:
+        parsed = None
+        start = text.find("[")
+        end = text.rfind("]")
+        if start != -1 and end != -1 and end > start:
+            try:
+                parsed = json.loads(text[start : end + 1])
+            except Exception:
+                pass
+    return parsed if isinstance(parsed, list) else None
 
-    rows = cur.execute(
-        """
-        SELECT gmail_id, subject, snippet, body, category
-        FROM emails
-        WHERE category IS NOT NULL
-        ORDER BY last_updated_at DESC
-        LIMIT 20
-        """
-    ).fetchall()
 
-    notes = state.get("notes", "")
+def _validator_text(row: tuple, body_budget: int) -> str:
+    gmail_id, subject, snippet, body, category, _ = row
+    return (
+        f"Current category: {category or ''}\n\n"
+        f"Subject: {subject}\n"
+        f"Snippet: {snippet or ''}\n\n"
+        f"Body:\n{truncate_to_tokens(body or '', body_budget)}"
+    )
 
-    for gmail_id, subject, snippet, body, category in rows:
-        body = body or ""
-        snippet = snippet or ""
-        current_cat = category or ""
 
-        email_text = (
-            f"Current category: {current_cat}\n\n"
-            f"Subject: {subject}\n"
-            f"Snippet: {snippet}\n\n"
-            f"Body:\n{body[:4000]}"
+def _validation_batches(rows: list[tuple]) -> list[list[tuple]]:
+    """
+    Greedily pack rows into batches of at most VALIDATE_BATCH_SIZE whose
+    prompt plus expected output fits the model's context window.
+    """
+    budget = LLM_NUM_CTX - estimate_tokens(VALIDATOR_BATCH_SYSTEM_PROMPT)
+    batches: list[list[tuple]] = []
+    batch: list[tuple] = []
+    used = 0
+    for row in rows:
+        cost = (
+            estimate_tokens(_validator_text(row, VALIDATE_BATCH_BODY_TOKENS))
+            + VALIDATE_OUTPUT_TOKENS
         )
+        if batch and (len(batch) >= VALIDATE_BATCH_SIZE or used + cost > budget):
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(row)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
 
-        resp = llm.invoke(
-            [
-                {"role": "system", "content": VALIDATOR_SYSTEM_PROMPT},
-                {"role": "user", "content": email_text},
-            ]
-        )
 
-        raw_text = resp.content if hasattr(resp, "content") else str(resp)
-        parsed = _safe_parse_json(raw_text)
-
-        keep = bool(parsed.get("keep", True))
-        new_category = parsed.get("new_category")
-        reason = parsed.get("reason", "")
-
-        if keep or not new_category:
-            cur.execute(
-                """
-                UPDATE emails
-                   SET category_confidence = ?,
-                       last_updated_at = ?
-                 WHERE gmail_id = ?
-                """,
-                (0.9, datetime.utcnow().isoformat(), gmail_id),
-            )
-            notes += f"\n[VALIDATOR] Kept category '{current_cat}' for {gmail_id}: {reason}"
-            continue
+def _validate_one(row: tuple) -> Dict[str, Any] | None:
+    """
+    Per-email validator prompt; None when the output is not a JSON object.
+    """
+    resp = _llm().invoke(
+        [
+            {"role": "system", "content": VALIDATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": _validator_text(row, BODY_TOKEN_BUDGET)},
+        ],
+        format=VALIDATION_SCHEMA,
+        options=_llm_options(VALIDATE_OUTPUT_TOKENS),
+    )
+    raw_text = resp.content if hasattr(resp, "content") else str(resp)
+    parsed = _safe_parse_json(raw_text)
+    if parsed is not None and "keep" not in parsed:
+        parsed = None
+    _count_llm("validate", resp, parsed is not None)
+    if parsed is None:
+        log.warning(f"[validate] Unparseable validator output for {row[0]}: {raw_text!r}")
+    return parsed
+
 
-        new_category = str(new_category).strip()
-        if new_category not in ALLOWED_CATEGORIES:
-            notes += (
-                f"\n[VALIDATOR] Ignored unknown new_category '{new_category}' "
-                f"for {gmail_id}, keeping '{current_cat}'."
+def _validate_batch(batch: list[tuple]) -> Dict[str, Dict[str, Any]]:
+    """
+    One request for the whole batch. Returns gmail_id -> verdict for the
+    well-formed entries; ids missing from the result need a per-email retry.
+    """
+    items = "\n\n".join(
+        f"### Email {i} (gmail_id: {row[0]})\n{_validator_text(row, VALIDATE_BATCH_BODY_TOKENS)}"
+        for i, row in enumerate(batch, 1)
+    )
+    resp = _llm().invoke(
+        [
+            {"role": "system", "content": VALIDATOR_BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": items},
+        ],
+        format=_batch_schema(len(batch)),
+        options=_llm_options(VALIDATE_OUTPUT_TOKENS * len(batch) + 8),
+    )
+    raw_text = resp.content if hasattr(resp, "content") else str(resp)
+    parsed = _parse_json_array(raw_text)
+    _count_llm("validate_batch", resp, parsed is not None)
+    if parsed is None:
+        log.warning(f"[validate] Unparseable batch output for {len(batch)} emails: {raw_text!r}")
+        return {}
+
+    wanted = {row[0] for row in batch}
+    verdicts = {}
+    for item in parsed:
+        if isinstance(item, dict) and str(item.get("gmail_id")) in wanted and "keep" in item:
+            verdicts[str(item["gmail_id"])] = item
+    return verdicts
+
+
+def _uncertain_batches(ids: list[str]):
+    for rows in db.iter_uncertain_emails(ids, VALIDATION_THRESHOLD):
+        yield from _validation_batches(rows)
+
+
+def validator_node(state: EmailState) -> EmailState:
+    """
+    Let the LLM confirm or correct the emails categorized this run whose
+    confidence is below VALIDATION_THRESHOLD. If corrected, update DB and
+    Gmail labels. Confident rows are not re-checked.
+
+    Rows are validated VALIDATE_BATCH_SIZE at a time in one prompt; any
+    email the batch answer does not cover cleanly is re-asked on its own.
+    """
+    new_ids = state.get("categorized_ids", []) or []
+
+    notes = state.get("notes", "")
+    kept: list[tuple[str, str, float, str]] = []
+    changed: list[tuple[str, str, float, str]] = []
+
+    _llm_stats.pop("validate", None)
+    _llm_stats.pop("validate_batch", None)
+    started = time.perf_counter()
+    llm_calls = fallbacks = unparsed = validated = 0
+    ignored = 0
+    for batch in _uncertain_batches(new_ids):
+        validated += len(batch)
+        verdicts: Dict[str, Dict[str, Any]] = {}
+        if len(batch) > 1:
+            verdicts = _validate_batch(batch)
+            llm_calls += 1
+
+        for row in batch:
+            gmail_id, category, confidence = row[0], row[4], row[5]
+            current_cat = category or ""
+            metrics.email_debug(log, gmail_id, "[validate] %s %r confidence=%s", gmail_id, current_cat, confidence)
+
+            parsed = verdicts.get(gmail_id)
+            if parsed is None:
+                if len(batch) > 1:
+                    fallbacks += 1
+                parsed = _validate_one(row)
+                llm_calls += 1
+            if parsed is None:
+                # Leave the row as it is; it stays below the threshold
+                unparsed += 1
+                continue
+
+            keep = bool(parsed.get("keep", True))
+            new_category = parsed.get("new_category")
+            reason = parsed.get("reason", "")
+
+            if keep or not new_category:
+                kept.append((gmail_id, current_cat, 0.9, "validator"))
+                metrics.email_debug(log, gmail_id, "[validate] Kept category '%s' for %s: %s", current_cat, gmail_id, reason)
+                continue
+
+            new_category = str(new_category).strip()
+            if new_category not in ALLOWED_CATEGORIES:
+                ignored += 1
+                log.info(
+                    f"[validate] Ignored unknown new_category '{new_category}' "
+                    f"for {gmail_id}, keeping '{current_cat}'."
+                )
+                continue
+
+            changed.append((gmail_id, new_category, 0.85, "validator"))
+
+            log.info(
+                f"[validate] Updated {gmail_id}: '{current_cat}' → '{new_category}' "
+                f"({reason})"
             )
-            continue
 
-        cur.execute(
-            """
-            UPDATE emails
-               SET category = ?,
-                   category_confidence = ?,
-                   last_updated_at = ?
-             WHERE gmail_id = ?
-            """,
-            (new_category, 0.85, datetime.utcnow().isoformat(), gmail_id),
-        )
+    elapsed = time.perf_counter() - started
+    rate = validated / elapsed if elapsed > 0 and validated else 0.0
+    notes += (
+        f"\n[VALIDATOR] validated {validated} of {len(new_ids)} new emails "
+        f"below confidence {VALIDATION_THRESHOLD} ({len(new_ids) - validated} LLM calls skipped)"
+        f"\n[VALIDATOR] kept={len(kept)} changed={len(changed)} ignored={ignored}, "
+        f"llm_calls={llm_calls} batch_size<={VALIDATE_BATCH_SIZE} "
+        f"per_email_fallbacks={fallbacks} unparsed={unparsed} "
+        f"({rate:.2f} emails/sec)"
+        f"\n[VALIDATOR] {_llm_note('validate_batch')}; {_llm_note('validate')}"
+    )
+
+    with db.transaction():
+        db.update_categories(kept + changed)
+
+    # Gmail labels for corrected categories go through the same delta sync
+    if changed:
+        calls, updated, failed = _sync_labels()
+        notes += f"\n[VALIDATOR] label_calls={calls} updated={updated} failed={failed}"
+
+    state["counters"] = {
+        **(state.get("counters") or {}),
+        "validated": validated,
+        "validator_changed": len(changed),
+        "validator_llm_calls": llm_calls,
+    }
+    state["notes"] = notes
+    return state
+
+
+# -------------------------------------------------------------------
+# Pipelined run: fetch -> categorize -> label -> schedule
+# -------------------------------------------------------------------
+
+# Batches buffered between two pipeline stages. A full queue makes the
+# stage feeding it wait (backpressure), so memory stays bounded however
+# far the fetcher could run ahead.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
 
-        old_label = CATEGORY_LABEL_MAP.get(current_cat)
-        new_label = CATEGORY_LABEL_MAP.get(new_category)
+# End-of-input marker passed down each queue
+_DONE = None
 
-        add_labels = [new_label] if new_label else []
-        remove_labels = [old_label] if old_label else []
 
+class _PipelineProgress:
+    """
+    Per-stage counts and queue depths of a pipelined run. Every finished
+    batch is reported to the LangGraph stream writer (stream_mode="custom").
+    """
+
+    def __init__(self, queues: Dict[str, asyncio.Queue], writer: "StreamWriter", started: float):
+        self.queues = queues
+        self.writer = writer
+        self.started = started
+        self.done = dict.fromkeys(("fetched", "categorized", "labeled", "scheduled"), 0)
+        self.first_label_s: float | None = None
+        self.depth_max = dict.fromkeys(queues, 0)
+        self._depth_sum = dict.fromkeys(queues, 0)
+        self._samples = 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def advance(self, stage: str, key: str, n: int):
+        self.done[key] += n
+        depths = {name: q.qsize() for name, q in self.queues.items()}
+        self._samples += 1
+        for name, depth in depths.items():
+            self.depth_max[name] = max(self.depth_max[name], depth)
+            self._depth_sum[name] += depth
+        self.writer({
+            "stage": stage,
+            "batch": n,
+            "done": dict(self.done),
+            "queues": depths,
+            "elapsed": round(self.elapsed(), 3),
+        })
+
+    def depth_avg(self) -> Dict[str, float]:
+        return {name: total / max(self._samples, 1) for name, total in self._depth_sum.items()}
+
+
+def _drain(queue: asyncio.Queue, first: list[str]) -> tuple[list[str], bool]:
+    """
+    `first` plus every batch already waiting in `queue`, so a stage that
+    fell behind catches up in fewer calls. True once the end marker was taken.
+    """
+    ids = list(first)
+    while True:
         try:
-            if add_labels or remove_labels:
-                set_email_labels(
-                    gmail_id,
-                    add_labels=add_labels,
-                    remove_labels=remove_labels,
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return ids, False
+        if item is _DONE:
+            return ids, True
+        ids.extend(item)
+
+
+async def _fetch_stage(
+    pages,
+    leftover: list[str],
+    ids_q: asyncio.Queue,
+    out_q: asyncio.Queue,
+    progress: _PipelineProgress,
+    stored: list[str],
+    failed: list[str],
+):
+    """
+    List ids page by page and fetch new ones READ_BATCH_SIZE at a time with
+    READ_CONCURRENCY workers; each stored batch goes straight to `out_q`,
+    as do the `leftover` emails stored but not categorized by earlier runs.
+    """
+    async def _leftover():
+        for emails in db.iter_emails(leftover, READ_BATCH_SIZE):
+            await out_q.put(emails)
+
+    async def _lister():
+        seen: set[str] = set()
+        async for page in pages:
+            page = [gid for gid in page if gid not in seen]
+            seen.update(page)
+            ids = db.unknown_ids(page)
+            for i in range(0, len(ids), READ_BATCH_SIZE):
+                await ids_q.put(ids[i : i + READ_BATCH_SIZE])
+        for _ in range(READ_CONCURRENCY):
+            await ids_q.put(_DONE)
+
+    async def _worker():
+        while (ids := await ids_q.get()) is not _DONE:
+            fetched = await _fetch_emails(ids, 1)
+            with db.transaction():
+                emails, bad = _store_fetched(ids, fetched)
+            stored.extend(e["id"] for e in emails)
+            failed.extend(bad)
+            progress.advance("fetch", "fetched", len(emails))
+            if emails:
+                await out_q.put(emails)
+
+    await asyncio.gather(_leftover(), _lister(), *(_worker() for _ in range(READ_CONCURRENCY)))
+    await out_q.put(_DONE)
+
+
+async def _categorize_stage(
+    in_q: asyncio.Queue,
+    out_q: asyncio.Queue,
+    progress: _PipelineProgress,
+    cache: ClassificationCache,
+    index: knn.KNNIndex | None,
+    counters: Dict[str, float],
+    categorized: list[str],
+):
+    """
+    Categorize each stored batch as it arrives. A single worker, so thread
+    inheritance sees every earlier batch; LLM_CONCURRENCY still applies
+    within a batch.
+    """
+    while (emails := await in_q.get()) is not _DONE:
+        started = time.perf_counter()
+        ids = await _categorize_chunk(emails, cache, index, counters)
+        counters["busy_seconds"] = counters.get("busy_seconds", 0.0) + time.perf_counter() - started
+        categorized.extend(ids)
+        progress.advance("categorize", "categorized", len(ids))
+        await out_q.put(ids)
+    await out_q.put(_DONE)
+
+
+async def _label_stage(
+    in_q: asyncio.Queue,
+    out_q: asyncio.Queue,
+    progress: _PipelineProgress,
+    totals: Dict[str, int],
+):
+    """
+    Apply the Gmail labels of each categorized batch, then pass it on.
+    """
+    finished = False
+    while not finished:
+        batch = await in_q.get()
+        if batch is _DONE:
+            break
+        ids, finished = _drain(in_q, batch)
+
+        updated = 0
+        deltas = db.label_deltas(CATEGORY_LABEL_MAP, ids)
+        for (desired, applied), gmail_ids in _label_groups(deltas).items():
+            totals["label_calls"] += 1
+            try:
+                resp = await set_labels_bulk_async(
+                    gmail_ids,
+                    add_labels=[desired] if desired else [],
+                    remove_labels=[applied] if applied else [],
                 )
-        except Exception as e:
-            notes += f"\n[VALIDATOR] Failed label sync for {gmail_id}: {e}"
+            except Exception as ex:
+                resp = {"error": str(ex)}
+            ok, bad = _record_labels(desired, gmail_ids, resp)
+            updated += ok
+            totals["label_failed"] += bad
+            if ok and progress.first_label_s is None:
+                progress.first_label_s = progress.elapsed()
+
+        totals["labeled"] += updated
+        progress.advance("label", "labeled", updated)
+        await out_q.put(ids)
+    await out_q.put(_DONE)
+
+
+async def _schedule_stage(
+    in_q: asyncio.Queue,
+    progress: _PipelineProgress,
+    totals: Dict[str, int],
+):
+    """
+    Calendar blocks for each labeled batch, one per thread over the whole run.
+    """
+    scheduled: set[str] = set()
+    finished = False
+    while not finished:
+        batch = await in_q.get()
+        if batch is _DONE:
+            break
+        ids, finished = _drain(in_q, batch)
+
+        urgent = [h for h in db.thread_heads(ids, "urgent_action") if h[0] not in scheduled]
+        weekend = [h for h in db.thread_heads(ids, "weekend_reading") if h[0] not in scheduled]
+        scheduled.update(h[0] for h in urgent + weekend)
+        for summary, start_iso, end_iso in _calendar_blocks(urgent, weekend):
+            await create_calendar_block_async(summary=summary, start_iso=start_iso, end_iso=end_iso)
+
+        totals["urgent_blocks"] += len(urgent)
+        totals["weekend_blocks"] += len(weekend)
+        progress.advance("schedule", "scheduled", len(urgent) + len(weekend))
+
+
+async def _run_stages(*stages):
+    """
+    Run pipeline stages concurrently; if one fails the others are
+    cancelled instead of waiting forever on its queue.
+    """
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
-        notes += (
-            f"\n[VALIDATOR] Updated {gmail_id}: '{current_cat}' → '{new_category}' "
-            f"({reason})"
-        )
 
-    conn.commit()
-    conn.close()
+async def pipeline_node(state: EmailState, writer: "StreamWriter") -> EmailState:
+    """
+    read_emails, categorize, organize and schedule as concurrent stages
+    joined by bounded queues: a batch is labeled and scheduled as soon as
+    it has been fetched and categorized, instead of after the whole
+    mailbox. Progress is streamed to `app.astream(..., stream_mode="custom")`.
+    """
+    log.info("ENTER: pipeline_node")
+    started = time.perf_counter()
+
+    leftover = db.uncategorized_ids(CATEGORIZE_MAX_ATTEMPTS)
+    pages, new_history_id = await asyncio.to_thread(_read_pages)
+    cache, index, counters = _start_categorize()
+
+    queues = {
+        name: asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        for name in ("fetch", "categorize", "label", "schedule")
+    }
+    progress = _PipelineProgress(queues, writer, started)
+    stored: list[str] = []
+    failed: list[str] = []
+    categorized: list[str] = []
+    totals = dict.fromkeys(
+        ("label_calls", "labeled", "label_failed", "urgent_blocks", "weekend_blocks"), 0
+    )
+
+    await _run_stages(
+        _fetch_stage(
+            pages, leftover, queues["fetch"], queues["categorize"], progress, stored, failed
+        ),
+        _categorize_stage(
+            queues["categorize"], queues["label"], progress, cache, index, counters, categorized
+        ),
+        _label_stage(queues["label"], queues["schedule"], progress, totals),
+        _schedule_stage(queues["schedule"], progress, totals),
+    )
 
-    state["notes"] = notes
+    with db.transaction():
+        _finish_read(new_history_id, failed)
+    # Labels left dirty by earlier runs or failed calls
+    sweep_calls, sweep_updated, sweep_failed = await asyncio.to_thread(_sync_labels)
+
+    elapsed = progress.elapsed()
+    state["email_ids"] = leftover + stored
+    state["counters"] = {
+        **(state.get("counters") or {}),
+        "fetched": len(stored),
+        "fetch_failed": len(failed),
+    }
+    # Time spent categorizing, not waiting for fetched batches
+    _finish_categorize(
+        state, len(leftover) + len(stored), categorized, cache, index, counters,
+        counters.get("busy_seconds", 0.0),
+    )
+
+    first_label = progress.first_label_s
+    label_calls = totals["label_calls"] + sweep_calls
+    labeled = totals["labeled"] + sweep_updated
+    state["counters"].update({
+        "label_calls": label_calls,
+        "labeled": labeled,
+        "first_label_ms": round(first_label * 1000) if first_label is not None else -1,
+        **{f"queue_max_{name}": depth for name, depth in progress.depth_max.items()},
+    })
+    avg = progress.depth_avg()
+    depths = " ".join(
+        f"{name}={progress.depth_max[name]}/{avg[name]:.1f}" for name in queues
+    )
+    state["notes"] += (
+        f"\n[ORGANIZE] label_calls={label_calls} updated={labeled} "
+        f"failed={totals['label_failed'] + sweep_failed}"
+        f"\n[SCHEDULE] calendar blocks: urgent={totals['urgent_blocks']} "
+        f"weekend={totals['weekend_blocks']} (one per thread)"
+        f"\n[PIPELINE] {len(stored)} emails in {elapsed:.1f}s, first label after "
+        f"{f'{first_label:.2f}s' if first_label is not None else 'n/a'}, "
+        f"queue depth max/avg (capacity {PIPELINE_QUEUE_SIZE}): {depths}"
+    )
+    log.info(
+        f"EXIT: pipeline_node fetched={len(stored)} categorized={len(categorized)} "
+        f"labeled={labeled} elapsed={elapsed:.2f}s first_label={first_label}"
+    )
     return state
 
 
@@ -484,18 +1567,40 @@ def validator_node(state: EmailState) -> EmailState:
 # LangGraph wiring
 # -------------------------------------------------------------------
 
-def build_app():
+def build_app(streaming: bool = False):
     """
     Build and compile the LangGraph app that wires all agents together.
+
+    streaming=True runs read/categorize/organize/schedule as one pipelined
+    node (see pipeline_node) ahead of the validator; drive it with
+    `app.astream` to receive per-batch progress.
     """
-    ensure_db()
+    from langgraph.graph import StateGraph, END
+
+    db.ensure_db()
+    # Load the model while the first node is still reading mail, and open
+    # the MCP session while LangGraph compiles
+    _llm().warm_up(background=True)
+    mcp_warm_up()
     graph = StateGraph(EmailState)
 
-    graph.add_node("read_emails", read_emails_node)
-    graph.add_node("categorize", categorize_emails_node)
-    graph.add_node("organize", organize_emails_node)
-    graph.add_node("schedule", scheduler_node)
-    graph.add_node("validate", validator_node)
+    def add_node(name, fn):
+        # every node run is timed in triage_node_seconds{node=name}
+        graph.add_node(name, metrics.instrument_node(name, fn))
+
+    if streaming:
+        add_node("pipeline", pipeline_node)
+        add_node("validate", validator_node)
+        graph.set_entry_point("pipeline")
+        graph.add_edge("pipeline", "validate")
+        graph.add_edge("validate", END)
+        return graph.compile()
+
+    add_node("read_emails", read_emails_node)
+    add_node("categorize", categorize_emails_node)
+    add_node("organize", organize_emails_node)
+    add_node("schedule", scheduler_node)
+    add_node("validate", validator_node)
 
     graph.set_entry_point("read_emails")
 
@@ -0,0 +1,311 @@
+# app/knn.py
+# Nearest-neighbour classifier over the mail we have already categorized.
+# Emails are embedded with a hashed bag-of-words (words + word pairs +
+# sender domain) into a fixed-size, L2-normalized vector; a new email
+# takes the similarity-weighted vote of its top-k neighbours. The index
+# is a NumPy matrix saved next to memory.db and updated incrementally
+# from rows changed since the last sync: ids, labels and the watermark go
+# to a small .npz, the vectors to an append-only float16 file, so a save
+# writes only the rows added since the previous one.
+#
+# numpy is optional and imported on first use: without it the classifier
+# reports itself as unavailable and everything goes to the LLM as before.
+
+import os
+import re
+import zlib
+import logging
+import sqlite3
+from typing import NamedTuple
+
+np = None   # numpy, once available() has imported it
+
+KNN_DIM = int(os.getenv("KNN_DIM", "1024"))
+KNN_K = int(os.getenv("KNN_K", "7"))
+# Oldest rows are dropped above this (KNN_MAX_ROWS x KNN_DIM x 4 bytes in
+# memory, half that on disk)
+KNN_MAX_ROWS = int(os.getenv("KNN_MAX_ROWS", "20000"))
+# Below this many indexed emails the classifier abstains
+KNN_MIN_ROWS = int(os.getenv("KNN_MIN_ROWS", "200"))
+# Accept a vote only if (best - runner-up) / total >= margin and the
+# nearest neighbour is at least this similar
+KNN_MIN_MARGIN = float(os.getenv("KNN_MIN_MARGIN", "0.6"))
+KNN_MIN_SIMILARITY = float(os.getenv("KNN_MIN_SIMILARITY", "0.35"))
+# Training rows: anything not labelled by the kNN itself or inherited
+# from its thread, at or above this confidence (legacy rows without a
+# source are included)
+KNN_MIN_TRAIN_CONFIDENCE = float(os.getenv("KNN_MIN_TRAIN_CONFIDENCE", "0.8"))
+
+QUERY_CHUNK = 256
+
+# Dropped rows stay at the head of the vector file until they make up
+# this share of KNN_MAX_ROWS; then the file is rewritten without them
+COMPACT_SHARE = 0.25
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9']{1,30}")
+
+log = logging.getLogger(__name__)
+
+
+class KNNMatch(NamedTuple):
+    category: str
+    confidence: float   # vote share of the winning category
+    margin: float
+
+
+def available() -> bool:
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+def index_path(db_path: str) -> str:
+    """
+    memory.db -> memory.knn.npz (vectors in memory.knn.<generation>.f16)
+    """
+    return os.path.splitext(db_path)[0] + ".knn.npz"
+
+
+def _features(from_addr: str, subject: str, body: str) -> list[str]:
+    words = _WORD_RE.findall(f"{subject or ''} {subject or ''} {body or ''}".lower())
+    feats = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    domain = (from_addr or "").rsplit("@", 1)[-1].strip("> ").lower()
+    if domain:
+        feats.append(f"@{domain}")
+    return feats
+
+
+def vectorize(docs: list[tuple[str, str, str]], dim: int = KNN_DIM):
+    """
+    (from_addr, subject, body) -> float32 matrix of signed hashed feature
+    counts, log-scaled and L2-normalized per row.
+    """
+    mat = np.zeros((len(docs), dim), dtype=np.float32)
+    for i, doc in enumerate(docs):
+        feats = _features(*doc)
+        if not feats:
+            continue
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.uint32, count=len(feats))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        mat[i] = np.bincount(hashes % dim, weights=signs, minlength=dim)
+    np.copyto(mat, np.sign(mat) * np.log1p(np.abs(mat)))
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def training_rows(conn: sqlite3.Connection, watermark: str) -> list[tuple]:
+    """
+    (gmail_id, from_addr, subject, body, category, last_updated_at) of the
+    training rows updated after `watermark`, oldest first. Served by
+    idx_emails_last_updated, so a sync after a small run reads only the
+    rows that run touched.
+    """
+    return conn.execute(
+        """
+        SELECT gmail_id, from_addr, subject, COALESCE(body_normalized, body),
+               category, last_updated_at
+          FROM emails
+         WHERE last_updated_at > ?
+           AND category IS NOT NULL
+           AND (category_source IS NULL
+                OR (category_source NOT IN ('knn', 'thread')
+                    AND category_confidence >= ?))
+         ORDER BY last_updated_at
+        """,
+        (watermark, KNN_MIN_TRAIN_CONFIDENCE),
+    ).fetchall()
+
+
+class KNNIndex:
+    """
+    vectors (N x dim float32), with the gmail_id and category of each row.
+    `watermark` is the newest emails.last_updated_at already synced.
+
+    On disk, row i of `vectors` is row `start + i` of the vector file
+    <path stem>.<generation>.f16; rows before `start` were dropped and are
+    reclaimed when the file is compacted into the next generation.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dim: int = KNN_DIM,
+        k: int = KNN_K,
+        max_rows: int = KNN_MAX_ROWS,
+    ):
+        if not available():
+            raise RuntimeError("numpy is not installed")
+        self.path = path
+        self.dim = dim
+        self.k = k
+        self.max_rows = max_rows
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        # object arrays in memory so relabelling never truncates a string
+        self.ids = np.array([], dtype=object)
+        self.labels = np.array([], dtype=object)
+        self.watermark = ""
+        self._row: dict[str, int] = {}
+        # vector file state: generation, first live row, rows written
+        self._generation = 0
+        self._start = 0
+        self._file_rows = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _vector_path(self, generation: int) -> str:
+        return f"{os.path.splitext(self.path)[0]}.{generation}.f16"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if "vectors" in data:
+                    # single-file index from before the vector file; the
+                    # next save writes it out as generation 1
+                    vectors = data["vectors"]
+                    dim, generation, start = vectors.shape[1], 0, 0
+                else:
+                    vectors = None
+                    dim, generation, start = (int(data[k]) for k in ("dim", "generation", "start"))
+                if dim != self.dim:
+                    log.info(f"[knn] {self.path} has dim {dim}, rebuilding")
+                    return
+                ids = data["ids"].astype(object)
+                labels = data["labels"].astype(object)
+                watermark = str(data["watermark"])
+            if vectors is None:
+                # a crash between appending rows and writing the .npz can
+                # leave extra rows at the end of the file; they are ignored
+                # and overwritten by the next save
+                count = len(ids) * self.dim
+                vectors = np.fromfile(
+                    self._vector_path(generation), dtype=np.float16,
+                    count=count, offset=start * self.dim * 2,
+                )
+                if vectors.size != count:
+                    raise ValueError(f"{self._vector_path(generation)} is truncated")
+                vectors = vectors.reshape(len(ids), self.dim)
+        except Exception as ex:
+            log.warning(f"[knn] could not load {self.path}, rebuilding: {ex}")
+            return
+        self.vectors = vectors.astype(np.float32)
+        self.ids, self.labels, self.watermark = ids, labels, watermark
+        self._generation = generation
+        self._start = start
+        self._file_rows = start + len(ids) if generation else 0
+        self._row = {gid: i for i, gid in enumerate(self.ids.tolist())}
+
+    def save(self):
+        """
+        Append the rows added since the last save to the vector file (or
+        compact it into a new generation once enough rows were dropped),
+        then replace the .npz that points at it.
+        """
+        # in-memory rows already in the file; negative if rows were
+        # dropped before they were ever saved
+        saved = self._file_rows - self._start
+        compact = (
+            not self._generation
+            or saved < 0
+            or self._start > self.max_rows * COMPACT_SHARE
+        )
+        old_vectors = self._vector_path(self._generation)
+        if compact:
+            self._generation += 1
+            self._start = 0
+            with open(self._vector_path(self._generation), "wb") as fh:
+                self.vectors.astype(np.float16).tofile(fh)
+        else:
+            with open(old_vectors, "r+b") as fh:
+                fh.truncate(self._file_rows * self.dim * 2)
+                fh.seek(0, os.SEEK_END)
+                self.vectors[saved:].astype(np.float16).tofile(fh)
+        self._file_rows = self._start + len(self.vectors)
+
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp,
+            ids=self.ids.astype(str),
+            labels=self.labels.astype(str),
+            watermark=np.array(self.watermark),
+            dim=np.array(self.dim),
+            generation=np.array(self._generation),
+            start=np.array(self._start),
+        )
+        os.replace(tmp, self.path)
+        if compact and os.path.exists(old_vectors):
+            os.remove(old_vectors)
+
+    def sync(self, conn: sqlite3.Connection) -> int:
+        """
+        Add (or relabel) every training row updated since the watermark.
+        Returns the number of rows added or changed.
+        """
+        rows = training_rows(conn, self.watermark)
+        if not rows:
+            return 0
+
+        new_ids, new_docs, new_labels = [], [], []
+        for gid, from_addr, subject, body, category, _ in rows:
+            if gid in self._row:
+                self.labels[self._row[gid]] = category
+                continue
+            new_ids.append(gid)
+            new_docs.append((from_addr, subject, body))
+            new_labels.append(category)
+
+        if new_ids:
+            self.vectors = np.vstack([self.vectors, vectorize(new_docs, self.dim)])
+            self.ids = np.concatenate([self.ids, np.array(new_ids, dtype=object)])
+            self.labels = np.concatenate([self.labels, np.array(new_labels, dtype=object)])
+            if len(self.ids) > self.max_rows:
+                drop = len(self.ids) - self.max_rows
+                self.vectors = self.vectors[drop:]
+                self.ids = self.ids[drop:]
+                self.labels = self.labels[drop:]
+                self._start += drop
+            self._row = {gid: i for i, gid in enumerate(self.ids.tolist())}
+
+        self.watermark = rows[-1][5]
+        return len(rows)
+
+    def classify(self, docs: list[tuple[str, str, str]]) -> list[KNNMatch | None]:
+        """
+        Top-k cosine vote for each (from_addr, subject, body); None where the
+        index is too small or the vote is not decisive enough.
+        """
+        if len(self) < max(KNN_MIN_ROWS, 1) or not docs:
+            return [None] * len(docs)
+
+        k = min(self.k, len(self))
+        matches: list[KNNMatch | None] = []
+        for start in range(0, len(docs), QUERY_CHUNK):
+            sims = vectorize(docs[start : start + QUERY_CHUNK], self.dim) @ self.vectors.T
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+
+            for labels, weights in zip(self.labels[top], top_sims):
+                if weights.max() < KNN_MIN_SIMILARITY:
+                    matches.append(None)
+                    continue
+                votes: dict[str, float] = {}
+                for label, weight in zip(labels.tolist(), np.maximum(weights, 0).tolist()):
+                    votes[label] = votes.get(label, 0.0) + weight
+                ranked = sorted(votes.values(), reverse=True)
+                total = sum(ranked)
+                margin = (ranked[0] - (ranked[1] if len(ranked) > 1 else 0.0)) / total
+                if margin < KNN_MIN_MARGIN:
+                    matches.append(None)
+                    continue
+                best = max(votes, key=votes.get)
+                matches.append(KNNMatch(best, round(ranked[0] / total, 3), round(margin, 3)))
+        return matches
@@ -0,0 +1,290 @@
+# app/llm.py
+# Ollama backend layer: one ChatOllama client per endpoint, requests
+# routed to the endpoint with the fewest in flight, failing endpoints
+# ejected for a while, and the model warmed up and pinned in memory
+# (keep_alive) for the whole run.
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+
+# ollama and langchain_ollama are imported when the pool is built: the
+# constants below are read by modules that never talk to the model
+
+LLM_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:0.5b")
+LLM_TEMPERATURE = float(os.getenv("OLLAMA_TEMPERATURE", "0.1"))
+
+# Context window requested from Ollama; batched prompts are sized to fit it
+LLM_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+
+# Comma-separated Ollama base URLs, e.g. "http://box1:11434,http://box2:11434"
+OLLAMA_ENDPOINTS = [
+    url.strip()
+    for url in os.getenv("OLLAMA_ENDPOINTS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")).split(",")
+    if url.strip()
+]
+
+# How long Ollama keeps the model loaded after each request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Consecutive failures before an endpoint is ejected, and for how long
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "60"))
+
+log = logging.getLogger(__name__)
+
+
+def _is_backend_failure(ex: Exception) -> bool:
+    """
+    Only transport errors (connection refused/reset, timeouts) and 5xx
+    responses count against the endpoint. A 4xx (bad request, unknown
+    model) would fail on every endpoint, and anything else is a bug on
+    our side that must not eject a healthy backend.
+    """
+    import httpx
+    import ollama
+
+    if isinstance(ex, ollama.ResponseError):
+        return ex.status_code < 0 or ex.status_code >= 500
+    return isinstance(ex, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def _count_tokens(resp):
+    meta = getattr(resp, "response_metadata", None) or {}
+    metrics.inc("triage_llm_tokens_total", meta.get("prompt_eval_count") or 0, kind="prompt")
+    metrics.inc("triage_llm_tokens_total", meta.get("eval_count") or 0, kind="eval")
+
+
+class Backend:
+    """
+    One Ollama endpoint and its routing counters.
+
+    `chat` serves blocking calls. Async calls go through `achat()`: an
+    async client's pooled connections belong to the event loop that opened
+    them, and every asyncio.run() (each categorize run, each `watch`
+    cycle) brings a new loop, so each loop gets its own client.
+    """
+
+    def __init__(self, url: str, model: str, temperature: float, num_ctx: int, keep_alive: str):
+        self.url = url
+        self._settings = {
+            "model": model,
+            "base_url": url,
+            "temperature": temperature,
+            "num_ctx": num_ctx,
+            "keep_alive": keep_alive,
+        }
+        self.chat = self._new_chat()
+        # event loop -> ChatOllama; entries go away with their loop
+        self._async_chats: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+        self.outstanding = 0
+        self.served = 0
+        self.errors = 0
+        self.failures = 0          # consecutive
+        self.ejected_until = 0.0
+
+    def _new_chat(self):
+        from langchain_ollama import ChatOllama
+
+        return ChatOllama(**self._settings)
+
+    def achat(self):
+        """
+        The client for async calls on the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            chat = self._async_chats.get(loop)
+            if chat is None:
+                chat = self._async_chats[loop] = self._new_chat()
+            return chat
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class LLMPool:
+    """
+    Drop-in for a ChatOllama client (`invoke` / `ainvoke`) spread over
+    several Ollama endpoints:
+    - each request goes to the healthy endpoint with the fewest requests
+      in flight (ties go to the one that served fewer)
+    - a failed request is retried on the next endpoint; after
+      `eject_after` consecutive failures an endpoint sits out
+      `eject_seconds`
+    - `warm_up()` loads the model on every endpoint ahead of the first
+      real request
+    """
+
+    def __init__(
+        self,
+        endpoints: list[str] = OLLAMA_ENDPOINTS,
+        model: str = LLM_MODEL,
+        temperature: float = LLM_TEMPERATURE,
+        num_ctx: int = LLM_NUM_CTX,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        eject_after: int = OLLAMA_EJECT_AFTER,
+        eject_seconds: float = OLLAMA_EJECT_SECONDS,
+    ):
+        if not endpoints:
+            raise ValueError("LLMPool needs at least one Ollama endpoint")
+        self.model = model
+        self.temperature = temperature
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.backends = [
+            Backend(url, model, temperature, num_ctx, keep_alive) for url in endpoints
+        ]
+        self._lock = threading.Lock()
+        self._warm_thread: threading.Thread | None = None
+
+    # ---------------- routing ----------------
+
+    def _acquire(self, tried: set[str]) -> Backend | None:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in tried]
+            if not candidates:
+                return None
+            # All ejected: still try rather than fail the request outright
+            healthy = [b for b in candidates if b.healthy(now)] or candidates
+            backend = min(healthy, key=lambda b: (b.outstanding, b.served))
+            backend.outstanding += 1
+            return backend
+
+    def _release(self, backend: Backend, error: Exception | None = None):
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                backend.served += 1
+                backend.failures = 0
+                backend.ejected_until = 0.0
+                return
+            if not _is_backend_failure(error):
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.eject_after:
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+                log.warning(
+                    f"[llm] ejecting {backend.url} for {self.eject_seconds:.0f}s "
+                    f"after {backend.failures} failures: {error}"
+                )
+
+    def invoke(self, messages, **kwargs):
+        tried: set[str] = set()
+        while True:
+            backend = self._acquire(tried)
+            try:
+                with metrics.timed("triage_llm_request_seconds", endpoint=backend.url):
+                    resp = backend.chat.invoke(messages, **kwargs)
+            except Exception as ex:
+                self._release(backend, ex)
+                tried.add(backend.url)
+                if not _is_backend_failure(ex) or len(tried) == len(self.backends):
+                    raise
+                log.warning(f"[llm] {backend.url} failed ({ex}), retrying on another endpoint")
+                continue
+            self._release(backend)
+            _count_tokens(resp)
+            return resp
+
+    async def ainvoke(self, messages, **kwargs):
+        tried: set[str] = set()
+        while True:
+            backend = self._acquire(tried)
+            try:
+                with metrics.timed("triage_llm_request_seconds", endpoint=backend.url):
+                    resp = await backend.achat().ainvoke(messages, **kwargs)
+            except Exception as ex:
+                self._release(backend, ex)
+                tried.add(backend.url)
+                if not _is_backend_failure(ex) or len(tried) == len(self.backends):
+                    raise
+                log.warning(f"[llm] {backend.url} failed ({ex}), retrying on another endpoint")
+                continue
+            self._release(backend)
+            _count_tokens(resp)
+            return resp
+
+    # ---------------- warm-up ----------------
+
+    def _warm(self, backend: Backend) -> bool:
+        import ollama
+
+        # An empty chat request loads the model without generating anything
+        started = time.perf_counter()
+        try:
+            ollama.Client(host=backend.url).chat(
+                model=self.model, messages=[], keep_alive=self.keep_alive
+            )
+        except Exception as ex:
+            with self._lock:
+                backend.errors += 1
+                backend.failures = self.eject_after
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+            log.warning(f"[llm] warm-up failed on {backend.url}, ejected: {ex}")
+            return False
+        log.info(
+            f"[llm] {self.model} warm on {backend.url} "
+            f"in {time.perf_counter() - started:.1f}s (keep_alive={self.keep_alive})"
+        )
+        return True
+
+    def warm_up(self, background: bool = False) -> int | None:
+        """
+        Load the model on every endpoint in parallel. With `background`
+        this returns immediately and the warm-up overlaps whatever runs
+        next (e.g. reading mail); otherwise returns the number of
+        endpoints that came up.
+        """
+        def _run() -> int:
+            with ThreadPoolExecutor(max_workers=len(self.backends)) as pool:
+                return sum(pool.map(self._warm, self.backends))
+
+        if not background:
+            return _run()
+        with self._lock:
+            if self._warm_thread is None or not self._warm_thread.is_alive():
+                self._warm_thread = threading.Thread(target=_run, name="llm-warm-up", daemon=True)
+                self._warm_thread.start()
+        return None
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": b.url,
+                    "served": b.served,
+                    "errors": b.errors,
+                    "outstanding": b.outstanding,
+                    "ejected": not b.healthy(now),
+                }
+                for b in self.backends
+            ]
+
+
+_pool: LLMPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_llm() -> LLMPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMPool()
+        return _pool
+
+
+def llm_stats() -> list[dict]:
+    return _pool.stats() if _pool is not None else []
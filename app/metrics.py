@@ -0,0 +1,268 @@
+# app/metrics.py
+# In-process instrumentation: latency histograms and counters for graph
+# nodes, MCP tool calls, Ollama requests and SQLite transactions, exported
+# as Prometheus text or a JSON summary at the end of a run. Also decides
+# which emails get per-email debug lines in agent.log.
+
+import os
+import json
+import time
+import zlib
+import logging
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+
+# METRICS_ENABLED=0 turns every timer and counter into a no-op
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Written at the end of each run (each cycle under `watch`): Prometheus
+# text if the name ends in .prom, a JSON summary otherwise
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+
+# Share of emails whose per-email debug lines are logged (LOG_LEVEL=DEBUG)
+EMAIL_LOG_SAMPLE = float(os.getenv("EMAIL_LOG_SAMPLE", "0.01"))
+
+# Histogram upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+# Where a run spends its time, by histogram
+SOURCES = {
+    "gmail": "triage_mcp_call_seconds",
+    "ollama": "triage_llm_request_seconds",
+    "sqlite": "triage_sqlite_transaction_seconds",
+}
+
+
+class Histogram:
+    """
+    Count, sum, max and per-bucket counts of observed durations.
+    """
+
+    __slots__ = ("count", "sum", "max", "counts")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.counts = [0] * len(BUCKETS)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate by linear interpolation inside the bucket holding rank q,
+        as Prometheus' histogram_quantile does; capped at the observed max.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(BUCKETS, self.counts):
+            if n and seen + n >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.max
+
+
+_lock = threading.Lock()
+_histograms: dict[tuple[str, tuple], Histogram] = {}
+_counters: dict[tuple[str, tuple], float] = {}
+
+
+def _key(name: str, labels: dict) -> tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram()
+        hist.observe(seconds)
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Observe the duration of the block in histogram `name`. A block that
+    raises is still timed and also counts in `<name>_errors_total`.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc(f"{name.removesuffix('_seconds')}_errors_total", **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def instrument_node(name: str, fn):
+    """
+    Wrap a LangGraph node (sync or async) so each run of it is timed in
+    triage_node_seconds{node=name}. The wrapper keeps fn's signature, so
+    LangGraph still injects `writer` and friends.
+    """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def _async_node(*args, **kwargs):
+            with timed("triage_node_seconds", node=name):
+                return await fn(*args, **kwargs)
+
+        return _async_node
+
+    @functools.wraps(fn)
+    def _node(*args, **kwargs):
+        with timed("triage_node_seconds", node=name):
+            return fn(*args, **kwargs)
+
+    return _node
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# -------------------------------------------------------------------
+# Export
+# -------------------------------------------------------------------
+
+def _labels_text(labels: tuple, extra: str = "") -> str:
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    parts = [f'{k}="{escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def prometheus() -> str:
+    """
+    Everything recorded so far in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = sorted((k, h.count, h.sum, list(h.counts)) for k, h in _histograms.items())
+        counters = sorted(_counters.items())
+
+    lines = []
+    last = None
+    for (name, labels), count, total, counts in histograms:
+        if name != last:
+            lines.append(f"# TYPE {name} histogram")
+            last = name
+        cumulative = 0
+        for bound, n in zip(BUCKETS, counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            le_label = f'le="{le}"'
+            lines.append(f"{name}_bucket{_labels_text(labels, le_label)} {cumulative}")
+        lines.append(f"{name}_sum{_labels_text(labels)} {total:.6f}")
+        lines.append(f"{name}_count{_labels_text(labels)} {count}")
+    for (name, labels), value in counters:
+        if name != last:
+            lines.append(f"# TYPE {name} counter")
+            last = name
+        lines.append(f"{name}{_labels_text(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> dict:
+    """
+    {"histograms": {series: {count, sum, mean, p50, p95, max}}, "counters": {series: value}}
+    with series written like Prometheus, e.g. 'triage_node_seconds{node="categorize"}'.
+    """
+    with _lock:
+        histograms = {
+            f"{name}{_labels_text(labels)}": {
+                "count": h.count,
+                "sum": round(h.sum, 4),
+                "mean": round(h.sum / h.count, 4) if h.count else 0.0,
+                "p50": round(h.quantile(0.5), 4),
+                "p95": round(h.quantile(0.95), 4),
+                "max": round(h.max, 4),
+            }
+            for (name, labels), h in sorted(_histograms.items())
+        }
+        counters = {f"{name}{_labels_text(labels)}": value for (name, labels), value in sorted(_counters.items())}
+    return {"histograms": histograms, "counters": counters}
+
+
+def time_breakdown() -> dict[str, dict]:
+    """
+    Calls and seconds spent waiting on Gmail, Ollama and SQLite. Seconds
+    are summed over concurrent calls, so they can exceed the wall time.
+    """
+    totals = {source: {"calls": 0, "seconds": 0.0} for source in SOURCES}
+    with _lock:
+        for (name, _), h in _histograms.items():
+            for source, hist_name in SOURCES.items():
+                if name == hist_name:
+                    totals[source]["calls"] += h.count
+                    totals[source]["seconds"] += h.sum
+    for t in totals.values():
+        t["seconds"] = round(t["seconds"], 3)
+    return totals
+
+
+def write(path: str):
+    """
+    Replace `path` with the current metrics (atomically, so a scraper or
+    node_exporter's textfile collector never reads half a file).
+    """
+    text = prometheus() if path.endswith(".prom") else json.dumps(summary(), indent=2)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+# -------------------------------------------------------------------
+# Sampled per-email logging
+# -------------------------------------------------------------------
+
+def email_sampled(gmail_id: str | None, rate: float = EMAIL_LOG_SAMPLE) -> bool:
+    """
+    Deterministic per id, so a sampled email is followed through every
+    stage of the run.
+    """
+    if rate >= 1:
+        return True
+    if rate <= 0 or not gmail_id:
+        return False
+    return zlib.crc32(gmail_id.encode("utf-8")) % 10000 < rate * 10000
+
+
+def email_debug(logger: logging.Logger, gmail_id: str | None, msg: str, *args):
+    """
+    logger.debug(msg, *args) for a sample of emails. Nothing is formatted
+    unless DEBUG is enabled and the email is sampled.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and email_sampled(gmail_id):
+        logger.debug(msg, *args)
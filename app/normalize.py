@@ -0,0 +1,141 @@
+# app/normalize.py
+# Email text normalization for LLM prompts: HTML -> text, drop quoted
+# replies, signatures and boilerplate footers, shorten links, and truncate
+# to a token budget rather than a character count.
+
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+# Prompt budget for the email body (qwen2.5 tokens, approximated)
+BODY_TOKEN_BUDGET = int(os.getenv("PROMPT_BODY_TOKENS", "512"))
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3",
+    "h4", "h5", "h6", "blockquote", "section", "article", "header", "footer",
+}
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript"}
+
+# First line of a quoted reply / forwarded history; everything after it goes
+_QUOTE_START_RE = re.compile(
+    r"^\s*(On .{5,200} wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|From:\s.+\n\s*(Sent|Date):\s)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SIGNATURE_RE = re.compile(
+    r"^(-- ?$|Sent from my (iPhone|iPad|Android|Samsung|mobile)|Get Outlook for )",
+    re.IGNORECASE | re.MULTILINE,
+)
+_BOILERPLATE_RE = re.compile(
+    r"(unsubscribe|privacy policy|all rights reserved|©|\(c\) \d{4}|view (it )?in (your )?browser"
+    r"|manage (your )?(email )?preferences|you are receiving this|you received this"
+    r"|this email was sent to|update your preferences|terms of (use|service)"
+    r"|confidentiality notice|intended (solely )?for the (use of the )?(addressee|recipient))",
+    re.IGNORECASE,
+)
+_URL_RE = re.compile(r"https?://[^\s<>\"')\]]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_SPACES_RE = re.compile(r"[ \t ]+")
+
+# BPE-ish pieces: runs of letters, digits, or single symbols
+_TOKEN_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html or "")
+    parser.close()
+    return "".join(parser.parts)
+
+
+def _shorten_url(match: re.Match) -> str:
+    host = urlparse(match.group(0)).netloc
+    return f"[link:{host}]" if host else ""
+
+
+def clean_text(text: str) -> str:
+    """
+    Drop quoted history, signature, '>' quote lines and boilerplate
+    footer lines; shorten links to their host; collapse whitespace.
+    """
+    text = (text or "").replace("\r\n", "\n")
+
+    quote = _QUOTE_START_RE.search(text)
+    if quote:
+        text = text[: quote.start()]
+    sig = _SIGNATURE_RE.search(text)
+    if sig:
+        text = text[: sig.start()]
+
+    text = _URL_RE.sub(_shorten_url, text)
+
+    lines = []
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith(">"):
+            continue
+        if stripped and len(stripped) < 300 and _BOILERPLATE_RE.search(stripped):
+            continue
+        lines.append(_SPACES_RE.sub(" ", stripped))
+
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Close approximation of the qwen2.5 BPE count: one token per short word
+    or symbol, long words split every ~6 letters, digits in groups of 3.
+    """
+    count = 0
+    for piece in _TOKEN_PIECE_RE.findall(text or ""):
+        count += 1 + (len(piece) - 1) // 6 if piece.isalpha() else 1
+    return count
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """
+    Longest prefix of `text` whose estimated token count fits `budget`.
+    """
+    count = 0
+    for match in _TOKEN_PIECE_RE.finditer(text or ""):
+        piece = match.group(0)
+        count += 1 + (len(piece) - 1) // 6 if piece.isalpha() else 1
+        if count > budget:
+            return text[: match.start()].rstrip()
+    return text or ""
+
+
+def normalize_email(body: str, body_html: str | None = None, budget: int = BODY_TOKEN_BUDGET) -> str:
+    """
+    Prompt-ready body text: plain text (or HTML converted to text), cleaned
+    and truncated to `budget` tokens.
+    """
+    text = body if (body or "").strip() else html_to_text(body_html or "")
+    return truncate_to_tokens(clean_text(text), budget)
@@ -0,0 +1,150 @@
+# app/rules.py
+# Deterministic pre-classifier that runs ahead of the LLM.
+# Everything is compiled once at import; classify() is a handful of set
+# lookups and regex searches per email.
+
+import os
+import re
+from email.utils import parseaddr
+from typing import Any, Dict, NamedTuple
+
+
+class RuleMatch(NamedTuple):
+    category: str
+    confidence: float
+    rule: str
+
+
+# Bulk-mail / marketing senders. Matching is by domain suffix, so
+# "news.example.com" matches an entry "example.com".
+NEWSLETTER_DOMAINS = {
+    "mailchimp.com",
+    "mcsv.net",
+    "mcdlv.net",
+    "list-manage.com",
+    "sendgrid.net",
+    "sendgrid.com",
+    "constantcontact.com",
+    "ccsend.com",
+    "hubspotemail.net",
+    "hs-email.com",
+    "klaviyomail.com",
+    "exacttarget.com",
+    "rsgsv.net",
+    "substack.com",
+    "beehiiv.com",
+    "convertkit.com",
+    "mailerlite.com",
+    "sailthru.com",
+    "cmail19.com",
+    "cmail20.com",
+    "e.target.com",
+    "marketing.amazon.com",
+}
+NEWSLETTER_DOMAINS.update(
+    d.strip().lower()
+    for d in os.getenv("RULES_NEWSLETTER_DOMAINS", "").split(",")
+    if d.strip()
+)
+
+# Subjects that must always reach the LLM, whatever the headers say
+# (bills and account notices often come from bulk senders too).
+_ACTION_SUBJECT_RE = re.compile(
+    r"\b(invoice|payment|bill|due|overdue|past due|action required|verify|"
+    r"security alert|password|appointment|reservation|confirm|deadline)\b",
+    re.IGNORECASE,
+)
+_PROMO_SUBJECT_RE = re.compile(
+    r"(\b\d{1,2}% off\b|\bsale ends\b|\bblack friday\b|\bcyber monday\b|"
+    r"\bcoupon\b|\bpromo code\b|\bflash sale\b|\bfree shipping\b|\blimited time offer\b)",
+    re.IGNORECASE,
+)
+_MARKETING_LOCALPART_RE = re.compile(
+    r"^(newsletters?|news|marketing|promo(tions)?|deals|offers|digest)([._+-].*)?$",
+    re.IGNORECASE,
+)
+_BULK_PRECEDENCE = {"bulk", "list"}
+
+
+def _domain_matches(domain: str) -> bool:
+    labels = domain.split(".")
+    return any(".".join(labels[i:]) in NEWSLETTER_DOMAINS for i in range(len(labels) - 1))
+
+
+def classify(email: Dict[str, Any]) -> RuleMatch | None:
+    """
+    Return a RuleMatch when a rule decides the category with high
+    confidence, or None to send the email to the LLM.
+
+    `email` is the dict returned by get_message
+    (labels, headers, from, subject, ...).
+    """
+    labels = set(email.get("labels") or [])
+    headers = email.get("headers") or {}
+    subject = email.get("subject") or ""
+
+    if "SPAM" in labels:
+        return RuleMatch("ignore", 0.99, "gmail_spam")
+
+    if _ACTION_SUBJECT_RE.search(subject):
+        return None
+
+    if "CATEGORY_PROMOTIONS" in labels:
+        return RuleMatch("newsletter", 0.95, "gmail_promotions")
+
+    if headers.get("List-Unsubscribe") or headers.get("List-Id"):
+        return RuleMatch("newsletter", 0.9, "list_headers")
+
+    if (headers.get("Precedence") or "").strip().lower() in _BULK_PRECEDENCE:
+        return RuleMatch("newsletter", 0.9, "precedence_bulk")
+
+    address = parseaddr(email.get("from") or "")[1].lower()
+    local, _, domain = address.partition("@")
+    if domain and _domain_matches(domain):
+        return RuleMatch("newsletter", 0.9, "marketing_domain")
+
+    if local and _MARKETING_LOCALPART_RE.match(local):
+        return RuleMatch("newsletter", 0.85, "marketing_sender")
+
+    if _PROMO_SUBJECT_RE.search(subject):
+        return RuleMatch("newsletter", 0.85, "promo_subject")
+
+    return None
+
+
+def subject_hint(subject: str) -> str | None:
+    """
+    The category the subject alone points at, or None. Too weak to decide
+    on its own, but used to check the LLM's answer for agreement.
+    """
+    subject = subject or ""
+    if _ACTION_SUBJECT_RE.search(subject):
+        return "urgent_action"
+    if _PROMO_SUBJECT_RE.search(subject):
+        return "newsletter"
+    return None
+
+
+def thread_signals(email: Dict[str, Any]) -> tuple[str | None, bool]:
+    """
+    What a message's subject points at, and whether its snippet asks for
+    action. Messages of one thread with the same signals share a category.
+    """
+    return (
+        subject_hint(email.get("subject")),
+        bool(_ACTION_SUBJECT_RE.search(email.get("snippet") or "")),
+    )
+
+
+def thread_change(email: Dict[str, Any], category: str) -> str | None:
+    """
+    Cheap check whether a new message in a thread already categorized as
+    `category` may no longer fit it. Returns the reason, or None when the
+    message can simply inherit the thread's category.
+    """
+    hint, action = thread_signals(email)
+    if hint is not None and hint != category:
+        return f"subject suggests {hint}"
+    if action and category != "urgent_action":
+        return "action words in snippet"
+    return None
@@ -1,6 +1,10 @@
-from typing import TypedDict, List, Optional, Dict, Any
+from typing import TypedDict, List, Dict
+
 
 class EmailState(TypedDict):
-    emails: List[Dict[str, Any]]  # list of emails pulled from DB/MCP
-    current_email_index: int
+    # Only ids and small counters travel between nodes; each node reads
+    # the rows it needs from SQLite (app/db.py).
+    email_ids: List[str]        # ids stored by read_emails this run
+    categorized_ids: List[str]  # ids categorized this run (scheduler/validator input)
+    counters: Dict[str, int]    # per-run counts (fetched, llm_calls, ...)
     notes: str
@@ -1,12 +1,65 @@
 # tools/gmail_calendar_tools.py
-from .mcp_client import call_tool
+from .mcp_client import call_tool, call_tool_async, mcp_stats, mcp_warm_up
 
-def list_unread_emails():
-    return call_tool("list_messages", {"q": "is:unread"})
+def list_unread_emails(page_size: int = 100, page_token: str | None = None):
+    """One page of unread messages; see `next_page_token` in the result."""
+    args = {"q": "is:unread", "max_results": page_size}
+    if page_token:
+        args["page_token"] = page_token
+    return call_tool("list_messages", args)
+
+async def list_unread_emails_async(page_size: int = 100, page_token: str | None = None):
+    args = {"q": "is:unread", "max_results": page_size}
+    if page_token:
+        args["page_token"] = page_token
+    return await call_tool_async("list_messages", args)
+
+def iter_unread_email_ids(page_size: int = 100):
+    """Yield lists of unread message ids, one list per page."""
+    page_token = None
+    while True:
+        resp = list_unread_emails(page_size, page_token)
+        if "error" in resp:
+            raise RuntimeError(f"list_messages failed: {resp['error']}")
+        yield [m["id"] for m in resp.get("messages", [])]
+        page_token = resp.get("next_page_token")
+        if not page_token:
+            return
+
+async def aiter_unread_email_ids(page_size: int = 100):
+    """Async version of iter_unread_email_ids."""
+    page_token = None
+    while True:
+        resp = await list_unread_emails_async(page_size, page_token)
+        if "error" in resp:
+            raise RuntimeError(f"list_messages failed: {resp['error']}")
+        yield [m["id"] for m in resp.get("messages", [])]
+        page_token = resp.get("next_page_token")
+        if not page_token:
+            return
+
+def get_mailbox_profile():
+    return call_tool("get_profile", {})
+
+def list_history(start_history_id: str, page_token: str | None = None):
+    args = {"start_history_id": start_history_id}
+    if page_token:
+        args["page_token"] = page_token
+    return call_tool("list_history", args)
 
 def get_email(gmail_id: str):
     return call_tool("get_message", {"id": gmail_id})
 
+async def get_email_async(gmail_id: str):
+    return await call_tool_async("get_message", {"id": gmail_id})
+
+def get_emails(gmail_ids: list[str]):
+    """Fetch many messages in one MCP call; returns {"results": [...]} in input order."""
+    return call_tool("batch_get_messages", {"ids": gmail_ids})
+
+async def get_emails_async(gmail_ids: list[str]):
+    return await call_tool_async("batch_get_messages", {"ids": gmail_ids})
+
 def set_email_labels(gmail_id: str, add_labels: list[str], remove_labels: list[str] | None = None):
     return call_tool("modify_labels", {
         "id": gmail_id,
@@ -14,9 +67,38 @@ def set_email_labels(gmail_id: str, add_labels: list[str], remove_labels: list[s
         "remove_labels": remove_labels or [],
     })
 
+async def set_email_labels_async(gmail_id: str, add_labels: list[str], remove_labels: list[str] | None = None):
+    return await call_tool_async("modify_labels", {
+        "id": gmail_id,
+        "add_labels": add_labels,
+        "remove_labels": remove_labels or [],
+    })
+
+def set_labels_bulk(gmail_ids: list[str], add_labels: list[str], remove_labels: list[str] | None = None):
+    """Apply one label change to many messages; returns per-id results."""
+    return call_tool("batch_modify_labels", {
+        "ids": gmail_ids,
+        "add_labels": add_labels,
+        "remove_labels": remove_labels or [],
+    })
+
+async def set_labels_bulk_async(gmail_ids: list[str], add_labels: list[str], remove_labels: list[str] | None = None):
+    return await call_tool_async("batch_modify_labels", {
+        "ids": gmail_ids,
+        "add_labels": add_labels,
+        "remove_labels": remove_labels or [],
+    })
+
 def create_calendar_block(summary: str, start_iso: str, end_iso: str):
     return call_tool("create_event", {
         "summary": summary,
         "start": start_iso,
         "end": end_iso,
     })
+
+async def create_calendar_block_async(summary: str, start_iso: str, end_iso: str):
+    return await call_tool_async("create_event", {
+        "summary": summary,
+        "start": start_iso,
+        "end": end_iso,
+    })
@@ -2,51 +2,248 @@
 
 import os
 import asyncio
+import atexit
 import json
-from fastmcp.client import Client
-from fastmcp.client.transports import StreamableHttpTransport
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from app import metrics
+
+# httpx and fastmcp are imported when the first session is opened, so
+# importing the tools (and `main.py --help`) stays fast
+if TYPE_CHECKING:
+    from fastmcp.client import Client
 
 # MCP server endpoint (note the /mcp path)
 MCP_BASE_URL = os.getenv("MCP_BASE_URL", "http://35.175.200.116:8001/mcp")
 
+# Connection pool / concurrency limits for the shared session
+MCP_MAX_CONNECTIONS = int(os.getenv("MCP_MAX_CONNECTIONS", "10"))
+MCP_MAX_KEEPALIVE = int(os.getenv("MCP_MAX_KEEPALIVE", "5"))
+MCP_KEEPALIVE_EXPIRY = float(os.getenv("MCP_KEEPALIVE_EXPIRY", "120"))
+MCP_TIMEOUT = float(os.getenv("MCP_TIMEOUT", "60"))
+
+log = logging.getLogger(__name__)
+
 
-async def _call_tool_async(tool_name: str, args: dict):
+def _pooled_http_client(headers=None, timeout=None, auth=None, **kwargs):
     """
-    Async helper that:
-    - creates a Client with HTTP transport
-    - connects using `async with`
-    - calls the tool
-    - unwraps CallToolResult into a plain Python value
+    httpx client factory for the MCP transport.
+    Keeps a bounded pool of keep-alive connections to the MCP server.
+    """
+    import httpx
+
+    kwargs.setdefault("follow_redirects", True)
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or httpx.Timeout(MCP_TIMEOUT),
+        auth=auth,
+        limits=httpx.Limits(
+            max_connections=MCP_MAX_CONNECTIONS,
+            max_keepalive_connections=MCP_MAX_KEEPALIVE,
+            keepalive_expiry=MCP_KEEPALIVE_EXPIRY,
+        ),
+        **kwargs,
+    )
+
+
+def _unwrap_result(result):
     """
-    transport = StreamableHttpTransport(url=MCP_BASE_URL)
-    async with Client(transport) as client:
-        result = await client.call_tool(tool_name, args)
+    Unwrap a FastMCP CallToolResult into a plain Python value.
+    """
+    # FastMCP returns a CallToolResult with `.content` list
+    # Our tools return dicts, which are encoded as JSON blocks.
+    content = getattr(result, "content", None)
+    if not content:
+        return None
+
+    first = content[0]
+
+    # Case 1: JSON-like block (preferred)
+    if hasattr(first, "data") and first.data is not None:
+        return first.data
+
+    # Case 2: text block that may contain JSON
+    if hasattr(first, "text"):
+        text = first.text
+        try:
+            return json.loads(text)
+        except Exception:
+            return text  # plain string fallback
+
+    # Fallback: just return the raw result as dict if possible
+    try:
+        return result.model_dump()
+    except Exception:
+        return result
+
+
+class MCPClientManager:
+    """
+    Long-lived MCP client:
+    - one background event loop (daemon thread)
+    - one MCP session, connected lazily and reused by every call
+    - at most `max_in_flight` concurrent tool calls over a pooled HTTP client
+
+    `handshakes` counts how many sessions were opened; in a healthy run it is 1.
+    """
+
+    def __init__(self, url: str = MCP_BASE_URL, max_in_flight: int = MCP_MAX_CONNECTIONS):
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.handshakes = 0
+        self.calls = 0
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # created inside the background loop
+        self._client: "Client | None" = None
+        self._connect_lock: asyncio.Lock | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    # ---------------- event loop ----------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    ready.set()
+                    loop.run_forever()
+
+                thread = threading.Thread(target=_run, name="mcp-client-loop", daemon=True)
+                thread.start()
+                ready.wait()
+
+                self._loop, self._thread = loop, thread
+                self._client = None
+                self._connect_lock = None
+                self._slots = None
+        return self._loop
+
+    # ---------------- session ----------------
 
-        # FastMCP returns a CallToolResult with `.content` list
-        # Our tools return dicts, which are encoded as JSON blocks.
-        content = getattr(result, "content", None)
-        if not content:
-            return None
+    async def _session(self) -> "Client":
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
 
-        first = content[0]
+        async with self._connect_lock:
+            if self._client is None or not self._client.is_connected():
+                from fastmcp.client import Client
+                from fastmcp.client.transports import StreamableHttpTransport
 
-        # Case 1: JSON-like block (preferred)
-        if hasattr(first, "data") and first.data is not None:
-            return first.data
+                transport = StreamableHttpTransport(
+                    url=self.url,
+                    httpx_client_factory=_pooled_http_client,
+                )
+                client = Client(transport)
+                await client.__aenter__()
+                self._client = client
+                self.handshakes += 1
+                log.info(f"[mcp] session opened to {self.url} (handshakes={self.handshakes})")
+        return self._client
 
-        # Case 2: text block that may contain JSON
-        if hasattr(first, "text"):
-            text = first.text
-            try:
-                return json.loads(text)
-            except Exception:
-                return text  # plain string fallback
+    async def _drop_session(self, client: "Client"):
+        async with self._connect_lock:
+            if self._client is client:
+                self._client = None
+        try:
+            await client.__aexit__(None, None, None)
+        except Exception:
+            pass
+
+    async def _call(self, tool_name: str, args: dict):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._slots:
+            client = await self._session()
+            with metrics.timed("triage_mcp_call_seconds", tool=tool_name):
+                try:
+                    result = await client.call_tool(tool_name, args)
+                except Exception:
+                    # Tool errors come back on a live session; only retry
+                    # when the connection itself went away.
+                    if client.is_connected():
+                        raise
+                    log.warning(f"[mcp] session lost during {tool_name}, reconnecting")
+                    metrics.inc("triage_mcp_reconnects_total")
+                    await self._drop_session(client)
+                    client = await self._session()
+                    result = await client.call_tool(tool_name, args)
+
+        self.calls += 1
+        return _unwrap_result(result)
+
+    # ---------------- public entry points ----------------
+
+    def call(self, tool_name: str, args: dict | None = None):
+        """
+        Blocking call from any thread other than the manager's loop thread.
+        """
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("MCPClientManager.call() used from its own event loop; use acall()")
+        future = asyncio.run_coroutine_threadsafe(self._call(tool_name, args or {}), loop)
+        return future.result()
+
+    async def acall(self, tool_name: str, args: dict | None = None):
+        """
+        Awaitable call usable from any event loop.
+        """
+        loop = self._ensure_loop()
+        coro = self._call(tool_name, args or {})
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def stats(self) -> dict:
+        return {"handshakes": self.handshakes, "calls": self.calls}
+
+    def close(self):
+        """
+        Close the MCP session and stop the background loop.
+        """
+        with self._start_lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+
+        async def _shutdown():
+            if self._client is not None:
+                client, self._client = self._client, None
+                try:
+                    await client.__aexit__(None, None, None)
+                except Exception:
+                    pass
 
-        # Fallback: just return the raw result as dict if possible
         try:
-            return result.model_dump()
+            asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout=10)
         except Exception:
-            return result
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+
+
+_manager: MCPClientManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> MCPClientManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MCPClientManager()
+            atexit.register(_manager.close)
+        return _manager
 
 
 def call_tool(tool_name: str, args: dict | None = None):
@@ -57,5 +254,34 @@ def call_tool(tool_name: str, args: dict | None = None):
         data = call_tool("list_messages", {"q": "is:unread"})
         # `data` is now a dict like {"messages": [...]} from your server tool.
     """
-    args = args or {}
-    return asyncio.run(_call_tool_async(tool_name, args))
+    return get_manager().call(tool_name, args)
+
+
+async def call_tool_async(tool_name: str, args: dict | None = None):
+    """
+    Async counterpart of `call_tool`; shares the same session.
+    """
+    return await get_manager().acall(tool_name, args)
+
+
+def mcp_warm_up():
+    """
+    Open the session in the background (importing fastmcp on the way), so
+    the first tool call of a run does not wait for it. Failures are only
+    logged; the first call connects again.
+    """
+    manager = get_manager()
+    future = asyncio.run_coroutine_threadsafe(manager._session(), manager._ensure_loop())
+
+    def _done(f):
+        if not f.cancelled() and f.exception() is not None:
+            log.warning(f"[mcp] warm-up failed: {f.exception()}")
+
+    future.add_done_callback(_done)
+
+
+def mcp_stats() -> dict:
+    """
+    Session counters for the current process, e.g. {"handshakes": 1, "calls": 42}.
+    """
+    return get_manager().stats()
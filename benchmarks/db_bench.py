@@ -0,0 +1,148 @@
+# benchmarks/db_bench.py
+"""
+Query latency of the graph's SQLite access paths on a large memory.db.
+
+    python -m benchmarks.db_bench --emails 100000
+
+Builds a throwaway database, then times the read / organize /
+scheduler / validator / kNN queries with the migration indexes in place
+and again with them dropped. The last RECENT rows are re-categorized
+after the rest, as a small run would leave them.
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app import db, knn
+from app.graph import CATEGORIZE_MAX_ATTEMPTS, CATEGORY_LABEL_MAP
+
+CATEGORIES = ["urgent_action", "newsletter", "weekend_reading", "ignore"]
+# Share of rows left uncategorized (the LLM failed on them)
+UNCATEGORIZED_SHARE = 0.01
+# Rows touched by the latest run, above the kNN watermark
+RECENT = 100
+INDEXES = ["idx_emails_category", "idx_emails_last_updated", "idx_emails_thread"]
+
+
+def _synthetic_emails(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(n):
+        yield {
+            "id": f"m{i:08d}",
+            "thread_id": f"t{i // 4:08d}",
+            "from": f"sender{rng.randrange(2000)}@example.com",
+            "to": "me@example.com",
+            "subject": f"Subject {i}",
+            "snippet": "snippet " * 10,
+            "body": "body text " * rng.randrange(20, 200),
+            "received_at": "Mon, 1 Jan 2024 10:00:00 +0000",
+            "labels": ["INBOX", "UNREAD"],
+            "headers": {},
+        }
+
+
+def _populate(n: int):
+    emails = list(_synthetic_emails(n))
+    started = time.perf_counter()
+    with db.transaction():
+        for i in range(0, n, 5000):
+            db.upsert_emails(emails[i : i + 5000])
+    insert_s = time.perf_counter() - started
+
+    rng = random.Random(11)
+    started = time.perf_counter()
+    with db.transaction():
+        db.update_categories(
+            (e["id"], rng.choice(CATEGORIES), 0.9, "llm")
+            for e in emails[:-RECENT]
+            if rng.random() >= UNCATEGORIZED_SHARE
+        )
+    update_s = time.perf_counter() - started
+
+    watermark = db.get_connection().execute("SELECT MAX(last_updated_at) FROM emails").fetchone()[0]
+    with db.transaction():
+        db.update_categories((e["id"], rng.choice(CATEGORIES), 0.9, "llm") for e in emails[-RECENT:])
+    return insert_s, update_s, watermark
+
+
+def _label_everything() -> float:
+    """
+    First organize pass over the fresh table: every categorized row is
+    dirty. Marks all of them applied, so the timed passes below see a
+    mailbox where nothing changed since the last run.
+    """
+    started = time.perf_counter()
+    with db.transaction():
+        db.settle_labels(CATEGORY_LABEL_MAP)
+        deltas = db.label_deltas(CATEGORY_LABEL_MAP)
+        db.mark_labels_applied((gid, desired) for gid, desired, _ in deltas)
+    return time.perf_counter() - started
+
+
+def _organize_pass():
+    with db.transaction():
+        db.settle_labels(CATEGORY_LABEL_MAP)
+    return db.label_deltas(CATEGORY_LABEL_MAP)
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _queries(watermark: str) -> dict:
+    ids = [f"m{i:08d}" for i in range(0, 1000, 2)]
+    return {
+        "read: uncategorized_ids": lambda: db.uncategorized_ids(CATEGORIZE_MAX_ATTEMPTS),
+        "read: unknown_ids (500 ids)": lambda: db.unknown_ids(ids),
+        "categorize: thread categories (500)": lambda: db.thread_categories(
+            f"t{i:08d}" for i in range(0, 1000, 2)
+        ),
+        f"knn: training rows since watermark ({RECENT})": lambda: knn.training_rows(
+            db.get_connection(), watermark
+        ),
+        "scheduler: thread heads of 500 ids": lambda: db.thread_heads(ids, "urgent_action"),
+        "validator: uncertain of 500 ids": lambda: list(db.iter_uncertain_emails(ids, 0.8)),
+        "organize: settle + label deltas (all)": _organize_pass,
+        "organize: label deltas of 500 ids": lambda: db.label_deltas(CATEGORY_LABEL_MAP, ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--emails", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "bench.db")
+        insert_s, update_s, watermark = _populate(args.emails)
+        print(f"{args.emails} emails: insert {insert_s:.2f}s, categorize update {update_s:.2f}s")
+        print(f"first organize pass (every row dirty): {_label_everything():.2f}s")
+
+        queries = _queries(watermark)
+        conn = db.get_connection()
+        conn.execute("ANALYZE")
+        indexed = {name: _time(q, args.repeat) for name, q in queries.items()}
+
+        for index in INDEXES:
+            conn.execute(f"DROP INDEX {index}")
+        conn.execute("ANALYZE")
+        unindexed = {name: _time(q, args.repeat) for name, q in queries.items()}
+        db.close_connection()
+
+    print(f"{'query':42} {'indexed ms':>12} {'no index ms':>12}")
+    for name in queries:
+        print(f"{name:42} {indexed[name]:12.2f} {unindexed[name]:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# benchmarks/fake_gmail.py
+"""
+Local stand-in for Server/mcp_server.py over a synthetic mailbox.
+
+    python -m benchmarks.fake_gmail --emails 5000 --body-words 300 --thread-size 3
+
+Serves the same tools with the same arguments and result shapes, plus
+create_event (served by the calendar server in production); nothing
+talks to Google. Messages are generated on demand from --seed, so two
+runs see the same mailbox and a large one costs no memory. Every tool
+call waits --latency-ms first. deliver adds new unread messages, as if
+mail arrived between two runs. service_stats returns calls per tool
+(reset=True zeroes them and takes delivered mail back).
+"""
+
+import argparse
+import asyncio
+import random
+import threading
+
+from fastmcp import FastMCP
+
+# kind: (share of threads, sender, subject, first body sentence, headers)
+TEMPLATES = {
+    "promo": (
+        0.25, "deals@shop{n}.com", "{pct}% off everything this weekend",
+        "Our biggest sale of the season is here.",
+        {"List-Unsubscribe": "<mailto:unsubscribe@shop.example>"},
+    ),
+    "digest": (
+        0.15, "team@product{n}.io", "Your weekly digest: {word} updates",
+        "Here is what changed in your workspace this week.",
+        {},
+    ),
+    "urgent": (
+        0.15, "billing@utility{n}.com", "Invoice {num} is due on Friday",
+        "Please confirm the payment before the due date to avoid a late fee.",
+        {},
+    ),
+    "reading": (
+        0.2, "editor@blog{n}.dev", "Deep dive: how {word} systems scale",
+        "In this long read we walk through the architecture step by step.",
+        {},
+    ),
+    "personal": (
+        0.25, "friend{n}@mail.example", "Catching up about {word}",
+        "Hey, it has been a while, how are things going?",
+        {},
+    ),
+}
+WORDS = (
+    "data stream search graph queue cache vector storage latency pipeline "
+    "kernel network budget garden travel recipe weekend project meeting"
+).split()
+
+
+class Mailbox:
+    """
+    `size` unread messages in threads of about `thread_size`; message i is
+    rebuilt from (seed, i) whenever it is asked for.
+    """
+
+    def __init__(self, size: int, body_words: int, thread_size: int, html_share: float, seed: int):
+        self.size = size
+        self.body_words = body_words
+        self.thread_size = max(1, thread_size)
+        self.html_share = html_share
+        self.seed = seed
+        self.kinds = list(TEMPLATES)
+        self.weights = [TEMPLATES[k][0] for k in self.kinds]
+
+    @staticmethod
+    def gmail_id(i: int) -> str:
+        return f"{0x18c0000000000000 + i:016x}"
+
+    @staticmethod
+    def index(gmail_id: str) -> int:
+        return int(gmail_id, 16) - 0x18c0000000000000
+
+    def message(self, gmail_id: str) -> dict:
+        i = self.index(gmail_id)
+        if not 0 <= i < self.size:
+            return {"id": gmail_id, "error": "<HttpError 404 Requested entity was not found.>", "status": 404}
+
+        thread = i // self.thread_size
+        trng = random.Random(self.seed * 1_000_003 + thread)
+        kind = trng.choices(self.kinds, self.weights)[0]
+        _, sender, subject, opening, headers = TEMPLATES[kind]
+        fill = {
+            "n": trng.randrange(200),
+            "pct": trng.choice([10, 20, 30, 50]),
+            "word": trng.choice(WORDS),
+            "num": trng.randrange(10000, 99999),
+        }
+        subject = subject.format(**fill)
+        if i % self.thread_size:
+            subject = f"Re: {subject}"
+
+        rng = random.Random(self.seed * 7_919 + i)
+        n_words = max(5, int(self.body_words * rng.uniform(0.5, 1.5)))
+        text = f"{opening} " + " ".join(rng.choice(WORDS) for _ in range(n_words))
+        html = rng.random() < self.html_share
+        labels = ["INBOX", "UNREAD"] + (["CATEGORY_PROMOTIONS"] if kind == "promo" and rng.random() < 0.5 else [])
+
+        return {
+            "id": gmail_id,
+            "thread_id": f"t{thread:012x}",
+            "labels": labels,
+            "snippet": text[:120],
+            "subject": subject,
+            "from": sender.format(**fill),
+            "to": "me@example.com",
+            "received_at": "Mon, 1 Jan 2024 10:00:00 +0000",
+            "body": "" if html else text,
+            "body_html": f"<html><body><p>{text}</p><p>Unsubscribe</p></body></html>" if html else "",
+            "headers": dict(headers),
+        }
+
+
+def build_server(mailbox: Mailbox, latency_ms: float) -> FastMCP:
+    app = FastMCP("fake-gmail")
+    calls: dict[str, int] = {}
+    labels: dict[str, set[str]] = {}
+    events: list[str] = []
+    lock = threading.Lock()
+    history_id = "1000"
+    initial_size = mailbox.size
+
+    async def _call(tool: str):
+        with lock:
+            calls[tool] = calls.get(tool, 0) + 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    @app.tool()
+    async def list_messages(q: str = "is:unread", max_results: int = 100, page_token: str | None = None) -> dict:
+        await _call("list_messages")
+        start = int(page_token or 0)
+        end = min(start + min(max_results, 500), mailbox.size)
+        return {
+            "messages": [{"id": mailbox.gmail_id(i), "threadId": f"t{i // mailbox.thread_size:012x}"} for i in range(start, end)],
+            "next_page_token": str(end) if end < mailbox.size else None,
+            "result_size_estimate": mailbox.size,
+        }
+
+    @app.tool()
+    async def get_profile() -> dict:
+        await _call("get_profile")
+        return {"email": "me@example.com", "history_id": history_id, "messages_total": mailbox.size}
+
+    @app.tool()
+    async def list_history(start_history_id: str, page_token: str | None = None, max_results: int = 500) -> dict:
+        await _call("list_history")
+        return {"history_id": history_id, "changes": [], "next_page_token": None}
+
+    @app.tool()
+    async def get_message(id: str) -> dict:
+        await _call("get_message")
+        return mailbox.message(id)
+
+    @app.tool()
+    async def batch_get_messages(ids: list[str]) -> dict:
+        await _call("batch_get_messages")
+        return {"results": [mailbox.message(gid) for gid in ids]}
+
+    @app.tool()
+    async def list_labels(refresh: bool = False) -> dict:
+        await _call("list_labels")
+        names = sorted({name for applied in labels.values() for name in applied})
+        return {"labels": {name: f"Label_{i}" for i, name in enumerate(names)}}
+
+    @app.tool()
+    async def modify_labels(id: str, add_labels: list[str] | None = None, remove_labels: list[str] | None = None) -> dict:
+        await _call("modify_labels")
+        with lock:
+            applied = labels.setdefault(id, set())
+            applied.update(add_labels or [])
+            applied.difference_update(remove_labels or [])
+        return {"id": id, "added": add_labels or [], "removed": remove_labels or []}
+
+    @app.tool()
+    async def batch_modify_labels(ids: list[str], add_labels: list[str] | None = None, remove_labels: list[str] | None = None) -> dict:
+        await _call("batch_modify_labels")
+        with lock:
+            for gid in ids:
+                applied = labels.setdefault(gid, set())
+                applied.update(add_labels or [])
+                applied.difference_update(remove_labels or [])
+        return {
+            "results": [{"id": gid, "ok": True} for gid in ids],
+            "added": add_labels or [],
+            "removed": remove_labels or [],
+        }
+
+    @app.tool()
+    async def send_email(to: str, subject: str, message: str) -> dict:
+        await _call("send_email")
+        return {"message_id": "sent"}
+
+    @app.tool()
+    async def create_event(summary: str, start: str, end: str) -> dict:
+        await _call("create_event")
+        with lock:
+            events.append(summary)
+            return {"id": f"event{len(events)}", "summary": summary}
+
+    @app.tool()
+    def deliver(count: int) -> dict:
+        with lock:
+            mailbox.size += max(0, count)
+            return {"messages_total": mailbox.size}
+
+    @app.tool()
+    def service_stats(reset: bool = False) -> dict:
+        with lock:
+            stats = {
+                "calls": dict(calls),
+                "labeled": sum(1 for applied in labels.values() if applied),
+                "events": len(events),
+            }
+            if reset:
+                calls.clear()
+                labels.clear()
+                events.clear()
+                mailbox.size = initial_size
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--body-words", type=int, default=200, help="mean body length")
+    parser.add_argument("--thread-size", type=int, default=3, help="messages per thread")
+    parser.add_argument("--html-share", type=float, default=0.2, help="share of HTML-only bodies")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="per tool call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mailbox = Mailbox(args.emails, args.body_words, args.thread_size, args.html_share, args.seed)
+    app = build_server(mailbox, args.latency_ms)
+    app.run(transport="streamable-http", host=args.host, port=args.port, path="/mcp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# benchmarks/fake_ollama.py
+"""
+Stand-in for an Ollama server's /api/chat with configurable latency.
+
+    python -m benchmarks.fake_ollama --port 11434 --latency-ms 150 --parallel 4
+
+Answers in the shape requested by the `format` schema the graph sends
+(categorizer object, validator verdict or batch array), streamed or not,
+with per-token logprobs when asked. The category is picked from keywords
+in the prompt, matching the templates of benchmarks.fake_gmail, and
+--uncertain of the answers come back with low logprobs so the validator
+has work to do. Like a real server, at most --parallel requests are
+served at once and the rest wait. GET /stats returns request counters
+(?reset=1 zeroes them).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CATEGORY_KEYWORDS = [
+    ("urgent_action", re.compile(r"\b(invoice|payment|due|confirm|appointment|action required)\b", re.I)),
+    ("weekend_reading", re.compile(r"\b(deep dive|long read|tutorial|essay|webinar)\b", re.I)),
+    ("newsletter", re.compile(r"(% off|\bsale\b|\bdigest\b|\bnewsletter\b|unsubscribe)", re.I)),
+]
+_BATCH_ID_RE = re.compile(r"\(gmail_id: ([^)]+)\)")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.by_kind: dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.busy_seconds = 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "by_kind": dict(self.by_kind),
+                "max_in_flight": self.max_in_flight,
+                "busy_seconds": round(self.busy_seconds, 3),
+            }
+
+
+def _category(text: str) -> str:
+    for category, pattern in CATEGORY_KEYWORDS:
+        if pattern.search(text):
+            return category
+    return "ignore"
+
+
+def _tokens(content: str, value: str | None, logprob: float) -> list[dict]:
+    """
+    Split `content` into a few tokens, `value` (if any) as its own tokens,
+    so app.graph._value_logprob can find it.
+    """
+    if not value or value not in content:
+        return [{"token": content, "logprob": -0.01}]
+    head, _, tail = content.partition(value)
+    half = max(1, len(value) // 2)
+    return [
+        {"token": head, "logprob": -0.01},
+        {"token": value[:half], "logprob": logprob / 2},
+        {"token": value[half:], "logprob": logprob / 2},
+        {"token": tail, "logprob": -0.01},
+    ]
+
+
+def answer(body: dict, uncertain: float) -> tuple[str, str, list[dict]]:
+    """
+    (kind, content, logprobs) for one /api/chat request body.
+    """
+    messages = body.get("messages") or []
+    schema = body.get("format") if isinstance(body.get("format"), dict) else {}
+    prompt = messages[-1]["content"] if messages else ""
+
+    if schema.get("type") == "array":
+        verdicts = [
+            {"gmail_id": gid, "keep": True, "new_category": None, "reason": "matches content"}
+            for gid in _BATCH_ID_RE.findall(prompt)
+        ]
+        content = json.dumps(verdicts)
+        return "validate_batch", content, _tokens(content, None, 0.0)
+
+    if "keep" in (schema.get("properties") or {}):
+        content = json.dumps({"keep": True, "new_category": None, "reason": "matches content"})
+        return "validate", content, _tokens(content, None, 0.0)
+
+    category = _category(prompt)
+    # Deterministic per prompt, so repeated runs agree
+    unsure = (zlib.crc32(prompt.encode("utf-8")) % 1000) / 1000 < uncertain
+    content = json.dumps({"category": category})
+    return "categorize", content, _tokens(content, category, -1.2 if unsure else -0.02)
+
+
+def make_handler(args, stats: Stats, slots: threading.Semaphore):
+    rng = random.Random(args.seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def _send_json(self, payload: dict, status: int = 200):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                snapshot = stats.snapshot()
+                if parse_qs(url.query).get("reset"):
+                    with stats.lock:
+                        stats.reset()
+                self._send_json(snapshot)
+            elif url.path in ("/", "/api/version"):
+                self._send_json({"version": "fake"})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/api/chat":
+                self._send_json({"error": "not found"}, 404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+            model = body.get("model", "fake")
+            created = "2024-01-01T00:00:00Z"
+
+            if not body.get("messages"):
+                # warm-up: load the model, generate nothing
+                self._send_json({
+                    "model": model, "created_at": created,
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True, "done_reason": "load",
+                })
+                return
+
+            kind, content, logprobs = answer(body, args.uncertain)
+            with slots:
+                with stats.lock:
+                    stats.requests += 1
+                    stats.by_kind[kind] = stats.by_kind.get(kind, 0) + 1
+                    stats.in_flight += 1
+                    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+                started = time.perf_counter()
+                time.sleep(max(0.0, args.latency_ms + rng.uniform(-1, 1) * args.jitter_ms) / 1000)
+                with stats.lock:
+                    stats.in_flight -= 1
+                    stats.busy_seconds += time.perf_counter() - started
+
+            final = {
+                "model": model, "created_at": created,
+                "message": {"role": "assistant", "content": ""},
+                "done": True, "done_reason": "stop",
+                "prompt_eval_count": len(json.dumps(body.get("messages"))) // 4,
+                "eval_count": max(1, len(content) // 4),
+            }
+            if not body.get("stream", True):
+                final["message"]["content"] = content
+                if body.get("logprobs"):
+                    final["logprobs"] = logprobs
+                self._send_json(final)
+                return
+
+            chunk = {
+                "model": model, "created_at": created,
+                "message": {"role": "assistant", "content": content}, "done": False,
+            }
+            if body.get("logprobs"):
+                chunk["logprobs"] = logprobs
+            data = (json.dumps(chunk) + "\n" + json.dumps(final) + "\n").encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "application/x-ndjson")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--parallel", type=int, default=4, help="requests served at once (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--uncertain", type=float, default=0.2, help="share of low-confidence categorizations")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stats = Stats()
+    handler = make_handler(args, stats, threading.Semaphore(max(1, args.parallel)))
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"fake ollama on http://{args.host}:{args.port} latency={args.latency_ms}ms parallel={args.parallel}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/import_time.py
+"""
+Cold-start import budget for the CLI, measured with `python -X importtime`.
+
+    python -m benchmarks.import_time                # exit 1 if over budget
+    python -m benchmarks.import_time --scale 2      # slower machine / CI
+
+Each module is imported in a fresh interpreter (best of --runs). A module
+fails when its cumulative import time exceeds its budget or when it pulls
+in one of the heavy dependencies that must only load once a command runs.
+Suitable for a pre-commit hook or cron host check.
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Cumulative import time in ms (-X importtime) allowed per module
+BUDGETS_MS = {
+    "main": 80,
+    "app.graph": 250,
+}
+# Must not be imported by any of the modules above
+HEAVY = ("langgraph", "langchain_core", "langchain_ollama", "ollama", "fastmcp", "httpx", "numpy")
+
+
+def _importtime(module: str) -> dict[str, int]:
+    """
+    {module name: cumulative microseconds} for one cold `import module`.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-W", "ignore", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS_MS.items():
+        runs = [_importtime(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda t: t[module])
+        took_ms = best[module] / 1000
+        limit_ms = budget * args.scale
+        heavy = sorted(
+            name for name in best if name.split(".")[0] in HEAVY and "." not in name
+        )
+        ok = took_ms <= limit_ms and not heavy
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<12} {took_ms:7.1f} ms (budget {limit_ms:.0f} ms)")
+        if heavy:
+            print(f"     imports heavy dependencies eagerly: {', '.join(heavy)}")
+        if not ok:
+            slowest = sorted(
+                ((us, name) for name, us in best.items() if name != module), reverse=True
+            )[:5]
+            for us, name in slowest:
+                print(f"     {us / 1000:7.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# benchmarks/knn_bench.py
+"""
+kNN classifier latency, coverage and agreement vs the LLM path.
+
+    python -m benchmarks.knn_bench                      # synthetic corpus
+    python -m benchmarks.knn_bench --from-db            # categorized rows in memory.db
+    python -m benchmarks.knn_bench --from-db --llm 20   # also time Ollama
+
+The corpus is split into an index part and a held-out part; the held-out
+emails are classified through the index and compared with their stored
+(or generated) category.
+"""
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app import db, knn
+
+TEMPLATES = {
+    "urgent_action": (
+        "billing@{d}",
+        "Your invoice {n} is due on {day}",
+        "Please pay the outstanding balance of ${n} before {day}. Log in to your account to "
+        "review the statement and confirm the payment method.",
+    ),
+    "newsletter": (
+        "news@{d}",
+        "This week at {d}: {n}% off everything",
+        "Shop the sale now. Limited time offer on new arrivals, free shipping on orders over "
+        "${n}. Unsubscribe or manage your email preferences.",
+    ),
+    "weekend_reading": (
+        "editor@{d}",
+        "Deep dive: how {word} systems scale",
+        "In this long read we walk through the architecture of {word} pipelines, the "
+        "trade-offs of caching, and lessons learned from running them in production.",
+    ),
+    "ignore": (
+        "noreply@{d}",
+        "You have won a {word} prize {n}",
+        "Congratulations winner! Claim your reward now by clicking the link, offer expires "
+        "soon, act fast, this is not spam.",
+    ),
+}
+WORDS = ["data", "stream", "search", "graph", "queue", "cache", "vector", "storage"]
+
+
+def _synthetic(n: int, seed: int = 3) -> list[tuple[str, str, str, str, str]]:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        category = rng.choice(list(TEMPLATES))
+        sender, subject, body = TEMPLATES[category]
+        fill = {
+            "d": f"site{rng.randrange(60)}.com",
+            "n": rng.randrange(10, 999),
+            "day": rng.choice(["Monday", "Friday", "the 15th"]),
+            "word": rng.choice(WORDS),
+        }
+        # a few random words so bodies are not identical
+        noise = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(0, 12)))
+        rows.append(
+            (f"s{i}", sender.format(**fill), subject.format(**fill), f"{body.format(**fill)} {noise}", category)
+        )
+    return rows
+
+
+def _from_db(limit: int) -> list[tuple[str, str, str, str, str]]:
+    return db.get_connection().execute(
+        """
+        SELECT gmail_id, from_addr, subject, COALESCE(body_normalized, body), category
+          FROM emails
+         WHERE category IS NOT NULL AND (category_source IS NULL OR category_source != 'knn')
+         ORDER BY RANDOM()
+         LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+
+# Rows added by a typical run, for timing an incremental save
+SAVE_INCREMENT = 100
+
+
+def _build_index(rows, path: str) -> tuple[knn.KNNIndex, float, sqlite3.Connection]:
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        """
+        CREATE TABLE emails (gmail_id TEXT, from_addr TEXT, subject TEXT, body TEXT,
+                             body_normalized TEXT, category TEXT, category_confidence REAL,
+                             category_source TEXT, last_updated_at TEXT)
+        """
+    )
+    conn.executemany(
+        "INSERT INTO emails VALUES (?, ?, ?, ?, NULL, ?, 1.0, 'llm', ?)",
+        [(*row, f"{i:012d}") for i, row in enumerate(rows)],
+    )
+    index = knn.KNNIndex(path, max_rows=max(len(rows), knn.KNN_MAX_ROWS))
+    started = time.perf_counter()
+    index.sync(conn)
+    return index, time.perf_counter() - started, conn
+
+
+def _time_saves(index: knn.KNNIndex, conn: sqlite3.Connection) -> tuple[float, float, float]:
+    """
+    (first save s, save after SAVE_INCREMENT new rows s, MB on disk).
+    """
+    started = time.perf_counter()
+    index.save()
+    first_s = time.perf_counter() - started
+
+    offset = conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+    conn.executemany(
+        "INSERT INTO emails SELECT ?, from_addr, subject, body, NULL, category, 1.0, 'llm', ? "
+        "FROM emails WHERE rowid = ?",
+        [(f"new{i}", f"{offset + i:012d}", i + 1) for i in range(SAVE_INCREMENT)],
+    )
+    index.sync(conn)
+    started = time.perf_counter()
+    index.save()
+    increment_s = time.perf_counter() - started
+
+    stem = Path(index.path).name.removesuffix(".npz")
+    size_mb = sum(p.stat().st_size for p in Path(index.path).parent.glob(f"{stem}*")) / 1e6
+    return first_s, increment_s, size_mb
+
+
+def _time_llm(rows) -> float:
+    from app.graph import LLM_CONCURRENCY, _categorize_llm
+
+    jobs = [(gid, f"From: {f}\nSubject: {s}\nBody:\n{b}") for gid, f, s, b, _ in rows]
+    started = time.perf_counter()
+    asyncio.run(_categorize_llm(jobs, LLM_CONCURRENCY))
+    return (time.perf_counter() - started) / len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--emails", type=int, default=20000)
+    parser.add_argument("--test", type=int, default=1000, help="held-out emails")
+    parser.add_argument("--from-db", action="store_true")
+    parser.add_argument("--llm", type=int, default=0, help="held-out emails to time against Ollama")
+    args = parser.parse_args()
+
+    if not knn.available():
+        raise SystemExit("numpy is not installed; the kNN classifier is disabled.")
+
+    rows = _from_db(args.emails + args.test) if args.from_db else _synthetic(args.emails + args.test)
+    if len(rows) <= args.test:
+        raise SystemExit(f"Need more than {args.test} categorized emails, found {len(rows)}.")
+    train, test = rows[: -args.test], rows[-args.test :]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index, build_s, conn = _build_index(train, str(Path(tmp) / "bench.knn.npz"))
+        first_save_s, increment_save_s, size_mb = _time_saves(index, conn)
+
+        docs = [(f, s, b) for _, f, s, b, _ in test]
+        samples = []
+        for _ in range(3):
+            started = time.perf_counter()
+            matches = index.classify(docs)
+            samples.append(time.perf_counter() - started)
+
+    decided = [(m, row[4]) for m, row in zip(matches, test) if m is not None]
+    agree = sum(1 for m, expected in decided if m.category == expected)
+    per_email_ms = statistics.median(samples) * 1000 / len(test)
+
+    print(f"index: {len(index)} emails, dim {index.dim}, built in {build_s:.2f}s, {size_mb:.1f} MB on disk")
+    print(
+        f"save: full {first_save_s * 1000:.0f} ms, "
+        f"after {SAVE_INCREMENT} new rows {increment_save_s * 1000:.0f} ms"
+    )
+    print(f"kNN: {per_email_ms:.3f} ms/email over {len(test)} held-out emails")
+    print(
+        f"decided {len(decided)}/{len(test)} ({len(decided) / len(test):.0%}), "
+        f"agreement with stored category {agree / len(decided) if decided else 0:.1%}; "
+        f"the rest would go to the LLM"
+    )
+
+    if args.llm:
+        llm_s = _time_llm(test[: args.llm])
+        print(f"LLM: {llm_s * 1000:.0f} ms/email ({llm_s * 1000 / per_email_ms:.0f}x the kNN path)")
+
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
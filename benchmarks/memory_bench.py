@@ -0,0 +1,130 @@
+# benchmarks/memory_bench.py
+"""
+Peak memory of the categorize -> validate graph path by backlog size.
+
+    python -m benchmarks.memory_bench --sizes 1000 10000
+
+Each size runs in a fresh subprocess against a throwaway database filled
+with synthetic newsletters (List-Unsubscribe header, ~20 KB bodies), so
+the rule engine decides them and no Ollama or MCP server is needed. The
+state passed between nodes holds ids only, so the Python heap peak
+should stay roughly flat as the backlog grows.
+
+The child turns SQLite's mmap off (mmap_size in app/db.py) so peak RSS
+counts only memory the process allocated; with --mmap it keeps the
+production setting, and RSS then also grows by the file-backed,
+reclaimable pages of the database it reads.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _emails(n: int):
+    body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 350
+    for i in range(n):
+        yield {
+            "id": f"m{i:08d}",
+            "thread_id": f"t{i:08d}",
+            "from": f"news@site{i % 50}.com",
+            "to": "me@example.com",
+            "subject": f"Weekly digest #{i}",
+            "snippet": "This week's stories",
+            "body": body,
+            "body_normalized": body[:2000],
+            "received_at": "Mon, 1 Jan 2024 10:00:00 +0000",
+            "labels": ["INBOX", "UNREAD"],
+            "headers": {"List-Unsubscribe": "<mailto:unsubscribe@example.com>"},
+        }
+
+
+def _child(n: int, mmap: bool):
+    from langgraph.graph import StateGraph, END
+
+    from app import db
+    from app.graph import categorize_emails_node, validator_node
+    from app.state import EmailState
+
+    if not mmap:
+        db.get_connection().execute("PRAGMA mmap_size=0")
+
+    with db.transaction():
+        batch = []
+        for email in _emails(n):
+            batch.append(email)
+            if len(batch) == 1000:
+                db.upsert_emails(batch)
+                batch = []
+        db.upsert_emails(batch)
+    ids = [f"m{i:08d}" for i in range(n)]
+
+    graph = StateGraph(EmailState)
+    graph.add_node("categorize", categorize_emails_node)
+    graph.add_node("validate", validator_node)
+    graph.set_entry_point("categorize")
+    graph.add_edge("categorize", "validate")
+    graph.add_edge("validate", END)
+    app = graph.compile()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+    final = app.invoke({"email_ids": ids, "categorized_ids": [], "counters": {}, "notes": ""})
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close_connection()
+
+    print(json.dumps({
+        "emails": n,
+        "categorized": final["counters"].get("categorized", 0),
+        "seconds": round(elapsed, 2),
+        "python_peak_mb": round(peak / 1e6, 1),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_before_mb": round(rss_before / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--mmap", action="store_true", help="keep SQLite's mmap on (counts mapped pages in RSS)")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.mmap)
+        return
+
+    print(f"{'emails':>8} {'seconds':>8} {'py peak MB':>11} {'RSS before':>11} {'peak RSS MB':>12}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                "MEMORY_DB_PATH": str(Path(tmp) / "bench.db"),
+                "KNN_ENABLED": "0",
+            }
+            cmd = [sys.executable, "-m", "benchmarks.memory_bench", "--child", str(n)]
+            if args.mmap:
+                cmd.append("--mmap")
+            out = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(
+            f"{r['emails']:8d} {r['seconds']:8.2f} {r['python_peak_mb']:11.1f} "
+            f"{r['rss_before_mb']:11.1f} {r['peak_rss_mb']:12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
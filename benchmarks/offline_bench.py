@@ -0,0 +1,341 @@
+# benchmarks/offline_bench.py
+"""
+End-to-end triage throughput without Gmail or a model.
+
+    python -m benchmarks.offline_bench --emails 2000
+    python -m benchmarks.offline_bench --emails 2000 --out new.json --compare old.json
+
+Starts benchmarks.fake_gmail (same tools as Server/mcp_server.py over a
+synthetic mailbox) and benchmarks.fake_ollama on free local ports, then
+runs the whole graph once per --modes in a fresh subprocess with a
+throwaway database. Reports emails/sec, wall time per node, MCP calls
+per tool and peak RSS, and writes everything plus the git commit to
+--out as JSON. --compare prints the change against an earlier file.
+
+Each process then runs --cycles - 1 more cycles on the same compiled
+graph, with --arrivals new messages delivered before each one, as
+`main.py watch` does. Any LLM request error or email left
+uncategorized in any cycle fails the benchmark (exit 1).
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{proc.args[2]} exited with {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"{proc.args[2]} did not listen on port {port} within {timeout:.0f}s")
+
+
+@contextmanager
+def _servers(args):
+    """
+    Run both fakes for the duration of the block; yields (mcp_url, ollama_url).
+    """
+    gmail_port, ollama_port = _free_port(), _free_port()
+    commands = [
+        (gmail_port, [
+            sys.executable, "-m", "benchmarks.fake_gmail", "--port", str(gmail_port),
+            "--emails", str(args.emails), "--body-words", str(args.body_words),
+            "--thread-size", str(args.thread_size), "--html-share", str(args.html_share),
+            "--latency-ms", str(args.gmail_latency_ms), "--seed", str(args.seed),
+        ]),
+        (ollama_port, [
+            sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(ollama_port),
+            "--latency-ms", str(args.ollama_latency_ms), "--parallel", str(args.ollama_parallel),
+            "--uncertain", str(args.uncertain), "--seed", str(args.seed),
+        ]),
+    ]
+    procs = []
+    try:
+        for port, cmd in commands:
+            proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            procs.append(proc)
+            _wait_for_port(port, proc)
+        yield f"http://127.0.0.1:{gmail_port}/mcp", f"http://127.0.0.1:{ollama_port}"
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+# ---------------- one run (child process) ----------------
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KiB elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _llm_errors() -> int:
+    from app import metrics
+
+    return int(sum(
+        value for series, value in metrics.summary()["counters"].items()
+        if series.startswith("triage_llm_request_errors_total")
+    ))
+
+
+def _cycle(app, mode: str) -> tuple[float, dict[str, float], dict]:
+    """
+    One graph run driven the way main.py does (a fresh event loop in
+    stream mode). Returns (seconds, wall time per node, counters).
+    """
+    import asyncio
+
+    state = {"email_ids": [], "categorized_ids": [], "counters": {}, "notes": ""}
+    nodes: dict[str, float] = {}
+    final = dict(state)
+
+    def _record(chunk: dict, since: float) -> float:
+        now = time.perf_counter()
+        for node, update in chunk.items():
+            nodes[node] = round(nodes.get(node, 0.0) + now - since, 3)
+            final.update(update or {})
+        return now
+
+    started = time.perf_counter()
+    if mode == "stream":
+        async def _run():
+            mark = time.perf_counter()
+            async for chunk in app.astream(state, stream_mode="updates"):
+                mark = _record(chunk, mark)
+
+        asyncio.run(_run())
+    else:
+        mark = started
+        for chunk in app.stream(state, stream_mode="updates"):
+            mark = _record(chunk, mark)
+    return time.perf_counter() - started, nodes, final.get("counters") or {}
+
+
+def _child(mode: str, ollama_url: str, cycles: int, arrivals: int):
+    from app import db, metrics
+    from app.graph import build_app
+    from app.tools.gmail_calendar_tools import mcp_stats
+    from app.tools.mcp_client import call_tool
+
+    call_tool("service_stats", {"reset": True})
+    urllib.request.urlopen(f"{ollama_url}/stats?reset=1").read()
+
+    started = time.perf_counter()
+    app = build_app(streaming=mode == "stream")
+    build_s = time.perf_counter() - started
+
+    elapsed, nodes, counters = _cycle(app, mode)
+    # Headline numbers are the first cycle's; reset=True clears what it counted
+    server = call_tool("service_stats", {"reset": True})
+    ollama = json.loads(urllib.request.urlopen(f"{ollama_url}/stats?reset=1").read())
+    client = mcp_stats()
+
+    history = []
+    errors_seen = 0
+    for cycle in range(1, cycles + 1):
+        if cycle > 1:
+            call_tool("deliver", {"count": arrivals})
+            seconds, _, cycle_counters = _cycle(app, mode)
+        else:
+            seconds, cycle_counters = elapsed, counters
+        errors = _llm_errors()
+        history.append({
+            "cycle": cycle,
+            "seconds": round(seconds, 3),
+            "fetched": cycle_counters.get("fetched", 0),
+            "categorized": cycle_counters.get("categorized", 0),
+            "categorize_failed": cycle_counters.get("categorize_failed", 0),
+            "llm_errors": errors - errors_seen,
+        })
+        errors_seen = errors
+    db.close_connection()
+
+    print(json.dumps({
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "build_seconds": round(build_s, 3),
+        "nodes": nodes,
+        "counters": counters,
+        "cycles": history,
+        "mcp_calls": sum(server["calls"].values()),
+        "mcp_calls_by_tool": server["calls"],
+        "mcp_handshakes": client["handshakes"],
+        "labeled": server["labeled"],
+        "events": server["events"],
+        "ollama": ollama,
+        "waited": metrics.time_breakdown(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }))
+
+
+# ---------------- report ----------------
+
+def _git(*cmd: str) -> str:
+    try:
+        return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _print_run(run: dict):
+    counters = run["counters"]
+    print(
+        f"{run['mode']:<6} {run['emails_per_sec']:9.1f} emails/s  {run['seconds']:7.2f}s  "
+        f"fetched={counters.get('fetched', 0)} categorized={counters.get('categorized', 0)} "
+        f"labeled={run['labeled']} events={run['events']}  peak RSS {run['peak_rss_mb']:.0f} MB"
+    )
+    print("       nodes: " + "  ".join(f"{name}={s:.2f}s" for name, s in run["nodes"].items()))
+    tools = sorted(run["mcp_calls_by_tool"].items(), key=lambda kv: -kv[1])
+    print(
+        f"       MCP: {run['mcp_calls']} calls over {run['mcp_handshakes']} handshake(s) ("
+        + ", ".join(f"{tool}={n}" for tool, n in tools) + ")"
+    )
+    ollama = run["ollama"]
+    print(
+        f"       Ollama: {ollama['requests']} requests "
+        f"({', '.join(f'{k}={v}' for k, v in ollama['by_kind'].items())}), "
+        f"max in flight {ollama['max_in_flight']}"
+    )
+    if run.get("waited"):
+        print("       waited: " + "  ".join(
+            f"{source}={t['seconds']:.2f}s/{t['calls']}" for source, t in run["waited"].items()
+        ))
+    for c in run.get("cycles", []):
+        ok = not (c["llm_errors"] or c["categorize_failed"])
+        print(
+            f"       {'ok  ' if ok else 'FAIL'} cycle {c['cycle']}: fetched={c['fetched']} "
+            f"categorized={c['categorized']} uncategorized={c['categorize_failed']} "
+            f"llm_errors={c['llm_errors']} in {c['seconds']:.2f}s"
+        )
+
+
+def _compare(base: dict, result: dict):
+    """
+    Print the change of each mode's headline numbers against `base`.
+    """
+    before = {run["mode"]: run for run in base["runs"]}
+    print(f"\nvs {base.get('commit', '?')[:10]} ({base.get('timestamp', '?')}):")
+    # cycles and arrivals only add later cycles; the headline is the first
+    workload = lambda params: {k: v for k, v in params.items() if k not in ("modes", "cycles", "arrivals")}
+    if workload(base.get("params", {})) != workload(result["params"]):
+        print("  (parameters differ; numbers are not directly comparable)")
+    for run in result["runs"]:
+        old = before.get(run["mode"])
+        if not old:
+            continue
+        for key, better in (("emails_per_sec", 1), ("seconds", -1), ("mcp_calls", -1), ("peak_rss_mb", -1)):
+            a, b = old[key], run[key]
+            change = (b - a) / a * 100 if a else 0.0
+            flag = "  worse" if change * better < -5 else ""
+            print(f"  {run['mode']:<6} {key:<15} {a:>10} -> {b:<10} {change:+6.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", nargs="+", default=["full", "stream"], choices=["full", "stream"])
+    parser.add_argument("--emails", type=int, default=1000)
+    parser.add_argument("--body-words", type=int, default=200)
+    parser.add_argument("--thread-size", type=int, default=3)
+    parser.add_argument("--html-share", type=float, default=0.2)
+    parser.add_argument("--gmail-latency-ms", type=float, default=20.0)
+    parser.add_argument("--ollama-latency-ms", type=float, default=50.0)
+    parser.add_argument("--ollama-parallel", type=int, default=4)
+    parser.add_argument("--uncertain", type=float, default=0.2)
+    parser.add_argument("--knn", action="store_true", help="leave the kNN pre-filter on")
+    parser.add_argument("--cycles", type=int, default=2, help="graph runs per process, like `watch`")
+    parser.add_argument("--arrivals", type=int, help="new messages before each later cycle (default emails/10)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="offline_bench.json")
+    parser.add_argument("--compare", help="earlier --out file to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--ollama-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.arrivals is None:
+        args.arrivals = max(1, args.emails // 10)
+    if args.child:
+        _child(args.child, args.ollama_url, args.cycles, args.arrivals)
+        return
+
+    params = {k: v for k, v in vars(args).items() if k not in ("out", "compare", "child", "ollama_url")}
+    runs = []
+    with _servers(args) as (mcp_url, ollama_url):
+        for mode in args.modes:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    **os.environ,
+                    "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.getenv("PYTHONPATH")])),
+                    "MEMORY_DB_PATH": str(Path(tmp) / "bench.db"),
+                    "MCP_BASE_URL": mcp_url,
+                    "OLLAMA_ENDPOINTS": ollama_url,
+                    "SYNC_MODE": "full",
+                    "KNN_ENABLED": "1" if args.knn else "0",
+                }
+                proc = subprocess.run(
+                    [sys.executable, "-W", "ignore", "-m", "benchmarks.offline_bench",
+                     "--child", mode, "--ollama-url", ollama_url,
+                     "--cycles", str(args.cycles), "--arrivals", str(args.arrivals)],
+                    env=env, cwd=tmp, capture_output=True, text=True,
+                )
+            if proc.returncode:
+                sys.stderr.write(proc.stderr)
+                raise SystemExit(f"{mode} run failed with exit code {proc.returncode}")
+            run = json.loads(proc.stdout.strip().splitlines()[-1])
+            fetched = run["counters"].get("fetched", 0)
+            run["emails_per_sec"] = round(fetched / run["seconds"], 1) if run["seconds"] else 0.0
+            runs.append(run)
+            _print_run(run)
+
+    result = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "params": params,
+        "runs": runs,
+    }
+    Path(args.out).write_text(json.dumps(result, indent=2))
+    print(f"\nwrote {args.out}")
+
+    if args.compare:
+        _compare(json.loads(Path(args.compare).read_text()), result)
+
+    failed = [
+        f"{run['mode']} cycle {c['cycle']}"
+        for run in runs for c in run.get("cycles", [])
+        if c["llm_errors"] or c["categorize_failed"]
+    ]
+    if failed:
+        raise SystemExit(f"\nLLM errors or uncategorized emails in: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/prompt_bench.py
+"""
+Prompt size and latency: raw `body[:4000]` vs normalized bodies.
+
+    python -m benchmarks.prompt_bench                 # token counts only
+    python -m benchmarks.prompt_bench --llm 20        # also time Ollama
+
+Reads stored emails from memory.db (MEMORY_DB_PATH).
+"""
+
+import argparse
+import statistics
+import time
+
+from app import db
+from app.normalize import estimate_tokens, normalize_email
+
+
+def _load(limit: int) -> list[tuple[str, str, str]]:
+    return db.get_connection().execute(
+        "SELECT from_addr, subject, body FROM emails WHERE body IS NOT NULL LIMIT ?",
+        (limit,),
+    ).fetchall()
+
+
+def _time_llm(rows, body_fn) -> float:
+    from app.graph import CATEGORIZE_SYSTEM
+    from app.llm import get_llm
+
+    llm = get_llm()
+
+    samples = []
+    for from_addr, subject, body in rows:
+        content = f"From: {from_addr}\nSubject: {subject}\nBody:\n{body_fn(body)}"
+        started = time.perf_counter()
+        llm.invoke(
+            [
+                {"role": "system", "content": CATEGORIZE_SYSTEM},
+                {"role": "user", "content": content},
+            ]
+        )
+        samples.append(time.perf_counter() - started)
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--llm", type=int, default=0, help="emails to time against Ollama")
+    args = parser.parse_args()
+
+    rows = _load(args.limit)
+    if not rows:
+        raise SystemExit(f"No emails in {db.DB_PATH}; run a triage first.")
+
+    started = time.perf_counter()
+    normalized = [normalize_email(body) for _, _, body in rows]
+    norm_ms = (time.perf_counter() - started) * 1000 / len(rows)
+
+    raw_tokens = [estimate_tokens(body[:4000]) for _, _, body in rows]
+    norm_tokens = [estimate_tokens(text) for text in normalized]
+    avg_raw, avg_norm = statistics.mean(raw_tokens), statistics.mean(norm_tokens)
+    print(f"{len(rows)} emails, normalization {norm_ms:.2f} ms/email")
+    print(f"avg body tokens: raw {avg_raw:.0f}, normalized {avg_norm:.0f} "
+          f"({1 - avg_norm / avg_raw if avg_raw else 0:.0%} smaller)")
+
+    if args.llm:
+        sample = rows[: args.llm]
+        raw_s = _time_llm(sample, lambda body: body[:4000])
+        norm_s = _time_llm(sample, normalize_email)
+        print(f"avg categorizer latency: raw {raw_s:.2f}s, normalized {norm_s:.2f}s")
+
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/validator_bench.py
+"""
+Validator throughput: one prompt per email vs batched prompts.
+
+    python -m benchmarks.validator_bench --emails 40
+    python -m benchmarks.validator_bench --emails 40 --batch-size 4
+
+Reads categorized emails from memory.db (MEMORY_DB_PATH) and runs both
+validator paths against the local Ollama model (OLLAMA_MODEL). Nothing
+is written back.
+"""
+
+import argparse
+import time
+
+from app import db
+from app import graph
+
+
+def _load(limit: int) -> list[tuple]:
+    return db.get_connection().execute(
+        """
+        SELECT gmail_id, subject, snippet, COALESCE(body_normalized, body),
+               category, category_confidence
+        FROM emails
+        WHERE category IS NOT NULL
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+
+def _per_email(rows) -> tuple[float, int, int]:
+    started = time.perf_counter()
+    unparsed = sum(1 for row in rows if graph._validate_one(row) is None)
+    return time.perf_counter() - started, len(rows), unparsed
+
+
+def _batched(rows) -> tuple[float, int, int]:
+    started = time.perf_counter()
+    calls = unparsed = 0
+    for batch in graph._validation_batches(rows):
+        verdicts = graph._validate_batch(batch)
+        calls += 1
+        unparsed += len(batch) - len(verdicts)
+    return time.perf_counter() - started, calls, unparsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--emails", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=graph.VALIDATE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rows = _load(args.emails)
+    if not rows:
+        raise SystemExit(f"No categorized emails in {db.DB_PATH}; run a triage first.")
+    graph.VALIDATE_BATCH_SIZE = args.batch_size
+
+    print(f"{len(rows)} emails, model {graph.LLM_MODEL}, num_ctx {graph.LLM_NUM_CTX}")
+    print(f"{'path':24} {'seconds':>8} {'calls':>6} {'emails/s':>9} {'unparsed':>9}")
+    for name, run in (("per-email", _per_email), (f"batched (<= {args.batch_size})", _batched)):
+        seconds, calls, unparsed = run(rows)
+        print(f"{name:24} {seconds:8.1f} {calls:6d} {len(rows) / seconds:9.2f} {unparsed:9d}")
+
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,117 @@
 # main.py
 import argparse
+import fcntl
 import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
-from app.graph import build_app
+from app import db, metrics
 from app.state import EmailState
 
+# app.graph (and with it LangGraph, the MCP client and Ollama) is imported
+# only once a command runs, so `--help` and argument errors return at once.
+# `python -m benchmarks.import_time` checks the budget.
 
-def run_triage(mode: str = "full"):
+# Polling bounds for `watch`: after a cycle that found mail the interval
+# drops to the minimum, after an idle one it doubles up to the maximum.
+# Keep the maximum below OLLAMA_KEEP_ALIVE so the model stays loaded.
+WATCH_MIN_INTERVAL = float(os.getenv("WATCH_MIN_INTERVAL", "30"))
+WATCH_MAX_INTERVAL = float(os.getenv("WATCH_MAX_INTERVAL", "900"))
+
+# Held for the whole run so a cron `triage` and a `watch` never overlap;
+# defaults to memory.lock next to memory.db
+LOCK_FILE = os.getenv("TRIAGE_LOCK_FILE", "")
+
+log = logging.getLogger("main")
+
+
+@contextmanager
+def run_lock(path: str):
+    """
+    Exclusive, non-blocking flock on `path` for the life of the run. The
+    kernel drops it when the process exits, so a crash never leaves a
+    stale lock behind.
+    """
+    with open(path, "a+") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.seek(0)
+            raise SystemExit(f"Another triage run holds {path} (pid {fh.read().strip() or '?'})")
+        fh.seek(0)
+        fh.truncate()
+        fh.write(f"{os.getpid()}\n")
+        fh.flush()
+        try:
+            yield
+        finally:
+            fh.seek(0)
+            fh.truncate()
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+async def _stream_triage(app, initial_state: EmailState) -> EmailState:
+    """
+    Drive the pipelined graph, printing per-batch progress as it arrives.
+    """
+    final_state = initial_state
+    async for kind, chunk in app.astream(initial_state, stream_mode=["custom", "values"]):
+        if kind == "values":
+            final_state = chunk
+            continue
+        done = " ".join(f"{k}={v}" for k, v in chunk["done"].items())
+        queues = " ".join(f"{k}={v}" for k, v in chunk["queues"].items())
+        print(f"[{chunk['elapsed']:7.2f}s] {chunk['stage']:<10} {done} | queues {queues}")
+    return final_state
+
+
+def _run_cycle(app, mode: str) -> EmailState:
+    initial_state: EmailState = {
+        "email_ids": [],
+        "categorized_ids": [],
+        "counters": {},
+        "notes": f"run started at {datetime.utcnow().isoformat()}",
+    }
+    if mode == "stream":
+        import asyncio
+
+        return asyncio.run(_stream_triage(app, initial_state))
+    return app.invoke(initial_state)
+
+
+def _print_stats():
+    from app.llm import llm_stats
+    from app.tools.gmail_calendar_tools import mcp_stats
+
+    stats = mcp_stats()
+    print(f"MCP: {stats['calls']} tool calls over {stats['handshakes']} session handshake(s)")
+    for backend in llm_stats():
+        print(
+            f"Ollama {backend['url']}: served={backend['served']} errors={backend['errors']}"
+            f"{' (ejected)' if backend['ejected'] else ''}"
+        )
+    if metrics.METRICS_ENABLED:
+        waited = metrics.time_breakdown()
+        print(
+            "Time in calls (summed over concurrent calls): "
+            + ", ".join(f"{source} {t['seconds']:.1f}s/{t['calls']}" for source, t in waited.items())
+        )
+
+
+def _write_metrics(path: str):
+    if not path or not metrics.METRICS_ENABLED:
+        return
+    try:
+        metrics.write(path)
+    except OSError as ex:
+        log.warning(f"Could not write metrics to {path}: {ex}")
+
+
+def run_triage(mode: str = "full", metrics_file: str = metrics.METRICS_FILE):
     """
     Run one triage cycle:
     - read emails via MCP Gmail
@@ -15,20 +119,85 @@ def run_triage(mode: str = "full"):
     - apply labels via MCP
     - block time on calendar
     - validate categories
+
+    mode="stream" pipelines the first four steps so each batch is labeled
+    as soon as it is categorized. Timings go to `metrics_file` at the end.
     """
-    app = build_app()
+    from app.graph import build_app
 
-    initial_state: EmailState = {
-        "emails": [],
-        "current_email_index": 0,
-        "notes": f"run started at {datetime.utcnow().isoformat()}",
-    }
+    app = build_app(streaming=mode == "stream")
 
-    # If later you want streaming, you can use app.astream(), for now invoke is fine
-    final_state = app.invoke(initial_state)
+    try:
+        final_state = _run_cycle(app, mode)
+    finally:
+        db.close_connection()
+        _write_metrics(metrics_file)
 
     print("✅ Triage run completed.")
     print(f"Notes: {final_state.get('notes', '')}")
+    print(f"Counters: {final_state.get('counters', {})}")
+    _print_stats()
+
+
+def watch(
+    mode: str = "full",
+    min_interval: float = WATCH_MIN_INTERVAL,
+    max_interval: float = WATCH_MAX_INTERVAL,
+    metrics_file: str = metrics.METRICS_FILE,
+):
+    """
+    Resident triage loop. The graph is compiled once and the MCP session,
+    SQLite connection, kNN index and the model loaded in Ollama stay warm
+    between cycles. Each cycle runs on a new event loop, so the async
+    Ollama clients are per loop (see app.llm.Backend.achat).
+    SIGINT/SIGTERM finish the current cycle and exit; a second signal
+    interrupts it. Metrics accumulate over cycles and
+    `metrics_file` is rewritten after each one.
+    """
+    stop = threading.Event()
+
+    def _on_signal(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print(f"[watch] {signal.Signals(signum).name}: stopping after the current cycle")
+        stop.set()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    signal.signal(signal.SIGTERM, _on_signal)
+
+    from app.graph import build_app
+
+    app = build_app(streaming=mode == "stream")
+    interval = min_interval
+    cycles = 0
+    try:
+        while not stop.is_set():
+            cycles += 1
+            started = time.perf_counter()
+            try:
+                final_state = _run_cycle(app, mode)
+            except Exception:
+                log.exception(f"[watch] cycle {cycles} failed")
+                interval = min(interval * 2, max_interval)
+                print(f"[watch] cycle {cycles} failed (see log); next poll in {interval:.0f}s")
+            else:
+                counters = final_state.get("counters") or {}
+                fetched = counters.get("fetched", 0)
+                interval = min_interval if fetched else min(interval * 2, max_interval)
+                log.info(final_state.get("notes", ""))
+                print(
+                    f"[watch] cycle {cycles}: fetched={fetched} "
+                    f"categorized={counters.get('categorized', 0)} "
+                    f"labeled={counters.get('labeled', 0)} in {time.perf_counter() - started:.1f}s; "
+                    f"next poll in {interval:.0f}s"
+                )
+            _write_metrics(metrics_file)
+            stop.wait(interval)
+    finally:
+        db.close_connection()
+
+    print(f"[watch] stopped after {cycles} cycle(s)")
+    _print_stats()
 
 
 def main():
@@ -37,27 +206,57 @@ def main():
         "command",
         nargs="?",
         default="triage",
-        choices=["triage"],
-        help="What to do. For now only 'triage' is supported.",
+        choices=["triage", "watch"],
+        help="triage: one run and exit; watch: keep running, polling for new mail.",
     )
     parser.add_argument(
         "--mode",
         default="full",
-        choices=["full"],
-        help="Future: run subsets (e.g., categorize-only, schedule-only).",
+        choices=["full", "stream"],
+        help="full: one step after another; stream: pipelined, labels appear as mail is categorized.",
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=WATCH_MIN_INTERVAL,
+        help="watch: seconds between polls while mail is arriving.",
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=WATCH_MAX_INTERVAL,
+        help="watch: longest wait between polls of an idle inbox.",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=metrics.METRICS_FILE,
+        help="write timings here at the end of the run: Prometheus text for *.prom, JSON otherwise.",
     )
 
     args = parser.parse_args()
 
     logging.basicConfig(
+        filename="agent.log",           # log file next to your script
         level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        format="%(asctime)s | %(levelname)s | %(message)s",
     )
+    # LOG_LEVEL=DEBUG adds sampled per-email lines (EMAIL_LOG_SAMPLE) from
+    # our own modules, without the HTTP client chatter
+    logging.getLogger("app").setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
-    if args.command == "triage":
-        run_triage(mode=args.mode)
-    else:
-        raise SystemExit(f"Unknown command: {args.command}")
+    lock_file = LOCK_FILE or os.path.splitext(db.DB_PATH)[0] + ".lock"
+    with run_lock(lock_file):
+        if args.command == "triage":
+            run_triage(mode=args.mode, metrics_file=args.metrics)
+        elif args.command == "watch":
+            watch(
+                mode=args.mode,
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                metrics_file=args.metrics,
+            )
+        else:
+            raise SystemExit(f"Unknown command: {args.command}")
 
 
 if __name__ == "__main__":